@@ -3,6 +3,18 @@ from typing import Optional
 import asyncpg
 from asyncpg.pool import Pool
 
+from .cache import PermissionCache
+
+# frequently used queries which are kept in the statement cache of every database connection,
+# see abrechnung.database.db_connect
+PREPARED_STATEMENTS: list[str] = []
+
+
+def prepared_statement(query: str) -> str:
+    """register a query to be prepared on every new database connection"""
+    PREPARED_STATEMENTS.append(query)
+    return query
+
 
 class NotFoundError(Exception):
     pass
@@ -13,8 +25,16 @@ class InvalidCommand(Exception):
 
 
 class Application:
-    def __init__(self, db_pool: Pool):
+    def __init__(
+        self, db_pool: Pool, permission_cache: Optional[PermissionCache] = None
+    ):
         self.db_pool = db_pool
+        self.permission_cache = permission_cache
+
+
+GROUP_PERMISSIONS_QUERY = prepared_statement(
+    "select is_owner, can_write from group_membership where group_id = $1 and user_id = $2"
+)
 
 
 async def check_group_permissions(
@@ -23,22 +43,30 @@ async def check_group_permissions(
     user_id: int,
     is_owner: bool = False,
     can_write: bool = False,
+    cache: Optional[PermissionCache] = None,
 ) -> tuple[bool, bool]:
-    membership = await conn.fetchrow(
-        "select is_owner, can_write from group_membership where group_id = $1 and user_id = $2",
-        group_id,
-        user_id,
-    )
+    membership = None if cache is None else cache.get_membership(user_id, group_id)
     if membership is None:
-        raise NotFoundError(f"group not found")
+        row = await conn.fetchrow(
+            GROUP_PERMISSIONS_QUERY,
+            group_id,
+            user_id,
+        )
+        if row is None:
+            raise NotFoundError(f"group not found")
+
+        membership = row["can_write"], row["is_owner"]
+        if cache is not None:
+            cache.set_membership(user_id, group_id, *membership)
 
-    if can_write and not (membership["is_owner"] or membership["can_write"]):
+    member_can_write, member_is_owner = membership
+    if can_write and not (member_is_owner or member_can_write):
         raise PermissionError(f"write access to group denied")
 
-    if is_owner and not membership["is_owner"]:
+    if is_owner and not member_is_owner:
         raise PermissionError(f"owner access to group denied")
 
-    return membership["can_write"], membership["is_owner"]
+    return member_can_write, member_is_owner
 
 
 async def create_group_log(
@@ -1,50 +1,131 @@
-from datetime import datetime, timezone
-from typing import Optional
+import logging
+from datetime import date, datetime, timezone
+from typing import Optional, AsyncIterator
 
-from abrechnung.domain.accounts import Account
+import asyncpg
+
+from abrechnung.domain.accounts import (
+    Account,
+    AccountBalance,
+    AccountBalanceHistory,
+    LedgerEntry,
+)
 from . import (
     Application,
     NotFoundError,
     check_group_permissions,
     InvalidCommand,
     create_group_log,
+    prepared_statement,
+)
+
+logger = logging.getLogger(__name__)
+
+# maximum absolute difference between a cached and a recomputed balance still considered equal
+BALANCE_DRIFT_TOLERANCE = 1e-6
+
+# periods the balance history can be aggregated by, as understood by date_trunc
+BALANCE_HISTORY_GRANULARITIES = ("day", "week", "month")
+
+# latest balance checkpoint of an account before the month of the given day
+_CHECKPOINT_BEFORE = (
+    "select c.balance from account_balance_checkpoint c "
+    "where c.account_id = {account_id} and c.month < date_trunc('month', {day}::date::timestamp)::date "
+    "order by c.month desc limit 1"
+)
+# the balance at the end of each day is the latest checkpoint before its month plus the running total of the
+# changes within the month, the balance at the end of a period is the one of its last day with changes
+BALANCE_HISTORY_QUERY = prepared_statement(
+    "select account_id, array_agg(period order by period) as periods, "
+    "   array_agg(balance order by period) as balances "
+    "from ("
+    "   select distinct on (account_id, period) account_id, period, balance "
+    "   from ("
+    "       select h.account_id, date_trunc($2, h.day::timestamp)::date as period, h.day, "
+    f"           coalesce(({_CHECKPOINT_BEFORE.format(account_id='h.account_id', day='h.day')}), 0) "
+    "           + sum(h.delta) over ("
+    "               partition by h.account_id, date_trunc('month', h.day::timestamp) order by h.day"
+    "           ) as balance "
+    "       from account_balance_history h "
+    "       where h.group_id = $1"
+    "   ) daily "
+    "   order by account_id, period, day desc"
+    ") periods "
+    "group by account_id "
+    "order by account_id"
+)
+
+
+# effects of the committed transaction states on the balance of an account
+LEDGER_QUERY = (
+    "select ts.transaction_id, ts.type, ts.billed_at, ts.details ->> 'description' as description, "
+    "   e.common_creditors as credit, e.common_debitors + e.positions as debit "
+    "from transaction_snapshot ts, transaction_balance_effects(ts.details) e "
+    "where ts.group_id = $1 and ts.pending_user_id is null "
+    "   and ts.involved_accounts @> array[$2::integer] and e.account_id = $2 "
 )
+# balance of an account before the given (billed_at, transaction_id) key, earlier months are taken from the
+# balance checkpoints and earlier days of the same month from the daily balance changes, only the transactions
+# on the same day have to be looked at
+LEDGER_BALANCE_BEFORE_QUERY = prepared_statement(
+    f"select coalesce(({_CHECKPOINT_BEFORE.format(account_id='$2', day='$3')}), 0) "
+    "+ coalesce(("
+    "   select sum(delta) from account_balance_history "
+    "   where account_id = $2 and day >= date_trunc('month', $3::date::timestamp)::date and day < $3"
+    "), 0) + coalesce(("
+    "   select sum(l.credit - l.debit) "
+    f"   from ({LEDGER_QUERY} and ts.billed_at = $3 and ts.transaction_id < $4) l"
+    "), 0)"
+)
+
+
+async def iter_accounts(
+    conn: asyncpg.Connection, group_id: int, user_id: int
+) -> AsyncIterator[Account]:
+    """iterate over all accounts of a group as seen by the given user, must be called within a transaction"""
+    cur = conn.cursor(
+        "select id, type, revision_id, name, description, priority "
+        "from latest_account "
+        "where group_id = $1 and user_id = $2 and deleted = false",
+        group_id,
+        user_id,
+    )
+    async for account in cur:
+        yield Account(
+            id=account["id"],
+            type=account["type"],
+            name=account["name"],
+            description=account["description"],
+            priority=account["priority"],
+            deleted=False,
+        )
 
 
 class AccountService(Application):
-    async def list_accounts(self, *, user_id: int, group_id: int) -> list[Account]:
+    async def list_accounts(
+        self, *, user_id: int, group_id: int
+    ) -> AsyncIterator[Account]:
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id
-                )
-                cur = conn.cursor(
-                    "select id, type, revision_id, name, description, priority "
-                    "from latest_account "
-                    "where group_id = $1 and user_id = $2 and deleted = false",
-                    group_id,
-                    user_id,
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
                 )
-                result = []
-                async for account in cur:
-                    result.append(
-                        Account(
-                            id=account["id"],
-                            type=account["type"],
-                            name=account["name"],
-                            description=account["description"],
-                            priority=account["priority"],
-                            deleted=False,
-                        )
-                    )
-
-                return result
+                async for account in iter_accounts(conn, group_id, user_id):
+                    yield account
 
     async def get_account(
         self, *, user_id: int, group_id: int, account_id: int
     ) -> Account:
         async with self.db_pool.acquire() as conn:
-            await check_group_permissions(conn=conn, group_id=group_id, user_id=user_id)
+            await check_group_permissions(
+                conn=conn,
+                group_id=group_id,
+                user_id=user_id,
+                cache=self.permission_cache,
+            )
             account = await conn.fetchrow(
                 "select id, type, revision_id, name, description, priority "
                 "from latest_account "
@@ -78,7 +159,11 @@ class AccountService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, can_write=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    can_write=True,
                 )
                 account_id = await conn.fetchval(
                     "insert into account (group_id, type) values ($1, $2) returning id",
@@ -125,7 +210,11 @@ class AccountService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, can_write=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    can_write=True,
                 )
                 account = await conn.fetchrow(
                     "select id, type, revision_id, name, description, priority "
@@ -179,7 +268,11 @@ class AccountService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, can_write=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    can_write=True,
                 )
 
                 n_committed_creditor = await conn.fetchval(
@@ -261,3 +354,174 @@ class AccountService(Application):
                     type="account-deleted",
                     message=f"deleted account account {row['name']}",
                 )
+
+    async def list_account_balances(
+        self, *, user_id: int, group_id: int, verify: bool = False
+    ) -> list[AccountBalance]:
+        """
+        committed balances of all accounts in a group as stored in the account balance cache.
+
+        If verify is set the balances are additionally recomputed from the committed transaction states.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+                if not verify:
+                    rows = await conn.fetch(
+                        "select a.id as account_id, coalesce(abc.balance, 0) as balance "
+                        "from account a "
+                        "left join account_balance_cache abc on abc.account_id = a.id "
+                        "where a.group_id = $1 "
+                        "order by a.id",
+                        group_id,
+                    )
+                    return [
+                        AccountBalance(
+                            account_id=row["account_id"], balance=row["balance"]
+                        )
+                        for row in rows
+                    ]
+
+                rows = await conn.fetch(
+                    "select a.id as account_id, coalesce(abc.balance, 0) as balance, "
+                    "   coalesce(cab.balance, 0) as computed_balance "
+                    "from account a "
+                    "left join account_balance_cache abc on abc.account_id = a.id "
+                    "left join compute_account_balances($1) cab on cab.account_id = a.id "
+                    "where a.group_id = $1 "
+                    "order by a.id",
+                    group_id,
+                )
+                balances = [
+                    AccountBalance(
+                        account_id=row["account_id"],
+                        balance=row["balance"],
+                        computed_balance=row["computed_balance"],
+                    )
+                    for row in rows
+                ]
+                for balance in balances:
+                    drift = balance.balance - balance.computed_balance
+                    if abs(drift) > BALANCE_DRIFT_TOLERANCE:
+                        logger.warning(
+                            f"cached balance of account {balance.account_id} in group {group_id} "
+                            f"drifted by {drift} from the recomputed balance"
+                        )
+
+                return balances
+
+    async def list_account_balance_history(
+        self, *, user_id: int, group_id: int, granularity: str = "day"
+    ) -> list[AccountBalanceHistory]:
+        """
+        committed balances of all accounts in a group at the end of each day, week or month
+        in which they changed according to the billing dates of the transactions.
+
+        Aggregated from the daily balance changes maintained alongside the account balance cache.
+        """
+        if granularity not in BALANCE_HISTORY_GRANULARITIES:
+            raise InvalidCommand(
+                f"granularity must be one of {', '.join(BALANCE_HISTORY_GRANULARITIES)}"
+            )
+
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+                rows = await conn.fetch(BALANCE_HISTORY_QUERY, group_id, granularity)
+                return [
+                    AccountBalanceHistory(
+                        account_id=row["account_id"],
+                        periods=row["periods"],
+                        balances=row["balances"],
+                    )
+                    for row in rows
+                ]
+
+    async def list_account_ledger(
+        self,
+        *,
+        user_id: int,
+        group_id: int,
+        account_id: int,
+        limit: int,
+        after: Optional[tuple[date, int]] = None,
+        descending: bool = False,
+    ) -> tuple[list[LedgerEntry], Optional[tuple[date, int]]]:
+        """
+        list one page of the committed transactions affecting the balance of an account
+        ordered by (billed_at, id), together with the balance of the account after each of them.
+
+        Returns the entries and the (billed_at, id) key to pass as 'after' to fetch the next page,
+        None if this is the last page.
+        """
+        direction = "desc" if descending else "asc"
+        query = LEDGER_QUERY
+        args: list = [group_id, account_id]
+        if after is not None:
+            query += f"and (ts.billed_at, ts.transaction_id) {'<' if descending else '>'} ($3, $4) "
+            args.extend(after)
+        # fetch one more row than requested to know whether there is a next page
+        args.append(limit + 1)
+        query += (
+            f"order by ts.billed_at {direction}, ts.transaction_id {direction} "
+            f"limit ${len(args)}"
+        )
+
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+                account_group_id = await conn.fetchval(
+                    "select group_id from account where id = $1", account_id
+                )
+                if account_group_id != group_id:
+                    raise NotFoundError(f"account not found")
+
+                page = await conn.fetch(query, *args)
+                next_key = None
+                if len(page) > limit:
+                    page = page[:limit]
+                    next_key = (page[-1]["billed_at"], page[-1]["transaction_id"])
+                if not page:
+                    return [], None
+
+                rows = list(reversed(page)) if descending else page
+                balance = await conn.fetchval(
+                    LEDGER_BALANCE_BEFORE_QUERY,
+                    group_id,
+                    account_id,
+                    rows[0]["billed_at"],
+                    rows[0]["transaction_id"],
+                )
+                entries = []
+                for row in rows:
+                    balance += row["credit"] - row["debit"]
+                    entries.append(
+                        LedgerEntry(
+                            transaction_id=row["transaction_id"],
+                            type=row["type"],
+                            description=row["description"],
+                            billed_at=row["billed_at"],
+                            credit=row["credit"],
+                            debit=row["debit"],
+                            balance=balance,
+                        )
+                    )
+
+                if descending:
+                    entries.reverse()
+                return entries, next_key
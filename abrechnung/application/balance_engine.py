@@ -0,0 +1,268 @@
+"""
+in-process counterpart of the transaction_balance_effects database function.
+
+All committed transactions of a group are loaded into sparse transactions x accounts matrices such that the
+balance effects of every transaction on every account are computed by a handful of vectorized operations.
+"""
+
+from dataclasses import dataclass
+
+import asyncpg
+import numpy as np
+from scipy import sparse
+
+from abrechnung.domain.transactions import TransactionAccountBalance
+
+# all queries read the committed, not deleted transaction states of a group as stored in transaction_snapshot.
+# they are not registered as prepared statements as no service uses the engine
+_PURCHASE_ITEMS = (
+    "jsonb_array_elements(case "
+    "   when jsonb_typeof(ts.details -> 'purchase_items') = 'array' then ts.details -> 'purchase_items' "
+    "   else '[]'::jsonb "
+    "end) pi"
+)
+
+GROUP_ACCOUNTS_QUERY = "select id from account where group_id = $1 order by id"
+GROUP_TRANSACTIONS_QUERY = (
+    "select ts.transaction_id, (ts.details ->> 'value')::double precision as value, "
+    "   (ts.details ->> 'currency_conversion_rate')::double precision as currency_conversion_rate "
+    "from transaction_snapshot ts "
+    "where ts.group_id = $1 and ts.pending_user_id is null and not ts.deleted "
+    "order by ts.transaction_id"
+)
+GROUP_SHARES_QUERY = {
+    share_type: (
+        "select ts.transaction_id, (s ->> 'account_id')::integer as account_id, "
+        "   (s ->> 'shares')::double precision as shares "
+        f"from transaction_snapshot ts, jsonb_array_elements(ts.details -> '{share_type}') s "
+        "where ts.group_id = $1 and ts.pending_user_id is null and not ts.deleted"
+    )
+    for share_type in ("creditor_shares", "debitor_shares")
+}
+GROUP_PURCHASE_ITEMS_QUERY = (
+    "select ts.transaction_id, (pi ->> 'id')::integer as item_id, "
+    "   (pi ->> 'price')::double precision as price, "
+    "   (pi ->> 'communist_shares')::double precision as communist_shares "
+    f"from transaction_snapshot ts, {_PURCHASE_ITEMS} "
+    "where ts.group_id = $1 and ts.pending_user_id is null and not ts.deleted "
+    "   and not (pi ->> 'deleted')::bool "
+    "order by item_id"
+)
+GROUP_PURCHASE_ITEM_USAGES_QUERY = (
+    "select (pi ->> 'id')::integer as item_id, (u ->> 'account_id')::integer as account_id, "
+    "   (u ->> 'share_amount')::double precision as share_amount "
+    f"from transaction_snapshot ts, {_PURCHASE_ITEMS}, jsonb_array_elements(pi -> 'usages') u "
+    "where ts.group_id = $1 and ts.pending_user_id is null and not ts.deleted "
+    "   and not (pi ->> 'deleted')::bool"
+)
+
+
+@dataclass
+class GroupShares:
+    """the committed transactions of a group, rows and columns are ordered by transaction and account id"""
+
+    account_ids: np.ndarray
+    transaction_ids: np.ndarray
+    # per transaction, in the transaction currency
+    values: np.ndarray
+    currency_conversion_rates: np.ndarray
+    # transactions x accounts
+    creditor_shares: sparse.csr_matrix
+    debitor_shares: sparse.csr_matrix
+    # per purchase item, the row of the transaction it belongs to
+    item_transactions: np.ndarray
+    item_prices: np.ndarray
+    item_communist_shares: np.ndarray
+    # purchase items x accounts
+    item_usages: sparse.csr_matrix
+
+
+def _index(ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """positions of the given ids in the sorted ids array"""
+    return np.searchsorted(ids, values)
+
+
+def _column(rows: list[asyncpg.Record], name: str, dtype) -> np.ndarray:
+    return np.fromiter((row[name] for row in rows), dtype=dtype, count=len(rows))
+
+
+def _matrix(
+    row_ids: np.ndarray,
+    column_ids: np.ndarray,
+    rows: list[asyncpg.Record],
+    row_name: str,
+    column_name: str,
+    value_name: str,
+) -> sparse.csr_matrix:
+    return sparse.csr_matrix(
+        (
+            _column(rows, value_name, np.float64),
+            (
+                _index(row_ids, _column(rows, row_name, np.int64)),
+                _index(column_ids, _column(rows, column_name, np.int64)),
+            ),
+        ),
+        shape=(len(row_ids), len(column_ids)),
+    )
+
+
+async def load_group_shares(conn: asyncpg.Connection, group_id: int) -> GroupShares:
+    """
+    load the committed transactions of a group,
+    must be called within a repeatable read transaction to get a consistent state
+    """
+    account_ids = _column(
+        await conn.fetch(GROUP_ACCOUNTS_QUERY, group_id), "id", np.int64
+    )
+    transactions = await conn.fetch(GROUP_TRANSACTIONS_QUERY, group_id)
+    transaction_ids = _column(transactions, "transaction_id", np.int64)
+    shares = {
+        share_type: _matrix(
+            transaction_ids,
+            account_ids,
+            await conn.fetch(query, group_id),
+            "transaction_id",
+            "account_id",
+            "shares",
+        )
+        for share_type, query in GROUP_SHARES_QUERY.items()
+    }
+    items = await conn.fetch(GROUP_PURCHASE_ITEMS_QUERY, group_id)
+    item_ids = _column(items, "item_id", np.int64)
+
+    return GroupShares(
+        account_ids=account_ids,
+        transaction_ids=transaction_ids,
+        values=_column(transactions, "value", np.float64),
+        currency_conversion_rates=_column(
+            transactions, "currency_conversion_rate", np.float64
+        ),
+        creditor_shares=shares["creditor_shares"],
+        debitor_shares=shares["debitor_shares"],
+        item_transactions=_index(
+            transaction_ids, _column(items, "transaction_id", np.int64)
+        ),
+        item_prices=_column(items, "price", np.float64),
+        item_communist_shares=_column(items, "communist_shares", np.float64),
+        item_usages=_matrix(
+            item_ids,
+            account_ids,
+            await conn.fetch(GROUP_PURCHASE_ITEM_USAGES_QUERY, group_id),
+            "item_id",
+            "account_id",
+            "share_amount",
+        ),
+    )
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """element wise a / b, 0 where b is 0"""
+    return np.divide(a, b, out=np.zeros_like(a), where=b != 0)
+
+
+def _row_sums(matrix: sparse.spmatrix) -> np.ndarray:
+    return np.asarray(matrix.sum(axis=1)).ravel()
+
+
+class BalanceEffects:
+    """
+    the effects of all committed transactions of a group on the account balances, in the group currency.
+    Each part is a sparse transactions x accounts matrix.
+    """
+
+    def __init__(self, shares: GroupShares):
+        self.account_ids = shares.account_ids
+        self.transaction_ids = shares.transaction_ids
+
+        n_transactions, n_items = len(shares.transaction_ids), len(shares.item_prices)
+        # transactions x purchase items
+        transaction_items = sparse.csr_matrix(
+            (
+                np.ones(n_items),
+                (shares.item_transactions, np.arange(n_items)),
+            ),
+            shape=(n_transactions, n_items),
+        )
+
+        # purchase items are billed to the accounts using them, the part of an item
+        # corresponding to its communist shares remains to be billed to the debitors
+        item_total_usages = shares.item_communist_shares + _row_sums(shares.item_usages)
+        item_price_per_usage = _divide(shares.item_prices, item_total_usages)
+        item_covered = shares.item_prices - item_price_per_usage * (
+            shares.item_communist_shares
+        )
+        remaining = shares.values - transaction_items @ item_covered
+
+        rates = shares.currency_conversion_rates
+        self.positions: sparse.csr_matrix = (
+            sparse.diags(rates)
+            @ transaction_items
+            @ sparse.diags(item_price_per_usage)
+            @ shares.item_usages
+        ).tocsr()
+        self.common_creditors: sparse.csr_matrix = (
+            sparse.diags(
+                _divide(shares.values * rates, _row_sums(shares.creditor_shares))
+            )
+            @ shares.creditor_shares
+        ).tocsr()
+        self.common_debitors: sparse.csr_matrix = (
+            sparse.diags(_divide(remaining * rates, _row_sums(shares.debitor_shares)))
+            @ shares.debitor_shares
+        ).tocsr()
+
+    def transaction_balances(self) -> sparse.csr_matrix:
+        """transactions x accounts matrix of the balance changes caused by each transaction"""
+        return self.common_creditors - self.positions - self.common_debitors
+
+    def account_balances(self) -> dict[int, float]:
+        balances = np.asarray(self.transaction_balances().sum(axis=0)).ravel()
+        return dict(zip(self.account_ids.tolist(), balances.tolist()))
+
+    def transaction_breakdown(
+        self, transaction_id: int
+    ) -> dict[int, TransactionAccountBalance]:
+        """balance effects of a single transaction on each account involved in it"""
+        row = _index(self.transaction_ids, np.array([transaction_id]))[0]
+        if (
+            row >= len(self.transaction_ids)
+            or self.transaction_ids[row] != transaction_id
+        ):
+            return {}
+
+        parts = [
+            part.getrow(row).toarray().ravel()
+            for part in (self.common_creditors, self.positions, self.common_debitors)
+        ]
+        involved = np.flatnonzero(np.any(np.stack(parts) != 0, axis=0))
+        return {
+            int(self.account_ids[i]): TransactionAccountBalance(
+                common_creditors=float(parts[0][i]),
+                positions=float(parts[1][i]),
+                common_debitors=float(parts[2][i]),
+            )
+            for i in involved
+        }
+
+    def pairwise_debts(self) -> sparse.csr_matrix:
+        """
+        accounts x accounts matrix of the amount each account owes to each other account, netted per pair.
+
+        Whatever an account is billed for in a transaction is owed to the creditors of that
+        transaction in proportion to their creditor shares.
+        """
+        creditor_fractions = (
+            sparse.diags(
+                _divide(
+                    np.ones(len(self.transaction_ids)), _row_sums(self.common_creditors)
+                )
+            )
+            @ self.common_creditors
+        )
+        billed = self.positions + self.common_debitors
+        debts = (billed.T @ creditor_fractions).tocsr()
+        # the diagonal cancels out as well
+        net = (debts - debts.T).tocsr()
+        net.data[net.data < 0] = 0
+        net.eliminate_zeros()
+        return net
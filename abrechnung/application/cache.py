@@ -0,0 +1,248 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+
+import asyncpg
+
+from abrechnung.domain.settlement import Settlement
+
+logger = logging.getLogger(__name__)
+
+
+class PermissionCache:
+    """
+    process local cache of group memberships and of the group and type of transactions.
+
+    Only existing memberships are cached, changes to them are announced by the database on the
+    GROUP_MEMBERSHIP_CHANNEL notification channel. In case notifications get lost, entries
+    expire after ttl seconds.
+    """
+
+    GROUP_MEMBERSHIP_CHANNEL = "group_membership_changed"
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # (user_id, group_id) -> (can_write, is_owner, valid until)
+        self._memberships: dict[tuple[int, int], tuple[bool, bool, float]] = {}
+        # transaction_id -> (group_id, transaction type), transactions never move between groups
+        self._transactions: dict[int, tuple[int, str]] = {}
+
+        # membership lookups
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # transaction lookups
+        self.transaction_hits = 0
+        self.transaction_misses = 0
+
+    def get_membership(
+        self, user_id: int, group_id: int
+    ) -> Optional[tuple[bool, bool]]:
+        """returns the can_write and is_owner flags of a group membership if it is cached"""
+        entry = self._memberships.get((user_id, group_id))
+        if entry is None or entry[2] < time.monotonic():
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry[0], entry[1]
+
+    def set_membership(
+        self, user_id: int, group_id: int, can_write: bool, is_owner: bool
+    ):
+        if len(self._memberships) >= self.max_size:
+            self._memberships.clear()
+        self._memberships[(user_id, group_id)] = (
+            can_write,
+            is_owner,
+            time.monotonic() + self.ttl,
+        )
+
+    def invalidate_membership(self, user_id: int, group_id: int):
+        self.invalidations += 1
+        self._memberships.pop((user_id, group_id), None)
+
+    def invalidate_group(self, group_id: int):
+        self.invalidations += 1
+        for key in [key for key in self._memberships if key[1] == group_id]:
+            del self._memberships[key]
+
+    def get_transaction(self, transaction_id: int) -> Optional[tuple[int, str]]:
+        """returns the group id and type of a transaction if it is cached"""
+        entry = self._transactions.get(transaction_id)
+        if entry is None:
+            self.transaction_misses += 1
+        else:
+            self.transaction_hits += 1
+        return entry
+
+    def set_transaction(self, transaction_id: int, group_id: int, type: str):
+        if len(self._transactions) >= self.max_size:
+            self._transactions.clear()
+        self._transactions[transaction_id] = (group_id, type)
+
+    def clear(self):
+        self._memberships.clear()
+        self._transactions.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "memberships": len(self._memberships),
+            "transaction_hits": self.transaction_hits,
+            "transaction_misses": self.transaction_misses,
+            "transactions": len(self._transactions),
+        }
+
+    def on_membership_notification(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ):
+        """asyncpg listener callback for the GROUP_MEMBERSHIP_CHANNEL notification channel"""
+        del connection, pid, channel  # unused
+
+        try:
+            data = json.loads(payload)
+            self.invalidate_membership(
+                user_id=data["user_id"], group_id=data["group_id"]
+            )
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logger.warning(
+                f"Received invalid group membership notification {payload}, clearing permission cache"
+            )
+            self.clear()
+
+
+class SessionCache:
+    """
+    process local cache of validated login sessions, keyed by (session_id, user_id).
+
+    Removed sessions are announced by the database on the SESSION_CHANNEL notification channel.
+    Entries expire after ttl seconds or when the session itself expires, whichever comes first.
+    """
+
+    SESSION_CHANNEL = "session_changed"
+
+    def __init__(self, ttl: float = 60.0, max_size: int = 100000):
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # (session_id, user_id) -> valid until
+        self._sessions: dict[tuple[int, int], float] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def is_valid(self, session_id: int, user_id: int) -> bool:
+        """returns true if the session is cached as valid"""
+        valid_until = self._sessions.get((session_id, user_id))
+        if valid_until is None or valid_until < time.monotonic():
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def set_valid(
+        self,
+        session_id: int,
+        user_id: int,
+        valid_until: Optional[datetime] = None,
+    ):
+        ttl = self.ttl
+        if valid_until is not None:
+            ttl = min(
+                ttl, (valid_until - datetime.now(tz=timezone.utc)).total_seconds()
+            )
+        if ttl <= 0:
+            return
+
+        if len(self._sessions) >= self.max_size:
+            self._sessions.clear()
+        self._sessions[(session_id, user_id)] = time.monotonic() + ttl
+
+    def invalidate(self, session_id: int, user_id: int):
+        self.invalidations += 1
+        self._sessions.pop((session_id, user_id), None)
+
+    def clear(self):
+        self._sessions.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "sessions": len(self._sessions),
+        }
+
+    def on_session_notification(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ):
+        """asyncpg listener callback for the SESSION_CHANNEL notification channel"""
+        del connection, pid, channel  # unused
+
+        try:
+            data = json.loads(payload)
+            self.invalidate(session_id=data["session_id"], user_id=data["user_id"])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            logger.warning(
+                f"Received invalid session notification {payload}, clearing session cache"
+            )
+            self.clear()
+
+
+class SettlementCache:
+    """
+    process local cache of the settlements of the most recently requested groups.
+
+    A settlement is computed from the committed account balances and stays valid as long as the
+    change sequence number of its group does not advance, hence entries never have to be invalidated.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+
+        # (group_id, exact) -> settlement, least recently used first
+        self._settlements: OrderedDict[tuple[int, Optional[bool]], Settlement] = (
+            OrderedDict()
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, group_id: int, exact: Optional[bool], change_seq: int
+    ) -> Optional[Settlement]:
+        """returns the settlement of a group if it was computed at the given change sequence number"""
+        settlement = self._settlements.get((group_id, exact))
+        if settlement is None or settlement.change_seq != change_seq:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._settlements.move_to_end((group_id, exact))
+        return settlement
+
+    def set(self, group_id: int, exact: Optional[bool], settlement: Settlement):
+        self._settlements[(group_id, exact)] = settlement
+        self._settlements.move_to_end((group_id, exact))
+        while len(self._settlements) > self.max_size:
+            self._settlements.popitem(last=False)
+
+    def clear(self):
+        self._settlements.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "settlements": len(self._settlements),
+        }
@@ -0,0 +1,64 @@
+from dataclasses import dataclass
+from datetime import timedelta
+
+import asyncpg
+
+from . import prepared_statement
+
+# channel on which the database announces new change feed entries, see notify_group
+CHANGE_FEED_CHANNEL = "change_feed"
+
+CHANGE_FEED_QUERY = prepared_statement(
+    "select group_id, seq, event, element_id, data from change_feed "
+    "where group_id = $1 and seq > $2 order by seq"
+)
+CHANGE_FEED_SEQ_QUERY = prepared_statement(
+    "select seq, pruned_seq from group_change_sequence where group_id = $1"
+)
+
+
+@dataclass
+class ChangeFeedEntry:
+    group_id: int
+    seq: int
+    event: str
+    element_id: int
+    data: dict
+
+
+async def read_change_feed(
+    conn: asyncpg.Connection, group_id: int, last_seq: int
+) -> list[ChangeFeedEntry]:
+    """all change feed entries of a group after the given sequence number"""
+    rows = await conn.fetch(CHANGE_FEED_QUERY, group_id, last_seq)
+    return [
+        ChangeFeedEntry(
+            group_id=row["group_id"],
+            seq=row["seq"],
+            event=row["event"],
+            element_id=row["element_id"],
+            data=row["data"],
+        )
+        for row in rows
+    ]
+
+
+async def can_resume_change_feed(
+    conn: asyncpg.Connection, group_id: int, last_seq: int
+) -> bool:
+    """
+    check whether all changes to a group after the given sequence number are still in the change feed
+    """
+    row = await conn.fetchrow(CHANGE_FEED_SEQ_QUERY, group_id)
+    seq, pruned_seq = (0, 0) if row is None else (row["seq"], row["pruned_seq"])
+    return pruned_seq <= last_seq <= seq
+
+
+async def current_change_feed_seq(conn: asyncpg.Connection, group_id: int) -> int:
+    """sequence number of the latest change feed entry of a group visible to the current transaction"""
+    row = await conn.fetchrow(CHANGE_FEED_SEQ_QUERY, group_id)
+    return 0 if row is None else row["seq"]
+
+
+async def prune_change_feed(conn: asyncpg.Connection, retention: timedelta):
+    await conn.execute("call prune_change_feed($1)", retention)
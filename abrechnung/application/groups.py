@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import AsyncIterator
 
 import asyncpg
 
@@ -18,6 +19,30 @@ from abrechnung.domain.groups import (
 )
 
 
+async def iter_group_members(
+    conn: asyncpg.Connection, group_id: int
+) -> AsyncIterator[GroupMember]:
+    """iterate over all members of a group, must be called within a transaction"""
+    cur = conn.cursor(
+        "select usr.id, usr.username, gm.is_owner, gm.can_write, gm.description, "
+        "gm.invited_by, gm.joined_at "
+        "from usr "
+        "join group_membership gm on gm.user_id = usr.id "
+        "where gm.group_id = $1",
+        group_id,
+    )
+    async for member in cur:
+        yield GroupMember(
+            user_id=member["id"],
+            username=member["username"],
+            is_owner=member["is_owner"],
+            can_write=member["can_write"],
+            invited_by=member["invited_by"],
+            joined_at=member["joined_at"],
+            description=member["description"],
+        )
+
+
 class GroupService(Application):
     async def create_group(
         self,
@@ -72,7 +97,11 @@ class GroupService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, can_write=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    can_write=True,
                 )
                 await create_group_log(
                     conn=conn, group_id=group_id, user_id=user_id, type="invite-created"
@@ -97,7 +126,11 @@ class GroupService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, can_write=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    can_write=True,
                 )
                 deleted_id = await conn.fetchval(
                     "delete from group_invite where id = $1 and group_id = $2 returning id",
@@ -169,7 +202,12 @@ class GroupService(Application):
 
     async def get_group(self, *, user_id: int, group_id: int) -> Group:
         async with self.db_pool.acquire() as conn:
-            await check_group_permissions(conn=conn, group_id=group_id, user_id=user_id)
+            await check_group_permissions(
+                conn=conn,
+                group_id=group_id,
+                user_id=user_id,
+                cache=self.permission_cache,
+            )
             group = await conn.fetchrow(
                 "select id, name, description, terms, currency_symbol, created_at, created_by "
                 "from grp "
@@ -202,7 +240,11 @@ class GroupService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, is_owner=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    is_owner=True,
                 )
                 await conn.execute(
                     "update grp set name = $2, description = $3, currency_symbol = $4, terms = $5 "
@@ -237,7 +279,11 @@ class GroupService(Application):
                 can_write = can_write if not is_owner else True
 
                 user_can_write, user_is_owner = await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, can_write=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    can_write=True,
                 )
                 membership = await conn.fetchrow(
                     "select is_owner, can_write from group_membership where group_id = $1 and user_id = $2",
@@ -309,11 +355,18 @@ class GroupService(Application):
                     is_owner,
                 )
 
+        # other processes are notified by the database once the transaction has been committed
+        self._invalidate_cached_membership(user_id=member_id, group_id=group_id)
+
     async def delete_group(self, *, user_id: int, group_id: int):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, is_owner=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    is_owner=True,
                 )
 
                 n_members = await conn.fetchval(
@@ -327,11 +380,16 @@ class GroupService(Application):
 
                 await conn.execute("delete from grp where id = $1", group_id)
 
+        self._invalidate_cached_membership(user_id=user_id, group_id=group_id)
+
     async def leave_group(self, *, user_id: int, group_id: int):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
                 )
 
                 n_members = await conn.fetchval(
@@ -348,6 +406,26 @@ class GroupService(Application):
                         group_id,
                         user_id,
                     )
+                    # pending changes of users who are not part of the group anymore are not visible
+                    transaction_ids = await conn.fetch(
+                        "select transaction_id from transaction_snapshot ts "
+                        "where ts.group_id = $1 and ts.pending_user_id = $2",
+                        group_id,
+                        user_id,
+                    )
+                    for row in transaction_ids:
+                        await conn.execute(
+                            "call refresh_transaction_snapshot($1)",
+                            row["transaction_id"],
+                        )
+
+        self._invalidate_cached_membership(user_id=user_id, group_id=group_id)
+
+    def _invalidate_cached_membership(self, user_id: int, group_id: int):
+        if self.permission_cache is not None:
+            self.permission_cache.invalidate_membership(
+                user_id=user_id, group_id=group_id
+            )
 
     async def preview_group(self, invite_token: str) -> GroupPreview:
         async with self.db_pool.acquire() as conn:
@@ -380,7 +458,10 @@ class GroupService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
                 )
                 cur = conn.cursor(
                     "select id, case when created_by = $1 then token else null end as token, description, created_by, "
@@ -408,36 +489,21 @@ class GroupService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id
-                )
-                cur = conn.cursor(
-                    "select usr.id, usr.username, gm.is_owner, gm.can_write, gm.description, "
-                    "gm.invited_by, gm.joined_at "
-                    "from usr "
-                    "join group_membership gm on gm.user_id = usr.id "
-                    "where gm.group_id = $1",
-                    group_id,
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
                 )
-                result = []
-                async for group in cur:
-                    result.append(
-                        GroupMember(
-                            user_id=group["id"],
-                            username=group["username"],
-                            is_owner=group["is_owner"],
-                            can_write=group["can_write"],
-                            invited_by=group["invited_by"],
-                            joined_at=group["joined_at"],
-                            description=group["description"],
-                        )
-                    )
-                return result
+                return [member async for member in iter_group_members(conn, group_id)]
 
-    async def list_log(self, *, user_id: int, group_id: int) -> list[GroupLog]:
+    async def list_log(self, *, user_id: int, group_id: int) -> AsyncIterator[GroupLog]:
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
                 )
                 cur = conn.cursor(
                     "select id, user_id, logged_at, type, message, affected "
@@ -446,25 +512,25 @@ class GroupService(Application):
                     group_id,
                 )
 
-                result = []
                 async for log in cur:
-                    result.append(
-                        GroupLog(
-                            id=log["id"],
-                            user_id=log["user_id"],
-                            logged_at=log["logged_at"],
-                            type=log["type"],
-                            message=log["message"],
-                            affected=log["affected"],
-                        )
+                    yield GroupLog(
+                        id=log["id"],
+                        user_id=log["user_id"],
+                        logged_at=log["logged_at"],
+                        type=log["type"],
+                        message=log["message"],
+                        affected=log["affected"],
                     )
-                return result
 
     async def send_group_message(self, *, user_id: int, group_id: int, message: str):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id, can_write=True
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                    can_write=True,
                 )
                 await conn.execute(
                     "insert into group_log (group_id, user_id, type, message) "
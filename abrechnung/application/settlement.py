@@ -0,0 +1,141 @@
+import heapq
+from typing import Optional
+
+from abrechnung.domain.settlement import Settlement, SettlementTransfer
+
+# balances are settled in cents, smaller remainders are considered to be settled
+SETTLEMENT_PRECISION = 100
+# the exact solution is exponential in the number of unsettled accounts
+EXACT_SETTLEMENT_MAX_ACCOUNTS = 12
+
+
+def _to_cents(balances: dict[int, float]) -> dict[int, int]:
+    cents = {
+        account_id: round(balance * SETTLEMENT_PRECISION)
+        for account_id, balance in balances.items()
+    }
+    return {account_id: value for account_id, value in cents.items() if value != 0}
+
+
+def _greedy_transfers(balances: dict[int, int]) -> list[SettlementTransfer]:
+    """
+    settle balances given in cents by repeatedly letting the largest debtor pay the largest creditor.
+
+    Every transfer settles at least one account, hence at most n - 1 transfers are needed for n accounts.
+    """
+    # heapq is a min heap, the largest amounts come first when negated
+    debtors = [
+        (balance, account_id) for account_id, balance in balances.items() if balance < 0
+    ]
+    creditors = [
+        (-balance, account_id)
+        for account_id, balance in balances.items()
+        if balance > 0
+    ]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+
+    transfers = []
+    while debtors and creditors:
+        debt, debtor_id = heapq.heappop(debtors)
+        credit, creditor_id = heapq.heappop(creditors)
+        amount = min(-debt, -credit)
+        transfers.append(
+            SettlementTransfer(
+                from_account_id=debtor_id,
+                to_account_id=creditor_id,
+                amount=amount / SETTLEMENT_PRECISION,
+            )
+        )
+        if debt + amount < 0:
+            heapq.heappush(debtors, (debt + amount, debtor_id))
+        if credit + amount < 0:
+            heapq.heappush(creditors, (credit + amount, creditor_id))
+
+    return transfers
+
+
+def _zero_sum_partition(balances: dict[int, int]) -> list[dict[int, int]]:
+    """
+    split the accounts into the maximum number of groups whose balances sum up to zero.
+
+    A group of k accounts can always be settled with k - 1 transfers, therefore settling each group on its own
+    results in the minimal number of transfers overall. Dynamic programming over all subsets of accounts.
+    """
+    account_ids = list(balances.keys())
+    n = len(account_ids)
+    full = (1 << n) - 1
+
+    sums = [0] * (full + 1)
+    # max_groups[mask] is the maximum number of zero sum groups the accounts in mask can be split into,
+    # not counting a remainder which does not sum up to zero
+    max_groups = [0] * (full + 1)
+    for mask in range(1, full + 1):
+        lowest = mask & -mask
+        sums[mask] = (
+            sums[mask ^ lowest] + balances[account_ids[lowest.bit_length() - 1]]
+        )
+        best = 0
+        for i in range(n):
+            if mask & (1 << i):
+                best = max(best, max_groups[mask ^ (1 << i)])
+        max_groups[mask] = best + (1 if sums[mask] == 0 else 0)
+
+    # walk back from the full set, removing one account at a time without losing a group
+    order = []
+    mask = full
+    while mask:
+        for i in range(n):
+            bit = 1 << i
+            if (
+                mask & bit
+                and max_groups[mask ^ bit] + (1 if sums[mask] == 0 else 0)
+                == max_groups[mask]
+            ):
+                order.append(i)
+                mask ^= bit
+                break
+
+    # the accounts in the order they were removed in reverse form the groups between zero sum prefixes
+    groups = []
+    current: dict[int, int] = {}
+    total = 0
+    for i in reversed(order):
+        current[account_ids[i]] = balances[account_ids[i]]
+        total += balances[account_ids[i]]
+        if total == 0:
+            groups.append(current)
+            current = {}
+    if current:
+        groups.append(current)
+
+    return groups
+
+
+def plan_settlement(
+    balances: dict[int, float], change_seq: int, exact: Optional[bool] = None
+) -> Settlement:
+    """
+    compute transfers which settle the given account balances.
+
+    Balances are positive for accounts which are owed money. By default the number of transfers is only
+    guaranteed to be minimal for groups with few unsettled accounts, larger groups are settled greedily.
+    """
+    cents = _to_cents(balances)
+    if exact is None:
+        exact = len(cents) <= EXACT_SETTLEMENT_MAX_ACCOUNTS
+    elif exact and len(cents) > EXACT_SETTLEMENT_MAX_ACCOUNTS:
+        raise ValueError(
+            f"exact settlements are limited to {EXACT_SETTLEMENT_MAX_ACCOUNTS} unsettled accounts"
+        )
+
+    if exact:
+        transfers = [
+            transfer
+            for group in _zero_sum_partition(cents)
+            for transfer in _greedy_transfers(group)
+        ]
+    else:
+        transfers = _greedy_transfers(cents)
+
+    return Settlement(change_seq=change_seq, exact=exact, transfers=transfers)
@@ -1,8 +1,9 @@
 import json
-from typing import Optional, Union
+from typing import Optional, Union, AsyncIterator
 from datetime import date
 
 import asyncpg
+from asyncpg.pool import Pool
 
 from abrechnung.application import (
     Application,
@@ -10,15 +11,80 @@ from abrechnung.application import (
     check_group_permissions,
     InvalidCommand,
     create_group_log,
+    prepared_statement,
 )
+from abrechnung.application.cache import PermissionCache, SettlementCache
+from abrechnung.application.change_feed import current_change_feed_seq
+from abrechnung.application.settlement import plan_settlement
+from abrechnung.domain.settlement import Settlement
 from abrechnung.domain.transactions import (
     Transaction,
+    TransactionAccountBalance,
     TransactionDetails,
     PurchaseItem,
+    NewTransaction,
+    TransactionType,
 )
 
+TRANSACTION_PERMISSIONS_QUERY = prepared_statement(
+    "select t.type, t.group_id, can_write, is_owner "
+    "from group_membership gm join transaction t on gm.group_id = t.group_id and gm.user_id = $1 where t.id = $2"
+)
+TRANSACTION_GROUP_QUERY = prepared_statement(
+    "select group_id, type from transaction where id = $1"
+)
+# transaction_snapshot rows together with the account balances stored for committed states
+TRANSACTION_SNAPSHOT_SELECT = (
+    "select ts.transaction_id, ts.type, ts.pending_user_id, ts.details, rab.account_balances "
+    "from transaction_snapshot ts "
+    "left join revision_account_balances rab "
+    "   on ts.pending_user_id is null and rab.revision_id = ts.revision_id "
+)
+TRANSACTION_SNAPSHOT_QUERY = prepared_statement(
+    TRANSACTION_SNAPSHOT_SELECT + "where ts.group_id = $1 and ts.transaction_id = $2"
+)
+GROUP_BALANCES_QUERY = prepared_statement(
+    "select a.id as account_id, coalesce(abc.balance, 0) as balance "
+    "from account a "
+    "left join account_balance_cache abc on abc.account_id = a.id "
+    "where a.group_id = $1"
+)
+GROUP_TRANSACTIONS_JSON_QUERY = prepared_statement(
+    "select json::text as json "
+    "from transaction_api_json "
+    "where group_id = $1 "
+    "order by transaction_id"
+)
+TRANSACTION_JSON_QUERY = prepared_statement(
+    "select json::text "
+    "from transaction_api_json "
+    "where group_id = $1 and transaction_id = $2"
+)
+
+
+async def iter_transactions_json(
+    conn: asyncpg.Connection, group_id: int
+) -> AsyncIterator[str]:
+    """
+    iterate over all transactions of a group in their api json representation as rendered by the database,
+    must be called within a transaction
+    """
+    cur = conn.cursor(GROUP_TRANSACTIONS_JSON_QUERY, group_id)
+    async for row in cur:
+        yield row["json"]
+
 
 class TransactionService(Application):
+    def __init__(
+        self,
+        db_pool: Pool,
+        permission_cache: Optional[PermissionCache] = None,
+        settlement_cache: Optional[SettlementCache] = None,
+    ):
+        super().__init__(db_pool=db_pool, permission_cache=permission_cache)
+
+        self.settlement_cache = settlement_cache
+
     @staticmethod
     def _transaction_detail_from_db_json(db_json: dict) -> TransactionDetails:
         purchase_items = None
@@ -58,8 +124,8 @@ class TransactionService(Application):
             purchase_items=purchase_items,
         )
 
-    @staticmethod
     async def _check_transaction_permissions(
+        self,
         conn: asyncpg.Connection,
         user_id: int,
         transaction_id: int,
@@ -67,14 +133,39 @@ class TransactionService(Application):
         transaction_type: Optional[Union[str, list[str]]] = None,
     ) -> int:
         """returns group id of the transaction"""
-        result = await conn.fetchrow(
-            "select t.type, t.group_id, can_write, is_owner "
-            "from group_membership gm join transaction t on gm.group_id = t.group_id and gm.user_id = $1 where t.id = $2",
-            user_id,
-            transaction_id,
-        )
-        if not result:
-            raise NotFoundError(f"user is not a member of this group")
+        if self.permission_cache is None:
+            result = await conn.fetchrow(
+                TRANSACTION_PERMISSIONS_QUERY,
+                user_id,
+                transaction_id,
+            )
+            if not result:
+                raise NotFoundError(f"user is not a member of this group")
+        else:
+            # the group and type of a transaction never change
+            transaction = self.permission_cache.get_transaction(transaction_id)
+            if transaction is None:
+                row = await conn.fetchrow(TRANSACTION_GROUP_QUERY, transaction_id)
+                if row is None:
+                    raise NotFoundError(f"user is not a member of this group")
+                transaction = row["group_id"], row["type"]
+                self.permission_cache.set_transaction(transaction_id, *transaction)
+
+            try:
+                member_can_write, member_is_owner = await check_group_permissions(
+                    conn=conn,
+                    group_id=transaction[0],
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+            except NotFoundError:
+                raise NotFoundError(f"user is not a member of this group")
+            result = {
+                "group_id": transaction[0],
+                "type": transaction[1],
+                "can_write": member_can_write,
+                "is_owner": member_is_owner,
+            }
 
         if can_write and not (result["can_write"] or result["is_owner"]):
             raise PermissionError(f"user does not have write permissions")
@@ -92,50 +183,280 @@ class TransactionService(Application):
 
         return result["group_id"]
 
-    def _transaction_db_row(self, transaction: asyncpg.Record) -> Transaction:
-        changes = transaction["pending_changes"]
-        if changes is None:
-            pending_changes = None
-        else:
-            pending_changes = {
-                c["last_changed_by"]: self._transaction_detail_from_db_json(c)
-                for c in json.loads(changes)
-            }
-
-        current_state = (
-            self._transaction_detail_from_db_json(
-                json.loads(transaction["current_state"])[0]
-            )
-            if transaction["current_state"] is not None
-            else None
-        )
+    def _transaction_from_snapshot(self, rows: list[asyncpg.Record]) -> Transaction:
+        """build a transaction from all of its rows in the transaction_snapshot table"""
+        current_state = None
+        pending_changes = None
+        for row in rows:
+            details = self._transaction_detail_from_db_json(row["details"])
+            if row["pending_user_id"] is None:
+                if row["account_balances"] is not None:
+                    details.account_balances = {
+                        int(account_id): TransactionAccountBalance(**balance)
+                        for account_id, balance in row["account_balances"].items()
+                    }
+                current_state = details
+            else:
+                if pending_changes is None:
+                    pending_changes = {}
+                pending_changes[row["pending_user_id"]] = details
 
         return Transaction(
-            id=transaction["id"],
-            type=transaction["type"],
+            id=rows[0]["transaction_id"],
+            type=rows[0]["type"],
             current_state=current_state,
             pending_changes=pending_changes,
         )
 
+    async def _iter_transactions_from_snapshot(self, cur) -> AsyncIterator[Transaction]:
+        """build transactions from transaction_snapshot rows ordered by transaction id"""
+        rows: list[asyncpg.Record] = []
+        async for row in cur:
+            if rows and rows[0]["transaction_id"] != row["transaction_id"]:
+                yield self._transaction_from_snapshot(rows)
+                rows = []
+            rows.append(row)
+        if rows:
+            yield self._transaction_from_snapshot(rows)
+
+    async def _transactions_from_snapshot_cursor(self, cur) -> list[Transaction]:
+        return [
+            transaction
+            async for transaction in self._iter_transactions_from_snapshot(cur)
+        ]
+
+    @staticmethod
+    async def _refresh_transaction_snapshot(
+        conn: asyncpg.Connection, transaction_id: int
+    ):
+        """needs to be called after every modification of a transaction, assumes we are already in a transaction"""
+        await conn.execute("call refresh_transaction_snapshot($1)", transaction_id)
+
+    @staticmethod
+    async def _committed_transaction_details(
+        conn: asyncpg.Connection, transaction_id: int
+    ) -> Optional[str]:
+        """the committed state of a transaction as stored in the transaction_snapshot table, json encoded"""
+        return await conn.fetchval(
+            "select details::text from transaction_snapshot "
+            "where transaction_id = $1 and pending_user_id is null",
+            transaction_id,
+        )
+
+    @staticmethod
+    async def _apply_account_balance_delta(
+        conn: asyncpg.Connection, transaction_id: int, old_details: Optional[str]
+    ):
+        """
+        update the cached account balances after the committed state of a transaction changed.
+        Needs to be called after refreshing the transaction snapshot, assumes we are already in a transaction
+        """
+        await conn.execute(
+            "call apply_account_balance_delta($1, $2::text::jsonb)",
+            transaction_id,
+            old_details,
+        )
+
     async def list_transactions(
         self, *, user_id: int, group_id: int
-    ) -> list[Transaction]:
+    ) -> AsyncIterator[Transaction]:
+        """
+        iterate over all transactions of a group.
+
+        The transactions are read lazily via a database cursor, permissions are checked on fetching the first element.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+                cur = conn.cursor(
+                    TRANSACTION_SNAPSHOT_SELECT + "where ts.group_id = $1 "
+                    "order by ts.transaction_id",
+                    group_id,
+                )
+                async for transaction in self._iter_transactions_from_snapshot(cur):
+                    yield transaction
+
+    async def list_transactions_json(
+        self, *, user_id: int, group_id: int
+    ) -> AsyncIterator[str]:
+        """
+        iterate over all transactions of a group in their api json representation as rendered by the database.
+
+        The transactions are read lazily via a database cursor, permissions are checked on fetching the first element.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+                async for transaction in iter_transactions_json(conn, group_id):
+                    yield transaction
+
+    async def list_transactions_page(
+        self,
+        *,
+        user_id: int,
+        group_id: int,
+        limit: int,
+        after: Optional[tuple[date, int]] = None,
+        descending: bool = False,
+        min_billed_at: Optional[date] = None,
+        max_billed_at: Optional[date] = None,
+        transaction_type: Optional[str] = None,
+        account_id: Optional[int] = None,
+        deleted: Optional[bool] = None,
+        has_pending_changes: Optional[bool] = None,
+    ) -> tuple[list[Transaction], Optional[tuple[date, int]]]:
+        """
+        list one page of the transactions visible to a user ordered by (billed_at, id).
+
+        Sorting and filtering is done on the state the user sees, i.e. their own pending change if they have one,
+        the last committed state otherwise. Transactions which have never been committed are only visible to the
+        user who created them.
+
+        Returns the transactions and the (billed_at, id) key to pass as 'after' to fetch the next page,
+        None if this is the last page.
+        """
+        conditions = [
+            "ts.group_id = $1",
+            "(ts.pending_user_id = $2 or (ts.pending_user_id is null and not exists ("
+            "   select from transaction_snapshot p where p.transaction_id = ts.transaction_id and p.pending_user_id = $2"
+            ")))",
+        ]
+        args: list = [group_id, user_id]
+
+        def add_condition(condition: str, *values):
+            """add a condition to the query, '{}' placeholders are replaced by the positional query arguments"""
+            placeholders = [f"${len(args) + i + 1}" for i in range(len(values))]
+            conditions.append(condition.format(*placeholders))
+            args.extend(values)
+
+        if after is not None:
+            add_condition(
+                f"(ts.billed_at, ts.transaction_id) {'<' if descending else '>'} ({{}}, {{}})",
+                *after,
+            )
+        if min_billed_at is not None:
+            add_condition("ts.billed_at >= {}", min_billed_at)
+        if max_billed_at is not None:
+            add_condition("ts.billed_at <= {}", max_billed_at)
+        if transaction_type is not None:
+            add_condition("ts.type = {}", transaction_type)
+        if account_id is not None:
+            add_condition("ts.involved_accounts @> array[{}::integer]", account_id)
+        if deleted is not None:
+            conditions.append("ts.deleted" if deleted else "not ts.deleted")
+        if has_pending_changes is not None:
+            conditions.append(
+                "ts.pending_user_id is not null"
+                if has_pending_changes
+                else "ts.pending_user_id is null"
+            )
+
+        # fetch one more row than requested to know whether there is a next page
+        args.append(limit + 1)
+        direction = "desc" if descending else "asc"
+        query = (
+            "select ts.transaction_id, ts.billed_at "
+            "from transaction_snapshot ts "
+            f"where {' and '.join(conditions)} "
+            f"order by ts.billed_at {direction}, ts.transaction_id {direction} "
+            f"limit ${len(args)}"
+        )
+
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
                 )
+                page = await conn.fetch(query, *args)
+                next_key = None
+                if len(page) > limit:
+                    page = page[:limit]
+                    next_key = (page[-1]["billed_at"], page[-1]["transaction_id"])
+
+                transaction_ids = [row["transaction_id"] for row in page]
                 cur = conn.cursor(
-                    "select id, type, current_state, pending_changes "
-                    "from current_transaction_state "
-                    "where group_id = $1",
+                    TRANSACTION_SNAPSHOT_SELECT
+                    + "where ts.group_id = $1 and ts.transaction_id = any($2::integer[]) "
+                    "order by ts.transaction_id",
                     group_id,
+                    transaction_ids,
                 )
-                result = []
-                async for transaction in cur:
-                    result.append(self._transaction_db_row(transaction))
+                transactions = {
+                    transaction.id: transaction
+                    for transaction in await self._transactions_from_snapshot_cursor(
+                        cur
+                    )
+                }
+
+                return [transactions[t_id] for t_id in transaction_ids], next_key
 
-                return result
+    async def list_transaction_changes(
+        self, *, user_id: int, group_id: int, since: int
+    ) -> tuple[int, list[Transaction], list[int]]:
+        """
+        list all transactions of a group which changed after the group change sequence number 'since'.
+
+        Returns the current change sequence number of the group, the changed transactions and the ids of
+        the changed transactions which have been deleted or are not visible anymore at all.
+        """
+        async with self.db_pool.acquire() as conn:
+            # the change sequence number has to match the returned transactions exactly
+            async with conn.transaction(isolation="repeatable_read"):
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+                change_seq = await conn.fetchval(
+                    "select seq from group_change_sequence where group_id = $1",
+                    group_id,
+                )
+                cur = conn.cursor(
+                    TRANSACTION_SNAPSHOT_SELECT
+                    + "where ts.group_id = $1 and ts.change_seq > $2 "
+                    "order by ts.transaction_id",
+                    group_id,
+                    since,
+                )
+                transactions = []
+                deleted_transactions = []
+                for transaction in await self._transactions_from_snapshot_cursor(cur):
+                    if (
+                        transaction.current_state is not None
+                        and transaction.current_state.deleted
+                    ):
+                        deleted_transactions.append(transaction.id)
+                    else:
+                        transactions.append(transaction)
+
+                # transactions whose snapshot rows have been removed entirely
+                removed = await conn.fetch(
+                    "select transaction_id from transaction_snapshot_tombstone tst "
+                    "where tst.group_id = $1 and tst.change_seq > $2",
+                    group_id,
+                    since,
+                )
+                deleted_transactions.extend(row["transaction_id"] for row in removed)
+
+                return (
+                    0 if change_seq is None else change_seq,
+                    transactions,
+                    deleted_transactions,
+                )
 
     async def get_transaction(
         self, *, user_id: int, transaction_id: int
@@ -144,10 +465,26 @@ class TransactionService(Application):
             group_id = await self._check_transaction_permissions(
                 conn=conn, user_id=user_id, transaction_id=transaction_id
             )
-            transaction = await conn.fetchrow(
-                "select id, type, current_state, pending_changes "
-                "from current_transaction_state "
-                "where group_id = $1 and id = $2",
+            rows = await conn.fetch(
+                TRANSACTION_SNAPSHOT_QUERY,
+                group_id,
+                transaction_id,
+            )
+            if not rows:
+                raise NotFoundError(
+                    f"Transaction with id {transaction_id} does not exist"
+                )
+
+            return self._transaction_from_snapshot(rows)
+
+    async def get_transaction_json(self, *, user_id: int, transaction_id: int) -> str:
+        """get a transaction in its api json representation as rendered by the database"""
+        async with self.db_pool.acquire() as conn:
+            group_id = await self._check_transaction_permissions(
+                conn=conn, user_id=user_id, transaction_id=transaction_id
+            )
+            transaction = await conn.fetchval(
+                TRANSACTION_JSON_QUERY,
                 group_id,
                 transaction_id,
             )
@@ -156,7 +493,7 @@ class TransactionService(Application):
                     f"Transaction with id {transaction_id} does not exist"
                 )
 
-            return self._transaction_db_row(transaction)
+            return transaction
 
     async def create_transaction(
         self,
@@ -173,7 +510,10 @@ class TransactionService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 await check_group_permissions(
-                    conn=conn, group_id=group_id, user_id=user_id
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
                 )
                 transaction_id = await conn.fetchval(
                     "insert into transaction (group_id, type) values ($1, $2) returning id",
@@ -197,8 +537,515 @@ class TransactionService(Application):
                     description,
                     billed_at,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
                 return transaction_id
 
+    @staticmethod
+    def _check_new_transaction(
+        transaction: NewTransaction, account_ids: set[int], complete: bool = True
+    ):
+        """
+        python side of the checks the database performs when committing a transaction,
+        such that imports fail early with a descriptive error.
+        The number of shares is only checked for complete, i.e. to be committed, transactions.
+        """
+        if transaction.type not in {t.value for t in TransactionType}:
+            raise InvalidCommand(f"unknown transaction type {transaction.type}")
+        if transaction.value <= 0:
+            raise InvalidCommand(f"transaction value must be positive")
+        if transaction.currency_conversion_rate <= 0:
+            raise InvalidCommand(f"currency conversion rate must be positive")
+
+        if complete:
+            n_creditors = len(transaction.creditor_shares)
+            n_debitors = len(transaction.debitor_shares)
+            if transaction.type == TransactionType.transfer.value and (
+                n_creditors != 1 or n_debitors != 1
+            ):
+                raise InvalidCommand(
+                    f'"transfer" type transactions must have exactly one creditor and one debitor share'
+                )
+            if transaction.type == TransactionType.purchase.value and (
+                n_creditors != 1 or n_debitors < 1
+            ):
+                raise InvalidCommand(
+                    f'"purchase" type transactions must have exactly one creditor and at least one debitor share'
+                )
+            if transaction.type == TransactionType.mimo.value and (
+                n_creditors < 1 or n_debitors < 1
+            ):
+                raise InvalidCommand(
+                    f'"mimo" type transactions must have at least one creditor and one debitor share'
+                )
+        if (
+            transaction.purchase_items
+            and transaction.type != TransactionType.purchase.value
+        ):
+            raise InvalidCommand(
+                f'only "purchase" type transactions can have purchase items'
+            )
+
+        shares = [transaction.creditor_shares, transaction.debitor_shares]
+        for item in transaction.purchase_items:
+            if item.price <= 0:
+                raise InvalidCommand(f"purchase item price must be positive")
+            if item.communist_shares < 0:
+                raise InvalidCommand(f"communist shares must not be negative")
+            if complete and item.communist_shares + sum(item.usages.values()) <= 0:
+                raise InvalidCommand(
+                    f"all transaction positions must have at least one account assigned "
+                    f"or their common shares set greater than 0"
+                )
+            shares.append(item.usages)
+
+        for share in shares:
+            for account_id, value in share.items():
+                if account_id not in account_ids:
+                    raise InvalidCommand(
+                        f"account {account_id} does not exist in this group"
+                    )
+                if value <= 0:
+                    raise InvalidCommand(f"shares must be positive")
+
+    @staticmethod
+    async def _reserve_ids(conn: asyncpg.Connection, table: str, n: int) -> list[int]:
+        """fetch n values from the id sequence of a table"""
+        rows = await conn.fetch(
+            "select nextval(pg_get_serial_sequence($1, 'id')) as id from generate_series(1, $2)",
+            table,
+            n,
+        )
+        return [row["id"] for row in rows]
+
+    async def import_transactions(
+        self, *, user_id: int, group_id: int, transactions: list[NewTransaction]
+    ) -> list[int]:
+        """
+        create and commit many transactions at once in a single database transaction.
+        Rows are loaded with COPY and the per row change notifications are replaced by a single one.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    can_write=True,
+                    cache=self.permission_cache,
+                )
+                if not transactions:
+                    return []
+
+                account_ids = {
+                    row["id"]
+                    for row in await conn.fetch(
+                        "select id from account where group_id = $1", group_id
+                    )
+                }
+                for i, transaction in enumerate(transactions):
+                    try:
+                        self._check_new_transaction(transaction, account_ids)
+                    except InvalidCommand as e:
+                        raise InvalidCommand(f"transaction {i}: {e}")
+
+                await conn.execute(
+                    "select set_config('abrechnung.suppress_notifications', 'on', true)"
+                )
+
+                transaction_ids = await self._reserve_ids(
+                    conn, "transaction", len(transactions)
+                )
+                revision_ids = await self._reserve_ids(
+                    conn, "transaction_revision", len(transactions)
+                )
+                items = [
+                    (transaction_id, revision_id, item)
+                    for transaction_id, revision_id, transaction in zip(
+                        transaction_ids, revision_ids, transactions
+                    )
+                    for item in transaction.purchase_items
+                ]
+                item_ids = await self._reserve_ids(conn, "purchase_item", len(items))
+
+                await conn.copy_records_to_table(
+                    "transaction",
+                    columns=["id", "group_id", "type"],
+                    records=[
+                        (transaction_id, group_id, transaction.type)
+                        for transaction_id, transaction in zip(
+                            transaction_ids, transactions
+                        )
+                    ],
+                )
+                # revisions are committed once all their shares exist, the commit check depends on them
+                await conn.copy_records_to_table(
+                    "transaction_revision",
+                    columns=["id", "user_id", "transaction_id"],
+                    records=[
+                        (revision_id, user_id, transaction_id)
+                        for transaction_id, revision_id in zip(
+                            transaction_ids, revision_ids
+                        )
+                    ],
+                )
+                await conn.copy_records_to_table(
+                    "transaction_history",
+                    columns=[
+                        "id",
+                        "revision_id",
+                        "currency_symbol",
+                        "currency_conversion_rate",
+                        "value",
+                        "billed_at",
+                        "description",
+                    ],
+                    records=[
+                        (
+                            transaction_id,
+                            revision_id,
+                            transaction.currency_symbol,
+                            transaction.currency_conversion_rate,
+                            transaction.value,
+                            transaction.billed_at,
+                            transaction.description,
+                        )
+                        for transaction_id, revision_id, transaction in zip(
+                            transaction_ids, revision_ids, transactions
+                        )
+                    ],
+                )
+                for table, attribute in (
+                    ("creditor_share", "creditor_shares"),
+                    ("debitor_share", "debitor_shares"),
+                ):
+                    await conn.copy_records_to_table(
+                        table,
+                        columns=[
+                            "transaction_id",
+                            "revision_id",
+                            "account_id",
+                            "shares",
+                        ],
+                        records=[
+                            (transaction_id, revision_id, account_id, shares)
+                            for transaction_id, revision_id, transaction in zip(
+                                transaction_ids, revision_ids, transactions
+                            )
+                            for account_id, shares in getattr(
+                                transaction, attribute
+                            ).items()
+                        ],
+                    )
+                if items:
+                    await conn.copy_records_to_table(
+                        "purchase_item",
+                        columns=["id", "transaction_id"],
+                        records=[
+                            (item_id, transaction_id)
+                            for item_id, (transaction_id, _, _) in zip(item_ids, items)
+                        ],
+                    )
+                    await conn.copy_records_to_table(
+                        "purchase_item_history",
+                        columns=[
+                            "id",
+                            "revision_id",
+                            "name",
+                            "price",
+                            "communist_shares",
+                        ],
+                        records=[
+                            (
+                                item_id,
+                                revision_id,
+                                item.name,
+                                item.price,
+                                item.communist_shares,
+                            )
+                            for item_id, (_, revision_id, item) in zip(item_ids, items)
+                        ],
+                    )
+                    await conn.copy_records_to_table(
+                        "purchase_item_usage",
+                        columns=[
+                            "item_id",
+                            "revision_id",
+                            "account_id",
+                            "share_amount",
+                        ],
+                        records=[
+                            (item_id, revision_id, account_id, share_amount)
+                            for item_id, (_, revision_id, item) in zip(item_ids, items)
+                            for account_id, share_amount in item.usages.items()
+                        ],
+                    )
+
+                await conn.execute(
+                    "update transaction_revision set committed = now() where id = any($1::bigint[])",
+                    revision_ids,
+                )
+                await create_group_log(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    type="transaction-committed",
+                    message=f"imported {len(transactions)} transactions",
+                )
+                await conn.execute(
+                    "call finish_transaction_import($1, $2)", group_id, transaction_ids
+                )
+                return transaction_ids
+
+    async def _insert_transaction(
+        self,
+        conn: asyncpg.Connection,
+        user_id: int,
+        group_id: int,
+        transaction: NewTransaction,
+        account_ids: set[int],
+        commit: bool = False,
+    ) -> int:
+        """
+        insert a transaction including its shares and purchase items, optionally committing it right away.
+        Must be called within a transaction after checking the group permissions.
+        """
+        self._check_new_transaction(transaction, account_ids, complete=commit)
+
+        transaction_id = await conn.fetchval(
+            "insert into transaction (group_id, type) values ($1, $2) returning id",
+            group_id,
+            transaction.type,
+        )
+        revision_id = await conn.fetchval(
+            "insert into transaction_revision (user_id, transaction_id) "
+            "values ($1, $2) returning id",
+            user_id,
+            transaction_id,
+        )
+        await conn.execute(
+            "insert into transaction_history (id, revision_id, currency_symbol, currency_conversion_rate, value, description, billed_at) "
+            "values ($1, $2, $3, $4, $5, $6, $7)",
+            transaction_id,
+            revision_id,
+            transaction.currency_symbol,
+            transaction.currency_conversion_rate,
+            transaction.value,
+            transaction.description,
+            transaction.billed_at,
+        )
+        for table, shares in (
+            ("creditor_share", transaction.creditor_shares),
+            ("debitor_share", transaction.debitor_shares),
+        ):
+            await conn.execute(
+                f"insert into {table} (transaction_id, revision_id, account_id, shares) "
+                f"select $1, $2, unnest($3::integer[]), unnest($4::double precision[])",
+                transaction_id,
+                revision_id,
+                list(shares.keys()),
+                list(shares.values()),
+            )
+
+        items = transaction.purchase_items
+        if items:
+            item_ids = await self._reserve_ids(conn, "purchase_item", len(items))
+            await conn.execute(
+                "insert into purchase_item (id, transaction_id) "
+                "select unnest($1::integer[]), $2",
+                item_ids,
+                transaction_id,
+            )
+            await conn.execute(
+                "insert into purchase_item_history (id, revision_id, name, price, communist_shares) "
+                "select unnest($1::integer[]), $2, unnest($3::text[]), unnest($4::double precision[]), "
+                "unnest($5::double precision[])",
+                item_ids,
+                revision_id,
+                [item.name for item in items],
+                [item.price for item in items],
+                [item.communist_shares for item in items],
+            )
+            usages = [
+                (item_id, account_id, share_amount)
+                for item_id, item in zip(item_ids, items)
+                for account_id, share_amount in item.usages.items()
+            ]
+            await conn.execute(
+                "insert into purchase_item_usage (item_id, revision_id, account_id, share_amount) "
+                "select unnest($1::integer[]), $2, unnest($3::integer[]), unnest($4::double precision[])",
+                [usage[0] for usage in usages],
+                revision_id,
+                [usage[1] for usage in usages],
+                [usage[2] for usage in usages],
+            )
+
+        if commit:
+            await conn.execute(
+                "update transaction_revision set committed = now() where id = $1",
+                revision_id,
+            )
+            await create_group_log(
+                conn=conn,
+                group_id=group_id,
+                user_id=user_id,
+                type="transaction-committed",
+                message=f"updated transaction with id {transaction_id}",
+            )
+        await self._refresh_transaction_snapshot(conn, transaction_id)
+        if commit:
+            await self._apply_account_balance_delta(conn, transaction_id, None)
+        return transaction_id
+
+    async def create_transaction_full(
+        self,
+        *,
+        user_id: int,
+        group_id: int,
+        transaction: NewTransaction,
+        commit: bool = False,
+    ) -> Transaction:
+        """
+        create a transaction including its shares and purchase items, optionally committing it right away.
+        Returns the state of the created transaction.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    can_write=True,
+                    cache=self.permission_cache,
+                )
+                account_ids = {
+                    row["id"]
+                    for row in await conn.fetch(
+                        "select id from account where group_id = $1", group_id
+                    )
+                }
+                transaction_id = await self._insert_transaction(
+                    conn,
+                    user_id=user_id,
+                    group_id=group_id,
+                    transaction=transaction,
+                    account_ids=account_ids,
+                    commit=commit,
+                )
+
+                rows = await conn.fetch(
+                    TRANSACTION_SNAPSHOT_QUERY,
+                    group_id,
+                    transaction_id,
+                )
+                return self._transaction_from_snapshot(rows)
+
+    async def _plan_settlement(
+        self,
+        conn: asyncpg.Connection,
+        group_id: int,
+        exact: Optional[bool],
+        update_cache: bool = True,
+    ) -> Settlement:
+        """
+        settlement of the committed account balances of a group, must be called within a transaction.
+
+        Settlements are cached until the change sequence number of the group advances. Only transactions
+        at repeatable read isolation see balances which match the change sequence number, others must not
+        update the cache.
+        """
+        change_seq = await current_change_feed_seq(conn, group_id)
+        if self.settlement_cache is not None:
+            settlement = self.settlement_cache.get(group_id, exact, change_seq)
+            if settlement is not None:
+                return settlement
+
+        rows = await conn.fetch(GROUP_BALANCES_QUERY, group_id)
+        try:
+            settlement = plan_settlement(
+                {row["account_id"]: row["balance"] for row in rows},
+                change_seq=change_seq,
+                exact=exact,
+            )
+        except ValueError as e:
+            raise InvalidCommand(str(e))
+
+        if update_cache and self.settlement_cache is not None:
+            self.settlement_cache.set(group_id, exact, settlement)
+        return settlement
+
+    async def get_settlement(
+        self, *, user_id: int, group_id: int, exact: Optional[bool] = None
+    ) -> Settlement:
+        """
+        transfers which settle all committed account balances of a group.
+
+        If exact is not given the number of transfers is minimal for small groups only.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    cache=self.permission_cache,
+                )
+                return await self._plan_settlement(conn, group_id, exact)
+
+    async def create_settlement_transfers(
+        self, *, user_id: int, group_id: int, exact: Optional[bool] = None
+    ) -> list[int]:
+        """
+        create the transfers settling all committed account balances of a group
+        as transactions with pending changes of the given user.
+        Returns the ids of the created transactions.
+        """
+        async with self.db_pool.acquire() as conn:
+            async with conn.transaction():
+                await check_group_permissions(
+                    conn=conn,
+                    group_id=group_id,
+                    user_id=user_id,
+                    can_write=True,
+                    cache=self.permission_cache,
+                )
+                currency_symbol = await conn.fetchval(
+                    "select currency_symbol from grp where id = $1", group_id
+                )
+                # the balances might be read at a later state than the change sequence number
+                settlement = await self._plan_settlement(
+                    conn, group_id, exact, update_cache=False
+                )
+                account_ids = {
+                    account_id
+                    for transfer in settlement.transfers
+                    for account_id in (transfer.from_account_id, transfer.to_account_id)
+                }
+
+                transaction_ids = []
+                for transfer in settlement.transfers:
+                    transaction = NewTransaction(
+                        type=TransactionType.transfer.value,
+                        description="settlement",
+                        value=transfer.amount,
+                        currency_symbol=currency_symbol,
+                        currency_conversion_rate=1.0,
+                        billed_at=date.today(),
+                        creditor_shares={transfer.from_account_id: 1.0},
+                        debitor_shares={transfer.to_account_id: 1.0},
+                        purchase_items=[],
+                    )
+                    transaction_ids.append(
+                        await self._insert_transaction(
+                            conn,
+                            user_id=user_id,
+                            group_id=group_id,
+                            transaction=transaction,
+                            account_ids=account_ids,
+                        )
+                    )
+
+                return transaction_ids
+
     async def commit_transaction(self, *, user_id: int, transaction_id: int) -> None:
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
@@ -215,6 +1062,9 @@ class TransactionService(Application):
                         f"Cannot commit a transaction without pending changes"
                     )
 
+                old_details = await self._committed_transaction_details(
+                    conn, transaction_id
+                )
                 await conn.execute(
                     "update transaction_revision "
                     "set committed = now() where id = $1",
@@ -227,6 +1077,10 @@ class TransactionService(Application):
                     type="transaction-committed",
                     message=f"updated transaction with id {transaction_id}",
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
+                await self._apply_account_balance_delta(
+                    conn, transaction_id, old_details
+                )
 
     async def update_transaction(
         self,
@@ -262,6 +1116,7 @@ class TransactionService(Application):
                     currency_conversion_rate,
                     billed_at,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def create_transaction_change(self, *, user_id: int, transaction_id: int):
         async with self.db_pool.acquire() as conn:
@@ -275,6 +1130,7 @@ class TransactionService(Application):
                 await self._get_or_create_pending_change(
                     conn=conn, user_id=user_id, transaction_id=transaction_id
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def discard_transaction_changes(self, *, user_id: int, transaction_id: int):
         async with self.db_pool.acquire() as conn:
@@ -314,6 +1170,7 @@ class TransactionService(Application):
                         "delete from transaction_revision tr " "where tr.id = $1",
                         revision_id,
                     )
+                    await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def delete_transaction(self, *, user_id: int, transaction_id: int):
         async with self.db_pool.acquire() as conn:
@@ -379,6 +1236,8 @@ class TransactionService(Application):
                         user_id,
                         transaction_id,
                     )
+                    await self._refresh_transaction_snapshot(conn, transaction_id)
+                    await self._apply_account_balance_delta(conn, transaction_id, None)
                     return
 
                 else:  # we have at least one committed change for this transaction
@@ -393,11 +1252,18 @@ class TransactionService(Application):
                         revision_id,
                     )
 
+                    old_details = await self._committed_transaction_details(
+                        conn, transaction_id
+                    )
                     await conn.execute(
                         "update transaction_revision tr set committed = NOW() "
                         "where tr.id = $1",
                         revision_id,
                     )
+                    await self._refresh_transaction_snapshot(conn, transaction_id)
+                    await self._apply_account_balance_delta(
+                        conn, transaction_id, old_details
+                    )
 
     async def _get_or_create_pending_change(
         self, conn: asyncpg.Connection, user_id: int, transaction_id: int
@@ -542,6 +1408,7 @@ class TransactionService(Application):
                     account_id,
                     value,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def switch_creditor_share(
         self,
@@ -574,6 +1441,7 @@ class TransactionService(Application):
                     account_id,
                     value,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def delete_creditor_share(
         self, *, user_id: int, transaction_id: int, account_id: int
@@ -593,6 +1461,7 @@ class TransactionService(Application):
                 )
                 if not r:
                     raise NotFoundError(f"Creditor share does not exist")
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def add_or_change_debitor_share(
         self,
@@ -621,6 +1490,7 @@ class TransactionService(Application):
                     account_id,
                     value,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def switch_debitor_share(
         self, *, user_id: int, transaction_id: int, account_id: int, value: float
@@ -648,6 +1518,7 @@ class TransactionService(Application):
                     account_id,
                     value,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def delete_debitor_share(
         self, *, user_id: int, transaction_id: int, account_id: int
@@ -668,6 +1539,7 @@ class TransactionService(Application):
                 )
                 if not r:
                     raise NotFoundError(f"Debitor share does not exist")
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def create_purchase_item(
         self,
@@ -703,6 +1575,7 @@ class TransactionService(Application):
                     price,
                     communist_shares,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
                 return item_id
 
     @staticmethod
@@ -754,6 +1627,7 @@ class TransactionService(Application):
                     price,
                     communist_shares,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def add_or_change_item_share(
         self,
@@ -785,6 +1659,7 @@ class TransactionService(Application):
                     account_id,
                     share_amount,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def delete_item_share(
         self,
@@ -811,6 +1686,7 @@ class TransactionService(Application):
                 )
                 if not r:
                     raise NotFoundError(f"Purchase item usage does not exist")
+                await self._refresh_transaction_snapshot(conn, transaction_id)
 
     async def delete_purchase_item(self, *, user_id: int, item_id: int):
         async with self.db_pool.acquire() as conn:
@@ -828,3 +1704,4 @@ class TransactionService(Application):
                     item_id,
                     revision_id,
                 )
+                await self._refresh_transaction_snapshot(conn, transaction_id)
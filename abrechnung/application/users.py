@@ -7,6 +7,7 @@ from email_validator import validate_email, EmailNotValidError
 
 from abrechnung.domain.users import User, Session
 from . import Application, NotFoundError, InvalidCommand
+from .cache import SessionCache
 
 
 class InvalidPassword(Exception):
@@ -23,11 +24,13 @@ class UserService(Application):
         db_pool: Pool,
         enable_registration: bool,
         valid_email_domains: Optional[list[str]] = None,
+        session_cache: Optional[SessionCache] = None,
     ):
         super().__init__(db_pool=db_pool)
 
         self.enable_registration = enable_registration
         self.valid_email_domains = valid_email_domains
+        self.session_cache = session_cache
 
     @staticmethod
     def _hash_password(password: str) -> str:
@@ -60,7 +63,7 @@ class UserService(Application):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
                 row = await conn.fetchrow(
-                    "select user_id, id from session where token = $1 and valid_until is null or valid_until > now()",
+                    "select user_id, id from session where token = $1 and (valid_until is null or valid_until > now())",
                     token,
                 )
                 if row:
@@ -117,6 +120,9 @@ class UserService(Application):
                 if sess_id is None:
                     raise InvalidCommand(f"Already logged out")
 
+        # other processes are notified by the database once the transaction has been committed
+        self._invalidate_cached_session(user_id=user_id, session_id=session_id)
+
     async def register_user(self, username: str, email: str, password: str) -> int:
         """Register a new user, returning the newly created user id and creating a pending registration entry"""
         if not self.enable_registration:
@@ -227,6 +233,12 @@ class UserService(Application):
                 if not sess_id:
                     raise NotFoundError(f"no such session found with id {session_id}")
 
+        self._invalidate_cached_session(user_id=user_id, session_id=session_id)
+
+    def _invalidate_cached_session(self, user_id: int, session_id: int):
+        if self.session_cache is not None:
+            self.session_cache.invalidate(session_id=session_id, user_id=user_id)
+
     async def rename_session(self, user_id: int, session_id: int, name: str):
         async with self.db_pool.acquire() as conn:
             async with conn.transaction():
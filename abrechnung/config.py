@@ -12,15 +12,25 @@ CONFIG_SCHEMA = schema.Schema(
             "user": str,
             "dbname": str,
             "password": str,
+            schema.Optional("min_size"): int,
+            schema.Optional("max_size"): int,
+            schema.Optional("statement_cache_size"): int,
+            schema.Optional("max_inactive_connection_lifetime"): schema.Or(int, float),
+            schema.Optional("pgbouncer"): bool,
         },
         "api": {
             "secret_key": str,
             "host": str,
             "port": int,
-            "id": str,
+            # generated from the host name and process id if not set, needs to be unique per api instance
+            schema.Optional("id"): str,
             schema.Optional("enable_cors"): bool,
             schema.Optional("enable_registration"): bool,
             schema.Optional("valid_email_domains"): [str],
+            schema.Optional("notification_debounce"): schema.Or(int, float),
+            schema.Optional("websocket_compress"): bool,
+            schema.Optional("change_feed_retention"): schema.Or(int, float),
+            schema.Optional("heartbeat_interval"): schema.Or(int, float),
         },
         "email": {
             "address": str,
@@ -1,7 +1,11 @@
 import contextlib
+import functools
+import json
+import logging
 import os
 import shutil
 import tempfile
+from typing import Optional
 
 import asyncpg
 from asyncpg.pool import Pool
@@ -11,20 +15,94 @@ from abrechnung import util
 from abrechnung.config import Config
 from . import revisions
 
+logger = logging.getLogger(__name__)
+
+
+async def init_connection(
+    conn: asyncpg.Connection, prepared_statements: Optional[list[str]] = None
+):
+    """
+    initialize a new database connection.
+
+    Registers automatic en- and decoding of json type postgresql values and prepares the given statements
+    in the statement cache of the connection such that their first use does not have to parse and plan them.
+    """
+    for json_type in ("json", "jsonb"):
+        await conn.set_type_codec(
+            json_type, encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+        )
+
+    # Connection.prepare returns statements which are not part of the statement cache used by fetch and
+    # execute, running a statement for an empty list of arguments prepares and caches it without executing it
+    for query in prepared_statements or []:
+        await conn.executemany(query, [])
+
 
 async def db_connect(
-    username: str, password: str, database: str, host: str, port: int = 5432
+    username: str,
+    password: str,
+    database: str,
+    host: str,
+    port: int = 5432,
+    min_size: int = 10,
+    max_size: int = 100,
+    statement_cache_size: int = 100,
+    max_inactive_connection_lifetime: float = 300.0,
+    pgbouncer: bool = False,
+    prepared_statements: Optional[list[str]] = None,
 ) -> Pool:
     """
     get a connection pool to the database
+
+    The given frequently used statements are prepared on every new connection and kept in its statement
+    cache, which is enlarged accordingly such that they are not crowded out by other queries. In pgbouncer
+    mode no named prepared statements are used as they are not supported when pgbouncer runs in transaction
+    pooling mode.
     """
+    if pgbouncer:
+        statement_cache_size = 0
+        prepared_statements = None
+    elif prepared_statements:
+        prepared_statements = list(dict.fromkeys(prepared_statements))
+        statement_cache_size += len(prepared_statements)
+
     return await asyncpg.create_pool(
         user=username,
         password=password,
         database=database,
         host=host,
         port=port,
-        max_size=100,
+        min_size=min_size,
+        max_size=max_size,
+        statement_cache_size=statement_cache_size,
+        max_inactive_connection_lifetime=max_inactive_connection_lifetime,
+        init=functools.partial(
+            init_connection, prepared_statements=prepared_statements
+        ),
+    )
+
+
+async def db_connect_from_config(
+    config: Config, prepared_statements: Optional[list[str]] = None
+) -> Pool:
+    """
+    get a connection pool to the database configured in the 'database' config section
+    """
+    db_config = config["database"]
+    return await db_connect(
+        username=db_config["user"],
+        password=db_config["password"],
+        database=db_config["dbname"],
+        host=db_config["host"],
+        port=db_config.get("port", 5432),
+        min_size=db_config.get("min_size", 10),
+        max_size=db_config.get("max_size", 100),
+        statement_cache_size=db_config.get("statement_cache_size", 100),
+        max_inactive_connection_lifetime=db_config.get(
+            "max_inactive_connection_lifetime", 300.0
+        ),
+        pgbouncer=db_config.get("pgbouncer", False),
+        prepared_statements=prepared_statements,
     )
 
 
@@ -42,7 +120,9 @@ class CLI(subcommand.SubCommand):
     @staticmethod
     def argparse_register(subparser):
         subparser.add_argument(
-            "action", choices=["migrate", "attach", "rebuild"], nargs="?"
+            "action",
+            choices=["migrate", "attach", "rebuild", "rebuild-snapshots"],
+            nargs="?",
         )
 
     async def _attach(self):
@@ -93,26 +173,51 @@ class CLI(subcommand.SubCommand):
                 print(util.format_error("psql failed"))
             return ret
 
+    async def _rebuild_snapshots(self, db_pool: Pool):
+        """
+        recompute the transaction snapshots and the account balance cache from the
+        history tables and report all snapshot rows that were inconsistent before.
+        """
+        async with db_pool.acquire() as conn:
+            async with conn.transaction():
+                inconsistencies = await conn.fetch(
+                    "select transaction_id, revision_id, problem from check_transaction_snapshots()"
+                )
+                for row in inconsistencies:
+                    logger.warning(
+                        f"transaction {row['transaction_id']} revision {row['revision_id']}: "
+                        f"snapshot is {row['problem']}"
+                    )
+
+                await conn.execute("call rebuild_transaction_snapshots()")
+
+                n_remaining = await conn.fetchval(
+                    "select count(*) from check_transaction_snapshots()"
+                )
+                if n_remaining != 0:
+                    raise RuntimeError(
+                        f"transaction snapshots are still inconsistent after rebuilding"
+                    )
+
+                await conn.execute("call rebuild_account_balance_cache()")
+
+        print(
+            f"rebuilt transaction snapshots, {len(inconsistencies)} rows were inconsistent"
+        )
+
     async def run(self):
         """
         CLI entry point
         """
         if self.action == "migrate":
-            db_pool = await db_connect(
-                username=self.config["database"]["user"],
-                database=self.config["database"]["dbname"],
-                host=self.config["database"]["host"],
-                password=self.config["database"]["password"],
-            )
+            db_pool = await db_connect_from_config(self.config)
             await revisions.apply_revisions(db_pool=db_pool)
         elif self.action == "rebuild":
-            db_pool = await db_connect(
-                username=self.config["database"]["user"],
-                database=self.config["database"]["dbname"],
-                host=self.config["database"]["host"],
-                password=self.config["database"]["password"],
-            )
+            db_pool = await db_connect_from_config(self.config)
             await revisions.reset_schema(db_pool=db_pool)
             await revisions.apply_revisions(db_pool=db_pool)
+        elif self.action == "rebuild-snapshots":
+            db_pool = await db_connect_from_config(self.config)
+            await self._rebuild_snapshots(db_pool=db_pool)
         elif self.action == "attach":
             await self._attach()
@@ -0,0 +1,143 @@
+-- revision: 8278fedd
+-- requires: f133b1d3
+
+-- materialized per-revision transaction state.
+-- contains one row with the last committed state of each transaction
+-- and one row for every pending change of a user.
+-- the rows are rebuilt from the history tables by refresh_transaction_snapshot
+-- whenever a transaction is modified, such that reading transactions becomes
+-- a simple indexed lookup instead of evaluating the history views.
+create table if not exists transaction_snapshot (
+    revision_id     bigint primary key references transaction_revision (id) on delete cascade,
+    transaction_id  integer not null references transaction (id) on delete cascade,
+    group_id        integer not null references grp (id) on delete cascade,
+    type            text    not null references transaction_type (name),
+
+    -- null for the committed state, the user owning the pending change otherwise
+    pending_user_id integer references usr (id) on delete cascade,
+
+    billed_at       date    not null,
+    deleted         bool    not null,
+
+    -- the full transaction state as produced by committed_transaction_state
+    -- and pending_transaction_revisions respectively
+    details         jsonb   not null
+);
+
+create index if not exists transaction_snapshot_group_idx on transaction_snapshot (group_id, transaction_id);
+create unique index if not exists transaction_snapshot_committed_idx
+    on transaction_snapshot (transaction_id) where pending_user_id is null;
+create unique index if not exists transaction_snapshot_pending_idx
+    on transaction_snapshot (transaction_id, pending_user_id);
+
+-- what the snapshot table should contain, computed from the history tables
+create or replace view transaction_snapshot_source as
+    select
+        cts.revision_id   as revision_id,
+        cts.id            as transaction_id,
+        cts.group_id      as group_id,
+        cts.type          as type,
+        null::integer     as pending_user_id,
+        cts.billed_at     as billed_at,
+        cts.deleted       as deleted,
+        to_jsonb(cts)     as details
+    from
+        committed_transaction_state cts
+    union all
+    select
+        ptr.revision_id   as revision_id,
+        ptr.id            as transaction_id,
+        ptr.group_id      as group_id,
+        ptr.type          as type,
+        ptr.user_id       as pending_user_id,
+        ptr.billed_at     as billed_at,
+        ptr.deleted       as deleted,
+        to_jsonb(ptr)     as details
+    from
+        pending_transaction_revisions ptr;
+
+-- recompute all snapshot rows of a single transaction.
+-- has to be called in the same database transaction as any modification of the
+-- transaction, its revisions, shares or purchase items.
+create or replace procedure refresh_transaction_snapshot(
+    transaction_id integer
+) as
+$$
+begin
+    delete from transaction_snapshot ts where ts.transaction_id = refresh_transaction_snapshot.transaction_id;
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details
+    from
+        transaction_snapshot_source src
+    where
+        src.transaction_id = refresh_transaction_snapshot.transaction_id;
+end
+$$ language plpgsql;
+
+-- recompute the whole snapshot table from the history tables
+create or replace procedure rebuild_transaction_snapshots() as
+$$
+begin
+    delete from transaction_snapshot;
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details
+    from
+        transaction_snapshot_source src;
+end
+$$ language plpgsql;
+
+-- lists all snapshot rows which differ from what the history tables say.
+-- problem is one of
+--   'missing':  the snapshot row does not exist
+--   'stale':    the snapshot row exists but should not
+--   'mismatch': the snapshot row has outdated contents
+create or replace function check_transaction_snapshots()
+    returns table (
+        transaction_id integer,
+        revision_id    bigint,
+        problem        text
+    )
+as
+$$
+    select
+        coalesce(ts.transaction_id, src.transaction_id) as transaction_id,
+        coalesce(ts.revision_id, src.revision_id)       as revision_id,
+        case
+            when ts.revision_id is null then 'missing'
+            when src.revision_id is null then 'stale'
+            else 'mismatch'
+        end                                             as problem
+    from
+        transaction_snapshot ts
+        full outer join transaction_snapshot_source src on ts.revision_id = src.revision_id
+    where
+        ts.revision_id is null
+        or src.revision_id is null
+        or (ts.transaction_id, ts.group_id, ts.type, ts.pending_user_id, ts.billed_at, ts.deleted, ts.details)
+            is distinct from
+           (src.transaction_id, src.group_id, src.type, src.pending_user_id, src.billed_at, src.deleted, src.details);
+$$ language sql stable;
+
+call rebuild_transaction_snapshots();
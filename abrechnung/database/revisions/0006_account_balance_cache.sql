@@ -0,0 +1,208 @@
+-- revision: 041cce30
+-- requires: 8278fedd
+
+-- the effect a single transaction state has on the balances of the accounts involved in it,
+-- in the group currency.
+-- takes a transaction state as stored in transaction_snapshot.details, deleted transactions have no effect.
+-- purchase items are billed to the accounts using them, the remainder of each item
+-- (according to its communist shares) is billed to the debitors of the transaction together
+-- with the part of the transaction value not covered by purchase items.
+create or replace function transaction_balance_effects(
+    details jsonb
+)
+    returns table (
+        account_id       integer,
+        common_creditors double precision,
+        common_debitors  double precision,
+        positions        double precision
+    )
+as
+$$
+    with state as (
+        select
+            (details ->> 'value')::double precision                    as value,
+            (details ->> 'currency_conversion_rate')::double precision as currency_conversion_rate,
+            case
+                when jsonb_typeof(details -> 'purchase_items') = 'array' then details -> 'purchase_items'
+                else '[]'::jsonb
+            end                                                        as purchase_items
+        where
+            not (details ->> 'deleted')::bool
+    ),
+    items as (
+        select
+            (pi ->> 'price')::double precision                                 as price,
+            (pi ->> 'communist_shares')::double precision                      as communist_shares,
+            pi -> 'usages'                                                     as usages,
+            (pi ->> 'communist_shares')::double precision + coalesce((
+                select sum((u ->> 'share_amount')::double precision)
+                from jsonb_array_elements(pi -> 'usages') u
+            ), 0)                                                              as total_usages
+        from
+            state,
+            jsonb_array_elements(state.purchase_items) pi
+        where
+            not (pi ->> 'deleted')::bool
+    ),
+    remaining as (
+        select
+            state.value - coalesce((
+                select
+                    sum(items.price - case
+                                          when items.total_usages > 0
+                                              then items.price / items.total_usages * items.communist_shares
+                                          else 0
+                                      end)
+                from items
+            ), 0) as value
+        from state
+    ),
+    effects as (
+        select
+            (u ->> 'account_id')::integer as account_id,
+            0::double precision           as common_creditors,
+            0::double precision           as common_debitors,
+            case
+                when items.total_usages > 0
+                    then items.price / items.total_usages * (u ->> 'share_amount')::double precision
+                else 0
+            end                           as positions
+        from
+            items,
+            jsonb_array_elements(items.usages) u
+        union all
+        select
+            (cs ->> 'account_id')::integer                                                    as account_id,
+            state.value / (details ->> 'n_creditor_shares')::double precision
+                * (cs ->> 'shares')::double precision                                         as common_creditors,
+            0                                                                                 as common_debitors,
+            0                                                                                 as positions
+        from
+            state,
+            jsonb_array_elements(details -> 'creditor_shares') cs
+        union all
+        select
+            (ds ->> 'account_id')::integer                                                    as account_id,
+            0                                                                                 as common_creditors,
+            remaining.value / (details ->> 'n_debitor_shares')::double precision
+                * (ds ->> 'shares')::double precision                                         as common_debitors,
+            0                                                                                 as positions
+        from
+            remaining,
+            jsonb_array_elements(details -> 'debitor_shares') ds
+    )
+    select
+        effects.account_id,
+        sum(effects.common_creditors) * state.currency_conversion_rate,
+        sum(effects.common_debitors) * state.currency_conversion_rate,
+        sum(effects.positions) * state.currency_conversion_rate
+    from
+        effects,
+        state
+    group by
+        effects.account_id, state.currency_conversion_rate;
+$$ language sql immutable;
+
+-- committed balance of each account, updated incrementally whenever the committed state of a
+-- transaction changes.
+create table if not exists account_balance_cache (
+    account_id integer primary key references account (id) on delete cascade,
+    group_id   integer          not null references grp (id) on delete cascade,
+
+    balance    double precision not null default 0
+);
+
+create index if not exists account_balance_cache_group_idx on account_balance_cache (group_id);
+
+-- account balances of a group computed from scratch from the committed transaction states
+create or replace function compute_account_balances(
+    group_id integer
+)
+    returns table (
+        account_id integer,
+        balance    double precision
+    )
+as
+$$
+    select
+        e.account_id                                              as account_id,
+        sum(e.common_creditors - e.positions - e.common_debitors) as balance
+    from
+        committed_transaction_state cts,
+        transaction_balance_effects(to_jsonb(cts)) e
+    where
+        cts.group_id = compute_account_balances.group_id
+    group by
+        e.account_id;
+$$ language sql stable;
+
+-- apply the change of the committed state of a transaction to the account balance cache.
+-- old_details is the committed transaction state before the modification (null for the first commit),
+-- the new committed state is taken from transaction_snapshot, i.e. the snapshot has to be refreshed before.
+create or replace procedure apply_account_balance_delta(
+    transaction_id integer,
+    old_details jsonb
+) as
+$$
+<<locals>> declare
+    group_id    integer;
+    new_details jsonb;
+begin
+    select
+        ts.group_id,
+        ts.details
+    into locals.group_id, locals.new_details
+    from
+        transaction_snapshot ts
+    where
+        ts.transaction_id = apply_account_balance_delta.transaction_id
+        and ts.pending_user_id is null;
+
+    if locals.group_id is null then return; end if;
+
+    insert into account_balance_cache (account_id, group_id, balance)
+    select
+        delta.account_id,
+        locals.group_id,
+        sum(delta.balance)
+    from
+        (
+            select
+                e.account_id,
+                e.common_creditors - e.positions - e.common_debitors as balance
+            from
+                transaction_balance_effects(locals.new_details) e
+            union all
+            select
+                e.account_id,
+                -(e.common_creditors - e.positions - e.common_debitors) as balance
+            from
+                transaction_balance_effects(apply_account_balance_delta.old_details) e
+        ) delta
+    group by
+        delta.account_id
+    on conflict (account_id) do update set
+        balance = account_balance_cache.balance + excluded.balance;
+end
+$$ language plpgsql;
+
+-- recompute the whole account balance cache from the committed transaction states
+create or replace procedure rebuild_account_balance_cache() as
+$$
+begin
+    delete from account_balance_cache;
+
+    insert into account_balance_cache (account_id, group_id, balance)
+    select
+        e.account_id,
+        cts.group_id,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        committed_transaction_state cts,
+        transaction_balance_effects(to_jsonb(cts)) e
+    group by
+        e.account_id, cts.group_id;
+end
+$$ language plpgsql;
+
+call rebuild_account_balance_cache();
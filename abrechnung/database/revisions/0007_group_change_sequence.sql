@@ -0,0 +1,107 @@
+-- revision: f16baeeb
+-- requires: 041cce30
+
+-- monotonically increasing per-group counter of transaction changes.
+-- the row is locked by every modification of a transaction in the group until the database transaction
+-- commits, therefore sequence numbers become visible in the order they were handed out.
+create table if not exists group_change_sequence (
+    group_id integer primary key references grp (id) on delete cascade,
+    seq      bigint not null default 0
+);
+
+-- change sequence number of the last modification of the transaction this snapshot row belongs to,
+-- all rows of a transaction always share the same number.
+alter table transaction_snapshot add column if not exists change_seq bigint not null default 0;
+
+create index if not exists transaction_snapshot_change_seq_idx on transaction_snapshot (group_id, change_seq);
+
+insert into group_change_sequence (group_id, seq)
+select distinct
+    ts.group_id,
+    1
+from
+    transaction_snapshot ts
+on conflict do nothing;
+
+update transaction_snapshot set change_seq = 1;
+
+-- advance the change sequence of a group, returning the new sequence number
+create or replace function next_group_change_seq(
+    group_id integer
+) returns bigint as
+$$
+    insert into group_change_sequence (group_id, seq)
+    values (next_group_change_seq.group_id, 1)
+    on conflict (group_id) do update set seq = group_change_sequence.seq + 1
+    returning seq;
+$$ language sql;
+
+create or replace procedure refresh_transaction_snapshot(
+    transaction_id integer
+) as
+$$
+<<locals>> declare
+    change_seq bigint;
+begin
+    select
+        next_group_change_seq(t.group_id)
+    into locals.change_seq
+    from
+        transaction t
+    where
+        t.id = refresh_transaction_snapshot.transaction_id;
+
+    delete from transaction_snapshot ts where ts.transaction_id = refresh_transaction_snapshot.transaction_id;
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        locals.change_seq
+    from
+        transaction_snapshot_source src
+    where
+        src.transaction_id = refresh_transaction_snapshot.transaction_id;
+end
+$$ language plpgsql;
+
+-- rebuilding advances the change sequence of every group such that clients fetch all transactions again
+create or replace procedure rebuild_transaction_snapshots() as
+$$
+begin
+    delete from transaction_snapshot;
+
+    insert into group_change_sequence (group_id, seq)
+    select
+        grp.id,
+        1
+    from
+        grp
+    on conflict (group_id) do update set seq = group_change_sequence.seq + 1;
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        gcs.seq
+    from
+        transaction_snapshot_source src
+        join group_change_sequence gcs on gcs.group_id = src.group_id;
+end
+$$ language plpgsql;
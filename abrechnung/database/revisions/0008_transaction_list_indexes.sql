@@ -0,0 +1,46 @@
+-- revision: 1135ef2a
+-- requires: f16baeeb
+
+-- all accounts a transaction state refers to, either via creditor or debitor shares or purchase item usages.
+-- takes a transaction state as stored in transaction_snapshot.details
+create or replace function transaction_involved_accounts(
+    details jsonb
+) returns integer[] as
+$$
+    select
+        coalesce(array_agg(distinct accounts.account_id order by accounts.account_id), '{}'::integer[])
+    from
+        (
+            select (cs ->> 'account_id')::integer as account_id
+            from jsonb_array_elements(details -> 'creditor_shares') cs
+            union all
+            select (ds ->> 'account_id')::integer as account_id
+            from jsonb_array_elements(details -> 'debitor_shares') ds
+            union all
+            select (u ->> 'account_id')::integer as account_id
+            from
+                jsonb_array_elements(case
+                                         when jsonb_typeof(details -> 'purchase_items') = 'array'
+                                             then details -> 'purchase_items'
+                                         else '[]'::jsonb
+                                     end) pi,
+                jsonb_array_elements(pi -> 'usages') u
+        ) accounts;
+$$ language sql immutable;
+
+alter table transaction_snapshot
+    add column if not exists involved_accounts integer[]
+        generated always as (transaction_involved_accounts(details)) stored;
+
+-- keyset pagination over all visible transactions of a group ordered by (billed_at, transaction_id)
+create index if not exists transaction_snapshot_billed_at_idx
+    on transaction_snapshot (group_id, billed_at, transaction_id);
+-- the same for lists excluding deleted transactions
+create index if not exists transaction_snapshot_not_deleted_billed_at_idx
+    on transaction_snapshot (group_id, billed_at, transaction_id) where not deleted;
+-- transactions with pending changes of a specific user
+create index if not exists transaction_snapshot_pending_billed_at_idx
+    on transaction_snapshot (group_id, pending_user_id, billed_at, transaction_id) where pending_user_id is not null;
+-- transactions an account is involved in
+create index if not exists transaction_snapshot_involved_accounts_idx
+    on transaction_snapshot using gin (involved_accounts);
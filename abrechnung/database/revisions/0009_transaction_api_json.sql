@@ -0,0 +1,70 @@
+-- revision: de9812a1
+-- requires: 1135ef2a
+
+-- the api representation of a transaction state as returned by the http api.
+-- takes a transaction state as stored in transaction_snapshot.details
+create or replace function transaction_change_api_json(
+    details jsonb
+) returns jsonb as
+$$
+    select
+        jsonb_build_object(
+            'description', details -> 'description',
+            'value', details -> 'value',
+            'currency_symbol', details -> 'currency_symbol',
+            'currency_conversion_rate', details -> 'currency_conversion_rate',
+            'deleted', details -> 'deleted',
+            'billed_at', details -> 'billed_at',
+            'creditor_shares', coalesce((
+                select jsonb_object_agg(cs ->> 'account_id', cs -> 'shares')
+                from jsonb_array_elements(details -> 'creditor_shares') cs
+            ), '{}'::jsonb),
+            'debitor_shares', coalesce((
+                select jsonb_object_agg(ds ->> 'account_id', ds -> 'shares')
+                from jsonb_array_elements(details -> 'debitor_shares') ds
+            ), '{}'::jsonb),
+            'purchase_items', (
+                select
+                    jsonb_agg(jsonb_build_object(
+                        'id', pi.item -> 'id',
+                        'price', pi.item -> 'price',
+                        'communist_shares', pi.item -> 'communist_shares',
+                        'deleted', pi.item -> 'deleted',
+                        'name', pi.item -> 'name',
+                        'usages', coalesce((
+                            select jsonb_object_agg(u ->> 'account_id', u -> 'share_amount')
+                            from jsonb_array_elements(pi.item -> 'usages') u
+                        ), '{}'::jsonb)
+                    ) order by pi.idx)
+                from
+                    jsonb_array_elements(case
+                                             when jsonb_typeof(details -> 'purchase_items') = 'array'
+                                                 then details -> 'purchase_items'
+                                             else '[]'::jsonb
+                                         end) with ordinality pi(item, idx)
+            )
+        );
+$$ language sql immutable;
+
+alter table transaction_snapshot
+    add column if not exists api_json jsonb
+        generated always as (transaction_change_api_json(details)) stored;
+
+-- the api representation of whole transactions, including the committed state and all pending changes
+create or replace view transaction_api_json as
+    select
+        ts.group_id       as group_id,
+        ts.transaction_id as transaction_id,
+        jsonb_build_object(
+            'id', ts.transaction_id,
+            'type', min(ts.type),
+            'pending_changes', coalesce(
+                jsonb_object_agg(ts.pending_user_id::text, ts.api_json) filter ( where ts.pending_user_id is not null ),
+                '{}'::jsonb
+            ),
+            'current_state', (array_agg(ts.api_json) filter ( where ts.pending_user_id is null ))[1]
+        )                 as json
+    from
+        transaction_snapshot ts
+    group by
+        ts.group_id, ts.transaction_id;
@@ -0,0 +1,20 @@
+-- revision: 13cc15b3
+-- requires: de9812a1
+
+-- announce changed or removed group memberships to the api servers such that they can invalidate
+-- their cached group permissions
+create or replace function group_membership_changed() returns trigger as
+$$
+begin
+    perform pg_notify('group_membership_changed',
+                      json_build_object('group_id', OLD.group_id, 'user_id', OLD.user_id)::text);
+    return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists group_membership_changed_trig on group_membership;
+create trigger group_membership_changed_trig
+    after update or delete
+    on group_membership
+    for each row
+execute function group_membership_changed();
@@ -0,0 +1,20 @@
+-- revision: 9bcd650e
+-- requires: 13cc15b3
+
+-- announce removed or shortened sessions to the api servers such that they can invalidate
+-- their cached session validations
+create or replace function session_changed() returns trigger as
+$$
+begin
+    perform pg_notify('session_changed',
+                      json_build_object('session_id', OLD.id, 'user_id', OLD.user_id)::text);
+    return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists session_changed_trig on session;
+create trigger session_changed_trig
+    after update of valid_until or delete
+    on session
+    for each row
+execute function session_changed();
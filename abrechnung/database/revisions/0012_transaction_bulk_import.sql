@@ -0,0 +1,109 @@
+-- revision: d7b1581b
+-- requires: 9bcd650e
+
+-- bulk operations such as transaction imports set abrechnung.suppress_notifications to 'on' for the duration
+-- of their database transaction and send a single notification in the end instead of one per modified row.
+create or replace function notifications_suppressed() returns boolean as
+$$
+    select coalesce(current_setting('abrechnung.suppress_notifications', true), '') = 'on';
+$$ language sql stable;
+
+drop trigger if exists transaction_history_update_trig on transaction_history;
+create trigger transaction_history_update_trig
+    after insert or update or delete
+    on transaction_history
+    for each row
+    when (not notifications_suppressed())
+execute function transaction_history_updated();
+
+drop trigger if exists creditor_share_trig on creditor_share;
+create trigger creditor_share_trig
+    after insert or update or delete
+    on creditor_share
+    for each row
+    when (not notifications_suppressed())
+execute function transaction_share_updated();
+
+drop trigger if exists debitor_share_trig on debitor_share;
+create trigger debitor_share_trig
+    after insert or update or delete
+    on debitor_share
+    for each row
+    when (not notifications_suppressed())
+execute function transaction_share_updated();
+
+drop trigger if exists transaction_revision_trig on transaction_revision;
+create trigger transaction_revision_trig
+    after insert or update or delete
+    on transaction_revision
+    for each row
+    when (not notifications_suppressed())
+execute function transaction_revision_updated();
+
+drop trigger if exists purchase_item_trig on purchase_item_history;
+create trigger purchase_item_trig
+    after insert or update or delete
+    on purchase_item_history
+    for each row
+    when (not notifications_suppressed())
+execute function purchase_item_updated();
+
+drop trigger if exists purchase_item_usage_trig on purchase_item_usage;
+create trigger purchase_item_usage_trig
+    after insert or update or delete
+    on purchase_item_usage
+    for each row
+    when (not notifications_suppressed())
+execute function purchase_item_usage_updated();
+
+-- set based counterpart of refresh_transaction_snapshot and apply_account_balance_delta for transactions which
+-- have just been created and committed in bulk, all of them belonging to the given group.
+-- notifies the group members once about the new transactions.
+create or replace procedure finish_transaction_import(
+    group_id integer,
+    transaction_ids integer[]
+) as
+$$
+<<locals>> declare
+    change_seq bigint;
+begin
+    locals.change_seq := next_group_change_seq(finish_transaction_import.group_id);
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        locals.change_seq
+    from
+        transaction_snapshot_source src
+    where
+        src.transaction_id = any(finish_transaction_import.transaction_ids);
+
+    insert into account_balance_cache (account_id, group_id, balance)
+    select
+        e.account_id,
+        finish_transaction_import.group_id,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        transaction_snapshot ts,
+        transaction_balance_effects(ts.details) e
+    where
+        ts.transaction_id = any(finish_transaction_import.transaction_ids)
+        and ts.pending_user_id is null
+    group by
+        e.account_id
+    on conflict (account_id) do update set
+        balance = account_balance_cache.balance + excluded.balance;
+
+    call notify_group('transaction', finish_transaction_import.group_id, finish_transaction_import.group_id::bigint,
+                      json_build_object('element_id', finish_transaction_import.group_id, 'transaction_id', null));
+end
+$$ language plpgsql;
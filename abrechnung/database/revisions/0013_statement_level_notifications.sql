@@ -0,0 +1,129 @@
+-- revision: 06ef4fbd
+-- requires: d7b1581b
+
+-- the transaction notification triggers used to fire for every modified row, e.g. once per copied share
+-- and purchase item when creating a new pending change. They are replaced by statement level triggers
+-- which notify every affected (group, transaction) pair once per statement. Notifications with an
+-- identical payload issued by multiple statements are folded into one by postgres when committing.
+
+-- notify the group members of all transactions in the given list, which may contain duplicates
+create or replace procedure notify_transactions_changed(
+    transaction_ids integer[]
+) as
+$$
+<<locals>> declare
+    r record;
+begin
+    for r in select distinct
+                 t.group_id,
+                 t.id
+             from
+                 transaction t
+             where
+                 t.id = any(notify_transactions_changed.transaction_ids)
+        loop
+            call notify_group('transaction', r.group_id, r.group_id::bigint,
+                              json_build_object('element_id', r.group_id, 'transaction_id', r.id));
+        end loop;
+end;
+$$ language plpgsql;
+
+-- all statement level triggers below expose the modified rows as the transition table changed_rows
+create or replace function transaction_history_changed() returns trigger as
+$$
+<<locals>> declare
+    transaction_ids integer[];
+begin
+    locals.transaction_ids := array(select cr.id from changed_rows cr);
+    call notify_transactions_changed(locals.transaction_ids);
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace function transaction_share_changed() returns trigger as
+$$
+<<locals>> declare
+    transaction_ids integer[];
+begin
+    locals.transaction_ids := array(select cr.transaction_id from changed_rows cr);
+    call notify_transactions_changed(locals.transaction_ids);
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace function transaction_revision_changed() returns trigger as
+$$
+<<locals>> declare
+    transaction_ids integer[];
+begin
+    -- only committing a revision is of interest
+    locals.transaction_ids := array(select cr.transaction_id from changed_rows cr where cr.committed is not null);
+    call notify_transactions_changed(locals.transaction_ids);
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace function purchase_item_changed() returns trigger as
+$$
+<<locals>> declare
+    transaction_ids integer[];
+begin
+    locals.transaction_ids := array(select pi.transaction_id from changed_rows cr join purchase_item pi on pi.id = cr.id);
+    call notify_transactions_changed(locals.transaction_ids);
+    return null;
+end;
+$$ language plpgsql;
+
+create or replace function purchase_item_usage_changed() returns trigger as
+$$
+<<locals>> declare
+    transaction_ids integer[];
+begin
+    locals.transaction_ids := array(select pi.transaction_id from changed_rows cr join purchase_item pi on pi.id = cr.item_id);
+    call notify_transactions_changed(locals.transaction_ids);
+    return null;
+end;
+$$ language plpgsql;
+
+-- transition tables are only supported for triggers on a single event, hence three triggers per table
+drop trigger if exists transaction_history_update_trig on transaction_history;
+drop trigger if exists creditor_share_trig on creditor_share;
+drop trigger if exists debitor_share_trig on debitor_share;
+drop trigger if exists transaction_revision_trig on transaction_revision;
+drop trigger if exists purchase_item_trig on purchase_item_history;
+drop trigger if exists purchase_item_usage_trig on purchase_item_usage;
+
+create or replace procedure create_statement_notification_triggers(
+    table_name text,
+    function_name text
+) as
+$$
+<<locals>> declare
+    event text;
+begin
+    foreach locals.event in array array ['insert', 'update', 'delete']
+        loop
+            execute format('drop trigger if exists %I on %I', table_name || '_' || locals.event || '_notify_trig',
+                           table_name);
+            execute format('create trigger %I after %s on %I referencing %s table as changed_rows '
+                               'for each statement when (not notifications_suppressed()) execute function %I()',
+                           table_name || '_' || locals.event || '_notify_trig', locals.event, table_name,
+                           case when locals.event = 'delete' then 'old' else 'new' end, function_name);
+        end loop;
+end;
+$$ language plpgsql;
+
+call create_statement_notification_triggers('transaction_history', 'transaction_history_changed');
+call create_statement_notification_triggers('creditor_share', 'transaction_share_changed');
+call create_statement_notification_triggers('debitor_share', 'transaction_share_changed');
+call create_statement_notification_triggers('transaction_revision', 'transaction_revision_changed');
+call create_statement_notification_triggers('purchase_item_history', 'purchase_item_changed');
+call create_statement_notification_triggers('purchase_item_usage', 'purchase_item_usage_changed');
+
+drop procedure create_statement_notification_triggers;
+
+drop function if exists transaction_history_updated();
+drop function if exists transaction_share_updated();
+drop function if exists transaction_revision_updated();
+drop function if exists purchase_item_updated();
+drop function if exists purchase_item_usage_updated();
@@ -0,0 +1,157 @@
+-- revision: f82f3a69
+-- requires: 06ef4fbd
+
+-- websocket connections and their subscriptions are kept in memory by the forwarders.
+-- instead of resolving the subscribed connections inside of the modifying transaction, notifications
+-- are published once on the shared subscription_event channel which all forwarders listen on.
+--
+-- notification format on subscription_event:
+-- {
+--     "event": subscription type,
+--     "element_id": subscribed element,
+--     -- either the users whose subscriptions should receive the notification
+--     "user_ids": [user_id, ...],
+--     -- or the group whose subscribed members should receive the notification
+--     "group_id": group_id,
+--     "data": event specific data
+-- }
+
+-- raises if the user is not allowed to subscribe to the given element
+create or replace procedure check_subscription(
+    user_id integer,
+    subscription_type text,
+    element_id bigint
+) as
+$$
+begin
+    if check_subscription.element_id is null then raise exception 'invalid element_id value'; end if;
+
+    -- type-specific permission/value checks
+    if check_subscription.subscription_type = 'test' then
+        -- only allow element_id == user_id
+        if check_subscription.element_id != check_subscription.user_id then
+            raise 'test requires correct element_id';
+        end if;
+
+    elseif check_subscription.subscription_type = 'user' then
+    -- but the element we watch has to be the user id
+        if check_subscription.element_id != check_subscription.user_id then
+            raise 'element_id not logged in user user';
+        end if;
+
+    elseif check_subscription.subscription_type = 'group' then
+        if check_subscription.element_id != check_subscription.user_id then
+            raise 'bad-subscription:group: element_id not token user';
+        end if;
+
+    elseif check_subscription.subscription_type in ('account', 'group_member', 'group_invite', 'group_log', 'transaction') then
+        perform
+        from group_membership gm
+        where gm.user_id = check_subscription.user_id and gm.group_id = check_subscription.element_id::integer;
+        if not found then
+            raise 'user % tried to subscribe to changes in a group without being a member', check_subscription.user_id;
+        end if;
+
+    else
+        raise exception 'unknown subscription type';
+    end if;
+end
+$$ language plpgsql;
+
+create or replace procedure subscribe(
+    connection_id bigint,
+    user_id integer,
+    subscription_type text,
+    element_id bigint
+) as
+$$
+begin
+    call check_subscription(subscribe.user_id, subscribe.subscription_type, subscribe.element_id);
+
+    insert into subscription (
+        connection_id, user_id, subscription_type, element_id
+    )
+    values (
+        subscribe.connection_id,
+        subscribe.user_id,
+        subscribe.subscription_type,
+        subscribe.element_id
+    )
+    on conflict on constraint subscription_conn_type_elem do update set user_id = subscribe.user_id;
+end
+$$ language plpgsql;
+
+create or replace procedure notify_users(
+    subscription_type text,
+    user_ids int[],
+    element_id subscription.element_id%TYPE,
+    data json
+) as
+$$
+begin
+    if notify_users.user_ids is null or cardinality(notify_users.user_ids) = 0 then return; end if;
+
+    perform pg_notify('subscription_event',
+                      json_build_object('event', notify_users.subscription_type, 'element_id',
+                                        notify_users.element_id, 'user_ids', notify_users.user_ids, 'data',
+                                        notify_users.data)::text);
+end;
+$$ language plpgsql;
+
+create or replace procedure notify_user(
+    subscription_type text,
+    user_id subscription.user_id%TYPE,
+    element_id subscription.element_id%TYPE,
+    data json
+) as
+$$
+begin
+    call notify_users(notify_user.subscription_type, array [notify_user.user_id], notify_user.element_id,
+                      notify_user.data);
+end;
+$$ language plpgsql;
+
+-- subscriptions to group scoped types have been checked for group membership when subscribing, forwarders drop
+-- them when the membership ends. For all other types the group members are resolved here.
+create or replace procedure notify_group(
+    subscription_type text,
+    group_id grp.id%TYPE,
+    element_id subscription.element_id%TYPE,
+    data json
+) as
+$$
+<<locals>> declare
+    user_ids int[];
+begin
+    if notify_group.group_id is null then return; end if;
+
+    if notify_group.subscription_type in ('account', 'group_member', 'group_invite', 'group_log', 'transaction') then
+        perform pg_notify('subscription_event',
+                          json_build_object('event', notify_group.subscription_type, 'element_id',
+                                            notify_group.element_id, 'group_id', notify_group.group_id, 'data',
+                                            notify_group.data)::text);
+        return;
+    end if;
+
+    select
+        array_agg(gm.user_id)
+    into locals.user_ids
+    from
+        group_membership gm
+    where
+        gm.group_id = notify_group.group_id;
+
+    call notify_users(notify_group.subscription_type, locals.user_ids, notify_group.element_id, notify_group.data);
+end;
+$$ language plpgsql;
+
+-- forwarders additionally need to know whether a membership has ended
+create or replace function group_membership_changed() returns trigger as
+$$
+begin
+    perform pg_notify('group_membership_changed',
+                      json_build_object('group_id', OLD.group_id, 'user_id', OLD.user_id, 'deleted',
+                                        TG_OP = 'DELETE')::text);
+    return null;
+end;
+$$ language plpgsql;
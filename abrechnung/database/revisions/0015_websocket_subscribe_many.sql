@@ -0,0 +1,26 @@
+-- revision: 5e11390e
+-- requires: f82f3a69
+
+-- checks many subscriptions of a user in a single call, raises for the first one which is not allowed.
+-- the subscriptions are given as two arrays of the same length, subscription_types[i] and element_ids[i]
+-- describe a single subscription.
+create or replace procedure check_subscriptions(
+    user_id integer,
+    subscription_types text[],
+    element_ids bigint[]
+) as
+$$
+<<locals>> declare
+    i integer;
+begin
+    if cardinality(check_subscriptions.subscription_types) != cardinality(check_subscriptions.element_ids) then
+        raise exception 'subscription_types and element_ids must have the same length';
+    end if;
+
+    for i in 1 .. cardinality(check_subscriptions.subscription_types)
+        loop
+            call check_subscription(check_subscriptions.user_id, check_subscriptions.subscription_types[i],
+                                    check_subscriptions.element_ids[i]);
+        end loop;
+end
+$$ language plpgsql;
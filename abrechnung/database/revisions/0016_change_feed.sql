@@ -0,0 +1,102 @@
+-- revision: 16515e41
+-- requires: 5e11390e
+
+-- append-only log of all group scoped notifications. Entries are written in the same database transaction as
+-- the change they describe and numbered by the change sequence of their group, which is locked until the
+-- transaction commits. Entries of a group therefore become visible in the order of their sequence numbers,
+-- which allows forwarders to tail the feed per group and clients to resume from the last entry they have seen.
+create table if not exists change_feed (
+    group_id   integer     not null,
+    seq        bigint      not null,
+    event      text        not null,
+    element_id bigint      not null,
+    data       jsonb       not null,
+    xact_id    xid8        not null default pg_current_xact_id(),
+    created_at timestamptz not null default now(),
+    primary key (group_id, seq)
+);
+
+-- a change is only recorded once per database transaction, even if multiple statements report it
+create unique index if not exists change_feed_xact_idx on change_feed (group_id, xact_id, event, element_id, md5(data::text));
+
+create index if not exists change_feed_created_at_idx on change_feed (created_at);
+
+-- entries up to this sequence number might have been pruned from the change feed
+alter table group_change_sequence add column if not exists pruned_seq bigint not null default 0;
+
+-- group scoped notifications are written to the change feed, forwarders are woken up on the change_feed
+-- channel with {"group_id": ..., "seq": ...} and read the new entries from the table.
+-- Notifications for groups which are being deleted are published directly as they cannot be recorded anymore.
+create or replace procedure notify_group(
+    subscription_type text,
+    group_id grp.id%TYPE,
+    element_id subscription.element_id%TYPE,
+    data json
+) as
+$$
+<<locals>> declare
+    user_ids int[];
+    seq      bigint;
+begin
+    if notify_group.group_id is null then return; end if;
+
+    if notify_group.subscription_type in ('account', 'group_member', 'group_invite', 'group_log', 'transaction') then
+        if exists (select from grp where grp.id = notify_group.group_id) then
+            insert into change_feed (group_id, seq, event, element_id, data)
+            values (notify_group.group_id, next_group_change_seq(notify_group.group_id),
+                    notify_group.subscription_type, notify_group.element_id, notify_group.data)
+            on conflict do nothing
+            returning change_feed.seq into locals.seq;
+
+            if locals.seq is not null then
+                perform pg_notify('change_feed',
+                                  json_build_object('group_id', notify_group.group_id, 'seq', locals.seq)::text);
+            end if;
+        else
+            perform pg_notify('subscription_event',
+                              json_build_object('event', notify_group.subscription_type, 'element_id',
+                                                notify_group.element_id, 'group_id', notify_group.group_id, 'data',
+                                                notify_group.data)::text);
+        end if;
+        return;
+    end if;
+
+    select
+        array_agg(gm.user_id)
+    into locals.user_ids
+    from
+        group_membership gm
+    where
+        gm.group_id = notify_group.group_id;
+
+    call notify_users(notify_group.subscription_type, locals.user_ids, notify_group.element_id, notify_group.data);
+end;
+$$ language plpgsql;
+
+-- remove change feed entries older than the given retention, clients which have not seen them need to resync
+create or replace procedure prune_change_feed(
+    retention interval
+) as
+$$
+begin
+    with pruned as (
+        delete from change_feed cf
+            where cf.created_at < now() - prune_change_feed.retention
+            returning cf.group_id, cf.seq
+    )
+    update group_change_sequence gcs
+    set
+        pruned_seq = greatest(gcs.pruned_seq, p.seq)
+    from
+        (
+            select
+                pruned.group_id,
+                max(pruned.seq) as seq
+            from
+                pruned
+            group by pruned.group_id
+        ) p
+    where
+        gcs.group_id = p.group_id;
+end
+$$ language plpgsql;
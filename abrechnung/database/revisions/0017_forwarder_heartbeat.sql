@@ -0,0 +1,72 @@
+-- revision: cfff3a58
+-- requires: 16515e41
+
+-- forwarders regularly report that they are alive, forwarders which have not done so for a while have most
+-- likely crashed and are removed together with everything they left behind by reap_forwarders.
+alter table forwarder add column if not exists started timestamptz not null default now();
+alter table forwarder add column if not exists last_seen timestamptz not null default now();
+-- forwarders may be configured differently, each one is judged by its own heartbeat interval
+alter table forwarder add column if not exists heartbeat_interval interval not null default '30 seconds';
+
+create or replace function forwarder_boot(
+    id text, out channel_id bigint
+) as
+$$
+<<locals>> declare
+    channel_number forwarder.channel_id%type;
+begin
+    -- check if this forwarder is already connected
+    select forwarder.channel_id into locals.channel_number from forwarder where forwarder.id = forwarder_boot.id;
+
+    -- either register the new forwarder
+    if locals.channel_number is null then
+        insert into forwarder (
+            id
+        )
+        values (
+            forwarder_boot.id
+        )
+        returning forwarder.channel_id into locals.channel_number;
+    else -- or get rid of potential old entries of a re-booted forwarder
+    -- (these are left over if a forwarder crashes)
+        delete
+        from
+            connection
+        where
+            connection.channel_id = locals.channel_number;
+
+        update forwarder set started = now(), last_seen = now() where forwarder.id = forwarder_boot.id;
+    end if;
+
+    forwarder_boot.channel_id := locals.channel_number;
+end
+$$ language plpgsql;
+
+-- to be called periodically by every running forwarder,
+-- registers the forwarder again in case it has been reaped in the meantime
+create or replace procedure forwarder_heartbeat(
+    id text,
+    heartbeat_interval interval
+) as
+$$
+begin
+    insert into forwarder (id, heartbeat_interval)
+    values (forwarder_heartbeat.id, forwarder_heartbeat.heartbeat_interval)
+    on conflict on constraint forwarder_pkey do update set last_seen = now(), heartbeat_interval = forwarder_heartbeat.heartbeat_interval;
+end
+$$ language plpgsql;
+
+-- removes all forwarders which have missed the given number of heartbeats,
+-- returns the ids of the removed forwarders
+create or replace function reap_forwarders(
+    missed_heartbeats integer
+) returns setof text as
+$$
+    -- ON DELETE CASCADE actions will take care of cleaning up the connections and subscriptions
+    delete
+    from
+        forwarder
+    where
+        forwarder.last_seen < now() - forwarder.heartbeat_interval * reap_forwarders.missed_heartbeats
+    returning forwarder.id;
+$$ language sql;
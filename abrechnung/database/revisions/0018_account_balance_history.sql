@@ -0,0 +1,188 @@
+-- revision: 745e70d3
+-- requires: cfff3a58
+
+-- committed balance changes of each account per day they were billed at, updated incrementally together with
+-- account_balance_cache. the balance of an account at the end of a day is the sum of all deltas up to that day.
+create table if not exists account_balance_history (
+    account_id integer          not null references account (id) on delete cascade,
+    group_id   integer          not null references grp (id) on delete cascade,
+    day        date             not null,
+
+    delta      double precision not null default 0,
+
+    primary key (account_id, day)
+);
+
+create index if not exists account_balance_history_group_idx on account_balance_history (group_id, day);
+
+create or replace procedure apply_account_balance_delta(
+    transaction_id integer,
+    old_details jsonb
+) as
+$$
+<<locals>> declare
+    group_id    integer;
+    new_details jsonb;
+begin
+    select
+        ts.group_id,
+        ts.details
+    into locals.group_id, locals.new_details
+    from
+        transaction_snapshot ts
+    where
+        ts.transaction_id = apply_account_balance_delta.transaction_id
+        and ts.pending_user_id is null;
+
+    if locals.group_id is null then return; end if;
+
+    with delta as (
+        select
+            e.account_id,
+            (locals.new_details ->> 'billed_at')::date           as day,
+            e.common_creditors - e.positions - e.common_debitors as balance
+        from
+            transaction_balance_effects(locals.new_details) e
+        union all
+        select
+            e.account_id,
+            (apply_account_balance_delta.old_details ->> 'billed_at')::date as day,
+            -(e.common_creditors - e.positions - e.common_debitors)         as balance
+        from
+            transaction_balance_effects(apply_account_balance_delta.old_details) e
+    ),
+    cache_update as (
+        insert into account_balance_cache (account_id, group_id, balance)
+        select
+            delta.account_id,
+            locals.group_id,
+            sum(delta.balance)
+        from
+            delta
+        group by
+            delta.account_id
+        on conflict (account_id) do update set
+            balance = account_balance_cache.balance + excluded.balance
+    )
+    insert into account_balance_history (account_id, group_id, day, delta)
+    select
+        delta.account_id,
+        locals.group_id,
+        delta.day,
+        sum(delta.balance)
+    from
+        delta
+    group by
+        delta.account_id, delta.day
+    on conflict (account_id, day) do update set
+        delta = account_balance_history.delta + excluded.delta;
+
+    -- days on which the changes of an account cancelled out, e.g. as a transaction was moved to another day
+    delete from account_balance_history h
+    where
+        h.group_id = locals.group_id
+        and h.day in ((locals.new_details ->> 'billed_at')::date,
+                      (apply_account_balance_delta.old_details ->> 'billed_at')::date)
+        and abs(h.delta) < 1e-9;
+end
+$$ language plpgsql;
+
+create or replace procedure finish_transaction_import(
+    group_id integer,
+    transaction_ids integer[]
+) as
+$$
+<<locals>> declare
+    change_seq bigint;
+begin
+    locals.change_seq := next_group_change_seq(finish_transaction_import.group_id);
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        locals.change_seq
+    from
+        transaction_snapshot_source src
+    where
+        src.transaction_id = any(finish_transaction_import.transaction_ids);
+
+    insert into account_balance_cache (account_id, group_id, balance)
+    select
+        e.account_id,
+        finish_transaction_import.group_id,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        transaction_snapshot ts,
+        transaction_balance_effects(ts.details) e
+    where
+        ts.transaction_id = any(finish_transaction_import.transaction_ids)
+        and ts.pending_user_id is null
+    group by
+        e.account_id
+    on conflict (account_id) do update set
+        balance = account_balance_cache.balance + excluded.balance;
+
+    insert into account_balance_history (account_id, group_id, day, delta)
+    select
+        e.account_id,
+        finish_transaction_import.group_id,
+        ts.billed_at,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        transaction_snapshot ts,
+        transaction_balance_effects(ts.details) e
+    where
+        ts.transaction_id = any(finish_transaction_import.transaction_ids)
+        and ts.pending_user_id is null
+    group by
+        e.account_id, ts.billed_at
+    on conflict (account_id, day) do update set
+        delta = account_balance_history.delta + excluded.delta;
+
+    call notify_group('transaction', finish_transaction_import.group_id, finish_transaction_import.group_id::bigint,
+                      json_build_object('element_id', finish_transaction_import.group_id, 'transaction_id', null));
+end
+$$ language plpgsql;
+
+-- recompute the account balance cache and history from the committed transaction states
+create or replace procedure rebuild_account_balance_cache() as
+$$
+begin
+    delete from account_balance_cache;
+    delete from account_balance_history;
+
+    insert into account_balance_cache (account_id, group_id, balance)
+    select
+        e.account_id,
+        cts.group_id,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        committed_transaction_state cts,
+        transaction_balance_effects(to_jsonb(cts)) e
+    group by
+        e.account_id, cts.group_id;
+
+    insert into account_balance_history (account_id, group_id, day, delta)
+    select
+        e.account_id,
+        cts.group_id,
+        cts.billed_at,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        committed_transaction_state cts,
+        transaction_balance_effects(to_jsonb(cts)) e
+    group by
+        e.account_id, cts.group_id, cts.billed_at;
+end
+$$ language plpgsql;
+
+call rebuild_account_balance_cache();
@@ -0,0 +1,8 @@
+-- revision: 7d562029
+-- requires: 745e70d3
+
+-- shares and purchase item usages of an account across all transactions and revisions,
+-- used when looking up the transactions an account is involved in and when deleting accounts
+create index if not exists creditor_share_account_idx on creditor_share (account_id);
+create index if not exists debitor_share_account_idx on debitor_share (account_id);
+create index if not exists purchase_item_usage_account_idx on purchase_item_usage (account_id);
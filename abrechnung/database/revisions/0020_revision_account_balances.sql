@@ -0,0 +1,61 @@
+-- revision: d117d109
+-- requires: 7d562029
+
+-- the effect of a transaction state on the balance of each account involved in it as returned by
+-- transaction_balance_effects, as a json object keyed by account id
+create or replace function transaction_account_balances(
+    details jsonb
+) returns jsonb as
+$$
+    select
+        coalesce(jsonb_object_agg(e.account_id, jsonb_build_object(
+            'common_creditors', e.common_creditors,
+            'positions', e.positions,
+            'common_debitors', e.common_debitors
+        )), '{}'::jsonb)
+    from
+        transaction_balance_effects(details) e;
+$$ language sql immutable;
+
+-- per account breakdown of committed transaction revisions. committed revisions never change, the breakdown is
+-- computed once when the revision first appears as the committed state in transaction_snapshot.
+create table if not exists revision_account_balances (
+    revision_id      bigint primary key references transaction_revision (id) on delete cascade,
+
+    account_balances jsonb not null
+);
+
+create or replace function transaction_snapshot_inserted() returns trigger as
+$$
+begin
+    insert into revision_account_balances (revision_id, account_balances)
+    select
+        cr.revision_id,
+        transaction_account_balances(cr.details)
+    from
+        changed_rows cr
+    where
+        cr.pending_user_id is null
+        and not exists(select from revision_account_balances rab where rab.revision_id = cr.revision_id)
+    on conflict (revision_id) do nothing;
+    return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists transaction_snapshot_insert_trig on transaction_snapshot;
+create trigger transaction_snapshot_insert_trig
+    after insert
+    on transaction_snapshot
+    referencing new table as changed_rows
+    for each statement
+execute function transaction_snapshot_inserted();
+
+insert into revision_account_balances (revision_id, account_balances)
+select
+    ts.revision_id,
+    transaction_account_balances(ts.details)
+from
+    transaction_snapshot ts
+where
+    ts.pending_user_id is null
+on conflict (revision_id) do nothing;
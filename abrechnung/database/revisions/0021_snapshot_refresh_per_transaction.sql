@@ -0,0 +1,252 @@
+-- revision: dedcc471
+-- requires: d117d109
+
+create index if not exists transaction_revision_transaction_idx on transaction_revision (transaction_id);
+create index if not exists purchase_item_transaction_idx on purchase_item (transaction_id);
+
+-- the snapshot rows of a single transaction, computed from the history tables.
+-- produces the same details as committed_transaction_state and pending_transaction_revisions but only
+-- touches the revisions, shares and purchase items of the given transaction, the views are aggregated
+-- over the whole history before any filter on the transaction can be applied.
+create or replace function transaction_snapshot_rows(
+    transaction_id integer
+)
+    returns table (
+        revision_id     bigint,
+        group_id        integer,
+        type            text,
+        pending_user_id integer,
+        billed_at       date,
+        deleted         boolean,
+        details         jsonb
+    )
+as
+$$
+    with revision_history as (
+        select
+            t.id                       as id,
+            t.type                     as type,
+            t.group_id                 as group_id,
+            history.revision_id        as revision_id,
+            r.started                  as revision_started,
+            r.committed                as revision_committed,
+            history.deleted            as deleted,
+            history.description        as description,
+            history.value              as value,
+            history.billed_at          as billed_at,
+            r.user_id                  as last_changed_by,
+            history.currency_symbol    as currency_symbol,
+            history.currency_conversion_rate as currency_conversion_rate
+        from
+            transaction t
+            join transaction_revision r on r.transaction_id = t.id
+            join transaction_history history on history.id = t.id and history.revision_id = r.id
+        where
+            t.id = transaction_snapshot_rows.transaction_id
+    ),
+    committed_history as (
+        select
+            h.*
+        from
+            revision_history h
+        where
+            h.revision_committed is not null
+        order by
+            h.revision_committed desc
+        limit 1
+    ),
+    pending_history as (
+        select distinct on (gm.user_id)
+            h.*,
+            gm.user_id as user_id
+        from
+            revision_history h
+            join group_membership gm on gm.group_id = h.group_id and gm.user_id = h.last_changed_by
+        where
+            h.revision_committed is null
+    ),
+    creditor_shares as (
+        select
+            cs.revision_id      as revision_id,
+            sum(cs.shares)      as n_shares,
+            json_agg(cs order by cs.account_id) as shares
+        from
+            creditor_share cs
+        where
+            cs.transaction_id = transaction_snapshot_rows.transaction_id
+        group by
+            cs.revision_id
+    ),
+    debitor_shares as (
+        select
+            ds.revision_id      as revision_id,
+            sum(ds.shares)      as n_shares,
+            json_agg(ds order by ds.account_id) as shares
+        from
+            debitor_share ds
+        where
+            ds.transaction_id = transaction_snapshot_rows.transaction_id
+        group by
+            ds.revision_id
+    ),
+    item_history as (
+        select
+            pi.id               as id,
+            pi.transaction_id   as transaction_id,
+            t.group_id          as group_id,
+            pih.revision_id     as revision_id,
+            r.started           as revision_started,
+            r.committed         as revision_committed,
+            pih.deleted         as deleted,
+            pih.name            as name,
+            pih.price           as price,
+            pih.communist_shares as communist_shares,
+            r.user_id           as last_changed_by,
+            piu.n_usages        as n_usages,
+            coalesce(piu.usages, '[]'::json) as usages
+        from
+            purchase_item pi
+            join transaction t on t.id = pi.transaction_id
+            join purchase_item_history pih on pih.id = pi.id
+            join transaction_revision r on r.id = pih.revision_id and r.transaction_id = pi.transaction_id
+            left join lateral (
+                select
+                    sum(u.share_amount)                as n_usages,
+                    json_agg(u order by u.account_id)  as usages
+                from
+                    purchase_item_usage u
+                where
+                    u.item_id = pi.id
+                    and u.revision_id = pih.revision_id
+            ) piu on true
+        where
+            pi.transaction_id = transaction_snapshot_rows.transaction_id
+    ),
+    committed_items as (
+        select distinct on (h.id)
+            h.*
+        from
+            item_history h
+        where
+            h.revision_committed is not null
+        order by
+            h.id,
+            h.revision_committed desc
+    ),
+    pending_items as (
+        select distinct on (h.id, gm.user_id)
+            h.*,
+            gm.user_id as user_id
+        from
+            item_history h
+            join group_membership gm on gm.group_id = h.group_id and gm.user_id = h.last_changed_by
+        where
+            h.revision_committed is null
+    )
+    select
+        cts.revision_id,
+        cts.group_id,
+        cts.type,
+        null::integer,
+        cts.billed_at,
+        cts.deleted,
+        to_jsonb(cts)
+    from
+        (
+            select
+                history.*,
+                cs.n_shares                        as n_creditor_shares,
+                ds.n_shares                        as n_debitor_shares,
+                coalesce(cs.shares, '[]'::json)    as creditor_shares,
+                coalesce(ds.shares, '[]'::json)    as debitor_shares,
+                (
+                    select json_agg(cpis order by cpis.id) from committed_items cpis
+                )                                  as purchase_items
+            from
+                committed_history history
+                left join creditor_shares cs on cs.revision_id = history.revision_id
+                left join debitor_shares ds on ds.revision_id = history.revision_id
+        ) cts
+    union all
+    select
+        ptr.revision_id,
+        ptr.group_id,
+        ptr.type,
+        ptr.user_id,
+        ptr.billed_at,
+        ptr.deleted,
+        to_jsonb(ptr)
+    from
+        (
+            select
+                history.*,
+                cs.n_shares                        as n_creditor_shares,
+                ds.n_shares                        as n_debitor_shares,
+                coalesce(cs.shares, '[]'::json)    as creditor_shares,
+                coalesce(ds.shares, '[]'::json)    as debitor_shares,
+                (
+                    select
+                        json_agg(ppif order by ppif.id)
+                    from
+                        pending_items ppif
+                    where
+                        ppif.user_id = history.user_id
+                )                                  as purchase_items
+            from
+                pending_history history
+                left join creditor_shares cs on cs.revision_id = history.revision_id
+                left join debitor_shares ds on ds.revision_id = history.revision_id
+        ) ptr;
+$$ language sql stable;
+
+create or replace view transaction_snapshot_source as
+    select
+        src.revision_id     as revision_id,
+        t.id                as transaction_id,
+        src.group_id        as group_id,
+        src.type            as type,
+        src.pending_user_id as pending_user_id,
+        src.billed_at       as billed_at,
+        src.deleted         as deleted,
+        src.details         as details
+    from
+        transaction t
+        cross join lateral transaction_snapshot_rows(t.id) src;
+
+create or replace procedure refresh_transaction_snapshot(
+    transaction_id integer
+) as
+$$
+<<locals>> declare
+    change_seq bigint;
+begin
+    select
+        next_group_change_seq(t.group_id)
+    into locals.change_seq
+    from
+        transaction t
+    where
+        t.id = refresh_transaction_snapshot.transaction_id;
+
+    delete from transaction_snapshot ts where ts.transaction_id = refresh_transaction_snapshot.transaction_id;
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        refresh_transaction_snapshot.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        locals.change_seq
+    from
+        transaction_snapshot_rows(refresh_transaction_snapshot.transaction_id) src;
+end
+$$ language plpgsql;
+
+-- purchase items and shares are now stored in a stable order
+call rebuild_transaction_snapshots();
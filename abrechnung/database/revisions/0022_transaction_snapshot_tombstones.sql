@@ -0,0 +1,113 @@
+-- revision: 82d773d4
+-- requires: dedcc471
+
+-- transactions whose snapshot rows have all been removed, e.g. when the only pending change of a transaction
+-- belongs to a user who left the group. Recorded with the change sequence number of the removal such that
+-- clients syncing changes of a group learn that the transaction is gone.
+create table if not exists transaction_snapshot_tombstone (
+    transaction_id integer primary key references transaction (id) on delete cascade,
+    group_id       integer not null references grp (id) on delete cascade,
+    change_seq     bigint  not null
+);
+
+create index if not exists transaction_snapshot_tombstone_change_seq_idx on transaction_snapshot_tombstone (group_id, change_seq);
+
+create or replace procedure refresh_transaction_snapshot(
+    transaction_id integer
+) as
+$$
+<<locals>> declare
+    change_seq bigint;
+    n_removed  bigint;
+begin
+    select
+        next_group_change_seq(t.group_id)
+    into locals.change_seq
+    from
+        transaction t
+    where
+        t.id = refresh_transaction_snapshot.transaction_id;
+
+    delete from transaction_snapshot ts where ts.transaction_id = refresh_transaction_snapshot.transaction_id;
+    get diagnostics locals.n_removed = row_count;
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        refresh_transaction_snapshot.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        locals.change_seq
+    from
+        transaction_snapshot_rows(refresh_transaction_snapshot.transaction_id) src;
+
+    if found then
+        delete from transaction_snapshot_tombstone tst
+        where tst.transaction_id = refresh_transaction_snapshot.transaction_id;
+    elsif locals.n_removed > 0 then
+        insert into transaction_snapshot_tombstone (transaction_id, group_id, change_seq)
+        select
+            t.id,
+            t.group_id,
+            locals.change_seq
+        from
+            transaction t
+        where
+            t.id = refresh_transaction_snapshot.transaction_id
+        on conflict on constraint transaction_snapshot_tombstone_pkey do update set change_seq = excluded.change_seq;
+    end if;
+end
+$$ language plpgsql;
+
+-- rebuilding advances the change sequence of every group such that clients fetch all transactions again,
+-- transactions without any snapshot rows are reported as removed with the new sequence number
+create or replace procedure rebuild_transaction_snapshots() as
+$$
+begin
+    delete from transaction_snapshot;
+
+    insert into group_change_sequence (group_id, seq)
+    select
+        grp.id,
+        1
+    from
+        grp
+    on conflict (group_id) do update set seq = group_change_sequence.seq + 1;
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        gcs.seq
+    from
+        transaction_snapshot_source src
+        join group_change_sequence gcs on gcs.group_id = src.group_id;
+
+    delete from transaction_snapshot_tombstone;
+
+    insert into transaction_snapshot_tombstone (transaction_id, group_id, change_seq)
+    select
+        t.id,
+        t.group_id,
+        gcs.seq
+    from
+        transaction t
+        join group_change_sequence gcs on gcs.group_id = t.group_id
+    where
+        not exists (select from transaction_snapshot ts where ts.transaction_id = t.id);
+end
+$$ language plpgsql;
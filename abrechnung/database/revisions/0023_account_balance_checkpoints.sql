@@ -0,0 +1,277 @@
+-- revision: a299c19e
+-- requires: 82d773d4
+
+-- committed balance of each account at the end of every month in which it changed. the balance at the end of a
+-- day is the latest checkpoint before its month plus the daily changes within the month, such that reading it
+-- does not require summing up the complete history of the account.
+create table if not exists account_balance_checkpoint (
+    account_id integer          not null references account (id) on delete cascade,
+    group_id   integer          not null references grp (id) on delete cascade,
+    month      date             not null,
+
+    balance    double precision not null,
+
+    primary key (account_id, month)
+);
+
+create index if not exists account_balance_checkpoint_group_idx on account_balance_checkpoint (group_id, month);
+
+-- record a committed balance change of an account on the given day in the history and the checkpoints
+create or replace procedure add_account_balance_delta(
+    account_id integer,
+    group_id integer,
+    day date,
+    delta double precision
+) as
+$$
+<<locals>> declare
+    month date := date_trunc('month', add_account_balance_delta.day::timestamp)::date;
+begin
+    insert into account_balance_history (account_id, group_id, day, delta)
+    values (add_account_balance_delta.account_id, add_account_balance_delta.group_id, add_account_balance_delta.day,
+            add_account_balance_delta.delta)
+    on conflict on constraint account_balance_history_pkey do update set
+        delta = account_balance_history.delta + excluded.delta;
+
+    -- a new checkpoint starts with the balance at the end of the previous month the account changed in
+    insert into account_balance_checkpoint (account_id, group_id, month, balance)
+    values (add_account_balance_delta.account_id, add_account_balance_delta.group_id, locals.month, coalesce((
+        select
+            c.balance
+        from
+            account_balance_checkpoint c
+        where
+            c.account_id = add_account_balance_delta.account_id
+            and c.month < locals.month
+        order by
+            c.month desc
+        limit 1
+    ), 0))
+    on conflict on constraint account_balance_checkpoint_pkey do nothing;
+
+    update account_balance_checkpoint c
+    set
+        balance = c.balance + add_account_balance_delta.delta
+    where
+        c.account_id = add_account_balance_delta.account_id
+        and c.month >= locals.month;
+
+    -- the changes of the account on this day cancelled out, e.g. as a transaction was moved to another day
+    delete from account_balance_history h
+    where
+        h.account_id = add_account_balance_delta.account_id
+        and h.day = add_account_balance_delta.day
+        and abs(h.delta) < 1e-9;
+
+    if found and not exists(
+        select
+        from
+            account_balance_history h
+        where
+            h.account_id = add_account_balance_delta.account_id
+            and h.day >= locals.month
+            and h.day < locals.month + interval '1 month'
+    ) then
+        delete from account_balance_checkpoint c
+        where
+            c.account_id = add_account_balance_delta.account_id
+            and c.month = locals.month;
+    end if;
+end
+$$ language plpgsql;
+
+-- recompute the checkpoints of all accounts of a group from their balance history, of all groups if null is given
+create or replace procedure rebuild_account_balance_checkpoints(
+    group_id integer
+) as
+$$
+begin
+    delete from account_balance_checkpoint c
+    where
+        rebuild_account_balance_checkpoints.group_id is null
+        or c.group_id = rebuild_account_balance_checkpoints.group_id;
+
+    insert into account_balance_checkpoint (account_id, group_id, month, balance)
+    select
+        m.account_id,
+        m.group_id,
+        m.month,
+        sum(m.delta) over (partition by m.account_id order by m.month)
+    from
+        (
+            select
+                h.account_id,
+                h.group_id,
+                date_trunc('month', h.day::timestamp)::date as month,
+                sum(h.delta)                                 as delta
+            from
+                account_balance_history h
+            where
+                rebuild_account_balance_checkpoints.group_id is null
+                or h.group_id = rebuild_account_balance_checkpoints.group_id
+            group by
+                h.account_id, h.group_id, date_trunc('month', h.day::timestamp)
+        ) m;
+end
+$$ language plpgsql;
+
+create or replace procedure apply_account_balance_delta(
+    transaction_id integer,
+    old_details jsonb
+) as
+$$
+<<locals>> declare
+    group_id    integer;
+    new_details jsonb;
+    change      record;
+begin
+    select
+        ts.group_id,
+        ts.details
+    into locals.group_id, locals.new_details
+    from
+        transaction_snapshot ts
+    where
+        ts.transaction_id = apply_account_balance_delta.transaction_id
+        and ts.pending_user_id is null;
+
+    if locals.group_id is null then return; end if;
+
+    for locals.change in
+        select
+            delta.account_id,
+            delta.day,
+            sum(delta.balance) as balance
+        from
+            (
+                select
+                    e.account_id,
+                    (locals.new_details ->> 'billed_at')::date           as day,
+                    e.common_creditors - e.positions - e.common_debitors as balance
+                from
+                    transaction_balance_effects(locals.new_details) e
+                union all
+                select
+                    e.account_id,
+                    (apply_account_balance_delta.old_details ->> 'billed_at')::date as day,
+                    -(e.common_creditors - e.positions - e.common_debitors)         as balance
+                from
+                    transaction_balance_effects(apply_account_balance_delta.old_details) e
+            ) delta
+        group by
+            delta.account_id, delta.day
+    loop
+        insert into account_balance_cache (account_id, group_id, balance)
+        values (locals.change.account_id, locals.group_id, locals.change.balance)
+        on conflict (account_id) do update set
+            balance = account_balance_cache.balance + excluded.balance;
+
+        call add_account_balance_delta(locals.change.account_id, locals.group_id, locals.change.day,
+                                       locals.change.balance);
+    end loop;
+end
+$$ language plpgsql;
+
+create or replace procedure finish_transaction_import(
+    group_id integer,
+    transaction_ids integer[]
+) as
+$$
+<<locals>> declare
+    change_seq bigint;
+begin
+    locals.change_seq := next_group_change_seq(finish_transaction_import.group_id);
+
+    insert into transaction_snapshot (
+        revision_id, transaction_id, group_id, type, pending_user_id, billed_at, deleted, details, change_seq
+    )
+    select
+        src.revision_id,
+        src.transaction_id,
+        src.group_id,
+        src.type,
+        src.pending_user_id,
+        src.billed_at,
+        src.deleted,
+        src.details,
+        locals.change_seq
+    from
+        transaction_snapshot_source src
+    where
+        src.transaction_id = any(finish_transaction_import.transaction_ids);
+
+    insert into account_balance_cache (account_id, group_id, balance)
+    select
+        e.account_id,
+        finish_transaction_import.group_id,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        transaction_snapshot ts,
+        transaction_balance_effects(ts.details) e
+    where
+        ts.transaction_id = any(finish_transaction_import.transaction_ids)
+        and ts.pending_user_id is null
+    group by
+        e.account_id
+    on conflict (account_id) do update set
+        balance = account_balance_cache.balance + excluded.balance;
+
+    insert into account_balance_history (account_id, group_id, day, delta)
+    select
+        e.account_id,
+        finish_transaction_import.group_id,
+        ts.billed_at,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        transaction_snapshot ts,
+        transaction_balance_effects(ts.details) e
+    where
+        ts.transaction_id = any(finish_transaction_import.transaction_ids)
+        and ts.pending_user_id is null
+    group by
+        e.account_id, ts.billed_at
+    on conflict (account_id, day) do update set
+        delta = account_balance_history.delta + excluded.delta;
+
+    call rebuild_account_balance_checkpoints(finish_transaction_import.group_id);
+
+    call notify_group('transaction', finish_transaction_import.group_id, finish_transaction_import.group_id::bigint,
+                      json_build_object('element_id', finish_transaction_import.group_id, 'transaction_id', null));
+end
+$$ language plpgsql;
+
+-- recompute the account balance cache, history and checkpoints from the committed transaction states
+create or replace procedure rebuild_account_balance_cache() as
+$$
+begin
+    delete from account_balance_cache;
+    delete from account_balance_history;
+
+    insert into account_balance_cache (account_id, group_id, balance)
+    select
+        e.account_id,
+        cts.group_id,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        committed_transaction_state cts,
+        transaction_balance_effects(to_jsonb(cts)) e
+    group by
+        e.account_id, cts.group_id;
+
+    insert into account_balance_history (account_id, group_id, day, delta)
+    select
+        e.account_id,
+        cts.group_id,
+        cts.billed_at,
+        sum(e.common_creditors - e.positions - e.common_debitors)
+    from
+        committed_transaction_state cts,
+        transaction_balance_effects(to_jsonb(cts)) e
+    group by
+        e.account_id, cts.group_id, cts.billed_at;
+
+    call rebuild_account_balance_checkpoints(null);
+end
+$$ language plpgsql;
+
+call rebuild_account_balance_checkpoints(null);
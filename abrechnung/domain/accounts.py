@@ -1,5 +1,7 @@
 from dataclasses import dataclass
+from datetime import date
 from enum import Enum
+from typing import Optional
 
 
 class AccountType(Enum):
@@ -15,3 +17,34 @@ class Account:
     priority: int
     # created_by: int
     deleted: bool
+
+
+@dataclass
+class AccountBalance:
+    account_id: int
+    balance: float
+    # only set when verifying the cached balance against a full recomputation
+    computed_balance: Optional[float] = None
+
+
+@dataclass
+class AccountBalanceHistory:
+    account_id: int
+    # start of each period with committed changes to the balance, in ascending order
+    periods: list[date]
+    # balance at the end of each period
+    balances: list[float]
+
+
+@dataclass
+class LedgerEntry:
+    transaction_id: int
+    type: str
+    description: str
+    billed_at: date
+    # effect of the committed transaction state on the balance of the account, in the group currency
+    credit: float
+    # includes the purchase items billed to the account
+    debit: float
+    # balance of the account after this transaction
+    balance: float
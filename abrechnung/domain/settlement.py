@@ -0,0 +1,18 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class SettlementTransfer:
+    # the account with a negative balance paying the amount to the account with a positive balance
+    from_account_id: int
+    to_account_id: int
+    amount: float
+
+
+@dataclass
+class Settlement:
+    # change sequence number of the group the settlement has been computed for
+    change_seq: int
+    # whether the number of transfers is guaranteed to be minimal
+    exact: bool
+    transfers: list[SettlementTransfer]
@@ -23,6 +23,15 @@ class PurchaseItem:
     usages: dict[int, float]
 
 
+@dataclass
+class TransactionAccountBalance:
+    """the effect of a transaction on the balance of one account, in the group currency"""
+
+    common_creditors: float
+    positions: float
+    common_debitors: float
+
+
 @dataclass
 class TransactionDetails:
     description: str
@@ -41,6 +50,9 @@ class TransactionDetails:
 
     purchase_items: Optional[list[PurchaseItem]]
 
+    # effect of a committed state on the account balances, stored when it was committed
+    account_balances: Optional[dict[int, TransactionAccountBalance]] = None
+
 
 @dataclass
 class Transaction:
@@ -49,3 +61,29 @@ class Transaction:
     current_state: Optional[TransactionDetails]
     pending_changes: Optional[dict[int, TransactionDetails]]
     # created_by: int
+
+
+@dataclass
+class NewPurchaseItem:
+    name: str
+    price: float
+    communist_shares: float
+
+    usages: dict[int, float]
+
+
+@dataclass
+class NewTransaction:
+    """a new transaction with all its shares and purchase items, created in one go either committed or pending"""
+
+    type: str
+    description: str
+    value: float
+    currency_symbol: str
+    currency_conversion_rate: float
+    billed_at: date
+
+    creditor_shares: dict[int, float]
+    debitor_shares: dict[int, float]
+
+    purchase_items: list[NewPurchaseItem]
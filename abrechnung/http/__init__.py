@@ -1,8 +1,12 @@
 import asyncio
+import itertools
 import json
 import logging
+import os
+import socket
 import traceback
-from typing import Optional
+from datetime import datetime, timezone, timedelta
+from typing import Optional, Union, Callable, Coroutine
 
 import aiohttp
 import aiohttp_cors as aiohttp_cors
@@ -12,17 +16,46 @@ from aiohttp import web
 from asyncpg.pool import Pool
 from jose import jwt
 
-from abrechnung.application.accounts import AccountService
-from abrechnung.application.groups import GroupService
-from abrechnung.application.transactions import TransactionService
+from abrechnung.application import PREPARED_STATEMENTS
+from abrechnung.application.accounts import AccountService, iter_accounts
+from abrechnung.application.cache import (
+    PermissionCache,
+    SessionCache,
+    SettlementCache,
+)
+from abrechnung.application.change_feed import (
+    CHANGE_FEED_CHANNEL,
+    ChangeFeedEntry,
+    can_resume_change_feed,
+    current_change_feed_seq,
+    prune_change_feed,
+    read_change_feed,
+)
+from abrechnung.application.groups import GroupService, iter_group_members
+from abrechnung.application.transactions import (
+    TransactionService,
+    TRANSACTION_JSON_QUERY,
+    iter_transactions_json,
+)
 from abrechnung.application.users import UserService
 from abrechnung.config import Config
-from abrechnung.database import db_connect
+from abrechnung.database import db_connect_from_config
 from abrechnung.http import auth, groups, transactions, websocket, accounts
-from abrechnung.http.auth import jwt_middleware, decode_jwt_token
-from abrechnung.http.utils import error_middleware, encode_json
+from abrechnung.http.auth import jwt_middleware, decode_jwt_token, is_session_valid
+from abrechnung.http.serializers import AccountSerializer, GroupMemberSerializer
+from abrechnung.http.utils import error_middleware, json_response, encode_json
 from abrechnung.subcommand import SubCommand
 
+# seconds between removing change feed entries older than the configured retention
+CHANGE_FEED_PRUNE_INTERVAL = 60 * 60
+# number of heartbeats a forwarder may miss before it is considered dead and removed by the other forwarders
+FORWARDER_MISSED_HEARTBEATS = 3
+
+
+def generate_forwarder_id() -> str:
+    """forwarder id for api instances which have not been given one, unique among all running instances"""
+    return f"{socket.gethostname()}-{os.getpid()}-{os.urandom(2).hex()}"
+
 
 class HTTPService(SubCommand):
     """
@@ -34,6 +67,25 @@ class HTTPService(SubCommand):
 
         # map connection_id -> tx queue
         self.tx_queues: dict[int, asyncio.Queue] = dict()
+        # map connection_id -> user the connection authenticated as
+        self.ws_sessions: dict[int, websocket.WebsocketSession] = dict()
+        # websocket connections are only known to this forwarder, ids are handed out locally
+        self.connection_ids = itertools.count(1)
+        self.subscriptions = websocket.SubscriptionRegistry()
+        # (channel, payload) of notifications received from psql, waiting to be dispatched to the tx queues in order
+        self.notification_queue: asyncio.Queue = asyncio.Queue()
+        # map group_id -> sequence number of the last change feed entry dispatched for this group
+        self.change_feed_seqs: dict[int, int] = dict()
+        self.change_feed_retention = timedelta(
+            seconds=self.cfg["api"].get("change_feed_retention", 7 * 24 * 60 * 60)
+        )
+        # seconds for which notifications are collected before being sent to a websocket client,
+        # duplicates within this window are only sent once
+        self.notification_debounce: float = self.cfg["api"].get(
+            "notification_debounce", 0.05
+        )
+        # whether permessage-deflate is negotiated with websocket clients supporting it
+        self.websocket_compress: bool = self.cfg["api"].get("websocket_compress", True)
 
         self.logger = logging.getLogger(__name__)
 
@@ -41,26 +93,28 @@ class HTTPService(SubCommand):
         # we get this when booting from the db.
         self.channel_id: Optional[int] = None
         self.channel_name: Optional[str] = None
+        self.forwarder_id: str = self.cfg["api"].get("id") or generate_forwarder_id()
+        self.heartbeat_interval: float = self.cfg["api"].get("heartbeat_interval", 30)
+
+        # group memberships shared by all services of this process,
+        # kept up to date via the group membership notification channel
+        self.permission_cache = PermissionCache()
+        # validated login sessions, kept up to date via the session notification channel
+        self.session_cache = SessionCache()
+        # settlements of groups, valid until the change sequence number of their group advances
+        self.settlement_cache = SettlementCache()
 
     async def run(self):
         """
         run the websocket server
         """
 
-        db_pool = await db_connect(
-            username=self.cfg["database"]["user"],
-            password=self.cfg["database"]["password"],
-            database=self.cfg["database"]["dbname"],
-            host=self.cfg["database"]["host"],
+        db_pool = await db_connect_from_config(
+            self.cfg, prepared_statements=PREPARED_STATEMENTS
         )
 
         async with db_pool.acquire() as conn:
-            # configure automatic decoding of json type postgresql values
-            await conn.set_type_codec(
-                "json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
-            )
-
-            await self._register_forwarder(conn, forwarder_id=self.cfg["api"]["id"])
+            await self._register_forwarder(conn, forwarder_id=self.forwarder_id)
 
             try:
                 app = self.create_app(db_pool=db_pool)
@@ -70,14 +124,13 @@ class HTTPService(SubCommand):
                     app, host=self.cfg["api"]["host"], port=self.cfg["api"]["port"]
                 )
             finally:
-                await self._unregister_forwarder(
-                    conn, forwarder_id=self.cfg["api"]["id"]
-                )
+                await self._unregister_forwarder(conn, forwarder_id=self.forwarder_id)
 
     async def _register_forwarder(
         self, connection: asyncpg.Connection, forwarder_id: str
     ):
         # register at db
+        self.forwarder_id = forwarder_id
         self.channel_id = await connection.fetchval(
             "select channel_id from forwarder_boot($1)", forwarder_id
         )
@@ -85,10 +138,15 @@ class HTTPService(SubCommand):
         self.logger.info(
             f"Registered forwarder {forwarder_id}: DB gave us channel_id {self.channel_id!r}"
         )
-        self.channel_name = f"channel{self.channel_id}"
+        self.channel_name = websocket.SUBSCRIPTION_EVENT_CHANNEL
 
-        # one channel for NOTIFY to this db-client
+        # notifications for subscriptions are published on a channel shared by all forwarders
         await connection.add_listener(self.channel_name, self.on_psql_notification)
+        # group scoped notifications are read from the change feed
+        await connection.add_listener(CHANGE_FEED_CHANNEL, self.on_psql_notification)
+        await connection.add_listener(
+            PermissionCache.GROUP_MEMBERSHIP_CHANNEL, self.on_group_membership_changed
+        )
 
         self.logger.info(
             f"Listening on postgresql triggers on channel '{self.channel_name}'"
@@ -99,6 +157,10 @@ class HTTPService(SubCommand):
     ):
         # deregister at db
         await connection.remove_listener(self.channel_name, self.on_psql_notification)
+        await connection.remove_listener(CHANGE_FEED_CHANNEL, self.on_psql_notification)
+        await connection.remove_listener(
+            PermissionCache.GROUP_MEMBERSHIP_CHANNEL, self.on_group_membership_changed
+        )
 
         self.logger.info(f"Unregistered forwarder {forwarder_id}")
         await connection.execute("select * from forwarder_stop($1)", forwarder_id)
@@ -125,6 +187,7 @@ class HTTPService(SubCommand):
                     "/api/v1/auth/confirm_password_recovery",
                     "/api/v1/ws",
                 ],
+                session_cache=self.session_cache,
             )
             middlewares = [auth_middleware]
 
@@ -138,10 +201,19 @@ class HTTPService(SubCommand):
             db_pool=db_pool,
             enable_registration=self.cfg["api"].get("enable_registration", True),
             valid_email_domains=self.cfg["api"].get("valid_email_domains"),
+            session_cache=self.session_cache,
+        )
+        api_app["group_service"] = GroupService(
+            db_pool=db_pool, permission_cache=self.permission_cache
+        )
+        api_app["account_service"] = AccountService(
+            db_pool=db_pool, permission_cache=self.permission_cache
+        )
+        api_app["transaction_service"] = TransactionService(
+            db_pool=db_pool,
+            permission_cache=self.permission_cache,
+            settlement_cache=self.settlement_cache,
         )
-        api_app["group_service"] = GroupService(db_pool=db_pool)
-        api_app["account_service"] = AccountService(db_pool=db_pool)
-        api_app["transaction_service"] = TransactionService(db_pool=db_pool)
 
         api_app.add_routes(groups.routes)
         api_app.add_routes(transactions.routes)
@@ -149,6 +221,15 @@ class HTTPService(SubCommand):
         api_app.add_routes(accounts.routes)
 
         api_app.router.add_route("GET", "/ws", self.handle_ws_connection)
+        api_app.router.add_route("GET", "/metrics", self.handle_metrics)
+
+        app.on_startup.append(self._listen_for_cache_invalidations)
+        app.on_cleanup.append(self._stop_listening_for_cache_invalidations)
+        self._add_background_task(
+            app, "notification_dispatcher", self.notification_dispatcher
+        )
+        self._add_background_task(app, "change_feed_pruning", self.change_feed_pruning)
+        self._add_background_task(app, "forwarder_heartbeat", self.forwarder_heartbeat)
 
         if self.cfg["api"].get("enable_cors", False):
             cors = aiohttp_cors.setup(
@@ -170,25 +251,119 @@ class HTTPService(SubCommand):
 
         return app
 
+    async def _listen_for_cache_invalidations(self, app: web.Application):
+        # the listening connection is held for the whole lifetime of the app
+        app["cache_listener"] = await app["db_pool"].acquire()
+        await app["cache_listener"].add_listener(
+            PermissionCache.GROUP_MEMBERSHIP_CHANNEL,
+            self.permission_cache.on_membership_notification,
+        )
+        await app["cache_listener"].add_listener(
+            SessionCache.SESSION_CHANNEL, self.session_cache.on_session_notification
+        )
+        # memberships and sessions might have changed while we were not listening
+        self.permission_cache.clear()
+        self.session_cache.clear()
+
+    async def _stop_listening_for_cache_invalidations(self, app: web.Application):
+        await app["cache_listener"].remove_listener(
+            PermissionCache.GROUP_MEMBERSHIP_CHANNEL,
+            self.permission_cache.on_membership_notification,
+        )
+        await app["cache_listener"].remove_listener(
+            SessionCache.SESSION_CHANNEL, self.session_cache.on_session_notification
+        )
+        await app["db_pool"].release(app["cache_listener"])
+
+    @staticmethod
+    def _add_background_task(
+        app: web.Application,
+        name: str,
+        task: Callable[[Pool], Coroutine],
+    ):
+        """run a task with the database pool of the app for as long as the app is running"""
+
+        async def start(app: web.Application):
+            app[name] = asyncio.create_task(task(app["db_pool"]))
+
+        async def stop(app: web.Application):
+            app[name].cancel()
+            try:
+                await app[name]
+            except asyncio.CancelledError:
+                pass
+
+        app.on_startup.append(start)
+        app.on_cleanup.append(stop)
+
+    async def forwarder_heartbeat(self, db_pool: Pool):
+        """
+        task reporting this forwarder as alive and removing forwarders which have stopped doing so
+        """
+        interval = timedelta(seconds=self.heartbeat_interval)
+        while True:
+            try:
+                async with db_pool.acquire() as connection:
+                    await connection.execute(
+                        "call forwarder_heartbeat($1, $2)", self.forwarder_id, interval
+                    )
+                    reaped = await connection.fetch(
+                        "select * from reap_forwarders($1)",
+                        FORWARDER_MISSED_HEARTBEATS,
+                    )
+                for row in reaped:
+                    self.logger.warning(f"Removed stale forwarder {row[0]}")
+            except Exception:
+                self.logger.exception("failed to send forwarder heartbeat")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def change_feed_pruning(self, db_pool: Pool):
+        """
+        task removing change feed entries older than the configured retention
+        """
+        while True:
+            try:
+                async with db_pool.acquire() as connection:
+                    await prune_change_feed(connection, self.change_feed_retention)
+            except Exception:
+                self.logger.exception("failed to prune the change feed")
+            await asyncio.sleep(CHANGE_FEED_PRUNE_INTERVAL)
+
+    async def handle_metrics(self, request):
+        return json_response(
+            data={
+                "forwarder": {
+                    "id": self.forwarder_id,
+                    "connections": len(self.tx_queues),
+                    "subscriptions": len(self.subscriptions),
+                },
+                "permission_cache": self.permission_cache.stats(),
+                "session_cache": self.session_cache.stats(),
+                "settlement_cache": self.settlement_cache.stats(),
+            }
+        )
+
     def on_psql_notification(
         self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
     ):
         """
         this is called by psql to deliver a notify.
 
-        psql sends a json to this notification channel,
-        which it knows by the forwarder id assigned to us on boot.
-
-        expected json message from psql:
+        psql publishes a json on the subscription event channel shared by all forwarders,
+        see the database function notify_users for the format:
         {
-            -- what connectionids this notification is for
-            "connections": [connid, ...],
-
-            -- which event this notification describes
+            -- which event this notification describes, i.e. the subscription type
             "event": "...",
 
+            -- the subscribed element
+            "element_id": ...,
+
+            -- either the users or the group the notification is for
+            "user_ids": [user_id, ...],
+            "group_id": ...,
+
             -- event-specific args
-            "args": ...
+            "data": ...
         }
 
         """
@@ -198,23 +373,215 @@ class HTTPService(SubCommand):
             f"Received psql notification on channel {channel} with payload {payload}"
         )
 
-        if channel != self.channel_name:
+        if channel not in (self.channel_name, CHANGE_FEED_CHANNEL):
             raise Exception(
                 f"bug: forwarder got a notification "
                 f"for channel {channel!r}, "
                 f"but registered is {self.channel_name!r}"
             )
 
-        payload_json = json.loads(payload)
-        event = payload_json.pop("event")
-        connections = payload_json["connections"]
-        for connection_id in connections:
-            message = {
-                "type": "notification",
-                "data": {"subscription_type": event, **payload_json["data"]},
-            }
+        self.notification_queue.put_nowait((channel, json.loads(payload)))
+
+    def on_group_membership_changed(
+        self, connection: asyncpg.Connection, pid: int, channel: str, payload: str
+    ):
+        """subscriptions to a group are dropped once the subscribed user is no longer a member"""
+        del connection, pid, channel  # unused
+
+        data = json.loads(payload)
+        if data.get("deleted"):
+            self.subscriptions.remove_group_member(
+                group_id=data["group_id"], user_id=data["user_id"]
+            )
+
+    async def notification_dispatcher(self, db_pool: Pool):
+        """
+        task delivering the notifications received from psql to the tx queues of the addressed connections.
+
+        Connections which subscribed with_payload additionally receive the changed element, which is loaded
+        once per notification and shared among all of them.
+        """
+        while True:
+            channel, payload_json = await self.notification_queue.get()
+            try:
+                if channel == CHANGE_FEED_CHANNEL:
+                    await self._tail_change_feed(
+                        db_pool, payload_json["group_id"], payload_json["seq"]
+                    )
+                else:
+                    await self._dispatch_notification(db_pool, payload_json)
+            except Exception:
+                self.logger.exception(f"failed to dispatch notification {payload_json}")
+
+    @staticmethod
+    def _change_feed_notification(entry: ChangeFeedEntry) -> dict:
+        """a change feed entry in the format of the notifications on the subscription event channel"""
+        return {
+            "event": entry.event,
+            "element_id": entry.element_id,
+            "group_id": entry.group_id,
+            "data": {**entry.data, "seq": entry.seq},
+        }
+
+    async def _tail_change_feed(self, db_pool: Pool, group_id: int, seq: int):
+        """
+        dispatch all change feed entries of a group up to the announced one which have not been dispatched yet.
+
+        Notifications on the change feed channel only announce new entries, if one gets lost its entries are
+        dispatched with the next one.
+        """
+        last_seq = self.change_feed_seqs.get(group_id, seq - 1)
+        if seq <= last_seq:
+            return
+
+        has_subscribers = any(
+            self.subscriptions.subscribers(subscription_type, group_id)
+            for subscription_type in websocket.GROUP_SUBSCRIPTION_TYPES
+        )
+        if not has_subscribers:
+            self.change_feed_seqs[group_id] = seq
+            return
+
+        async with db_pool.acquire() as connection:
+            entries = await read_change_feed(connection, group_id, last_seq)
+
+        for entry in entries:
+            self.change_feed_seqs[group_id] = entry.seq
+            await self._dispatch_notification(
+                db_pool, self._change_feed_notification(entry)
+            )
+
+    async def _load_notification_payload(
+        self, db_pool: Pool, event: str, data: dict
+    ) -> Optional[dict[str, str]]:
+        """
+        the changed element to include in a notification, in the json representation rendered by the database
+        """
+        if event == "transaction" and data.get("transaction_id") is not None:
+            async with db_pool.acquire() as connection:
+                transaction = await connection.fetchval(
+                    TRANSACTION_JSON_QUERY, data["element_id"], data["transaction_id"]
+                )
+            if transaction is not None:
+                return {"transaction": transaction}
+
+        return None
+
+    async def _replay_change_feed(
+        self,
+        db_pool: Pool,
+        subscription_type: str,
+        element_id: int,
+        last_seq: int,
+        with_payload: bool,
+    ) -> Optional[tuple[int, list[websocket.Notification]]]:
+        """
+        the notifications a client resuming a subscription after the given change feed entry has missed,
+        together with the sequence number of the latest change feed entry they cover.
+
+        Returns None if they are not available anymore, i.e. the client needs to fetch the element again.
+        """
+        if subscription_type not in websocket.GROUP_SUBSCRIPTION_TYPES:
+            return None
+
+        async with db_pool.acquire() as connection:
+            if not await can_resume_change_feed(connection, element_id, last_seq):
+                return None
+            entries = await read_change_feed(connection, element_id, last_seq)
+
+        notifications = []
+        replayed_seq = last_seq
+        for entry in entries:
+            replayed_seq = max(replayed_seq, entry.seq)
+            if entry.event != subscription_type:
+                continue
+            data = {"subscription_type": entry.event, **entry.data, "seq": entry.seq}
+            payload = None
+            if with_payload:
+                payload = await self._load_notification_payload(
+                    db_pool, entry.event, entry.data
+                )
+            notifications.append(websocket.Notification.encode(data, raw=payload))
+
+        return replayed_seq, notifications
+
+    async def _read_subscription_snapshot(
+        self, db_pool: Pool, user_id: int, subscription_type: str, group_id: int
+    ) -> tuple[int, str]:
+        """
+        the current state of a group for a subscription, json encoded, together with the sequence number of the
+        latest change feed entry it includes.
+
+        Both are read in the same database snapshot. The subscription has to be registered as buffered beforehand,
+        all changes committed afterwards have a higher sequence number and are delivered as notifications.
+        """
+        async with db_pool.acquire() as connection:
+            async with connection.transaction(
+                isolation="repeatable_read", readonly=True
+            ):
+                seq = await current_change_feed_seq(connection, group_id)
+                if subscription_type == "transaction":
+                    # the api representation rendered by the database is passed through as is
+                    snapshot = [
+                        transaction
+                        async for transaction in iter_transactions_json(
+                            connection, group_id
+                        )
+                    ]
+                elif subscription_type == "account":
+                    snapshot = [
+                        json.dumps(
+                            AccountSerializer(account).to_repr(), default=encode_json
+                        )
+                        async for account in iter_accounts(
+                            connection, group_id, user_id
+                        )
+                    ]
+                else:
+                    snapshot = [
+                        json.dumps(
+                            GroupMemberSerializer(member).to_repr(), default=encode_json
+                        )
+                        async for member in iter_group_members(connection, group_id)
+                    ]
+
+        return seq, f"[{', '.join(snapshot)}]"
+
+    async def _dispatch_notification(self, db_pool: Pool, payload_json: dict):
+        event = payload_json["event"]
+        subscribers = self.subscriptions.subscribers(
+            event, payload_json["element_id"], payload_json.get("user_ids")
+        )
+        if not subscribers:
+            return
+
+        # encoded once, the same message is put on the tx queues of all subscribers
+        data = {"subscription_type": event, **payload_json["data"]}
+        message = websocket.Notification.encode(data)
+        payload_connections = {
+            connection_id
+            for connection_id, subscriber in subscribers.items()
+            if subscriber.with_payload
+        }
+        payload_message = None
+        if payload_connections:
+            payload = await self._load_notification_payload(
+                db_pool, event, payload_json["data"]
+            )
+            if payload is not None:
+                payload_message = websocket.Notification.encode(data, raw=payload)
+
+        for connection_id, subscriber in subscribers.items():
+            if payload_message is not None and connection_id in payload_connections:
+                connection_message = payload_message
+            else:
+                connection_message = message
+            if subscriber.buffer is not None:
+                # the reply to the subscription has not been queued yet
+                subscriber.buffer.append(connection_message)
+                continue
             try:
-                self.tx_queues[connection_id].put_nowait(message)
+                self.tx_queues[connection_id].put_nowait(connection_message)
             except KeyError:
                 pass  # tx queue is no longer available
             except asyncio.QueueFull:
@@ -226,15 +593,11 @@ class HTTPService(SubCommand):
         """
         how to talk over a websocket connection.
         """
-        ws = aiohttp.web.WebSocketResponse()
+        ws = aiohttp.web.WebSocketResponse(compress=self.websocket_compress)
         await ws.prepare(request)
 
-        async with request.app["db_pool"].acquire() as connection:
-            # register the client connection at the db
-            connection_id = await connection.fetchval(
-                "select connection_id from client_connected($1)", self.channel_id
-            )
-            self.logger.debug(f"Websocket client connected with id {connection_id}")
+        connection_id = next(self.connection_ids)
+        self.logger.debug(f"Websocket client connected with id {connection_id}")
 
         # create the tx queue and task
         tx_queue = asyncio.Queue(maxsize=1000)
@@ -248,10 +611,9 @@ class HTTPService(SubCommand):
                         msg_obj = json.loads(msg.data)
                         websocket.CLIENT_SCHEMA.validate(msg_obj)
 
-                        async with request.app["db_pool"].acquire() as connection:
-                            response = await self.ws_message(
-                                connection, connection_id, msg_obj
-                            )
+                        response = await self.ws_message(
+                            request.app["db_pool"], connection_id, msg_obj
+                        )
                     else:
                         self.logger.info(
                             f"websocket got unhandled websocket message on connection id {connection_id}: {msg.type}"
@@ -271,16 +633,17 @@ class HTTPService(SubCommand):
                         code=web.HTTPInternalServerError.status_code, msg=str(exc)
                     )
                 try:
-                    tx_queue.put_nowait(response)
+                    # subscription replies are followed by the notifications buffered while preparing them
+                    for item in response if isinstance(response, list) else [response]:
+                        tx_queue.put_nowait(item)
                 except asyncio.QueueFull:
                     self.logger.error(
                         f"websocket with id {connection_id} error: tx queue full"
                     )
                     break
         finally:
-            async with request.app["db_pool"].acquire() as connection:
-                # deregister the client connection
-                await connection.execute("call client_disconnected($1)", connection_id)
+            self._end_ws_session(connection_id)
+            self.subscriptions.remove_connection(connection_id)
             # stop the tx task
             del self.tx_queues[connection_id]
             tx_task.cancel()
@@ -289,62 +652,356 @@ class HTTPService(SubCommand):
 
         return ws
 
-    @staticmethod
-    async def tx_task(ws, tx_queue):
+    async def tx_task(self, ws, tx_queue):
         """
-        task for sending messages from a queue to a websocket connection
-        """
-        while True:
-            item = await tx_queue.get()
-            msg = json.dumps(item, default=encode_json) + "\n"
-            await asyncio.shield(ws.send_str(msg))
+        task for sending messages from a queue to a websocket connection.
 
-    async def ws_message(
-        self, connection: asyncpg.Connection, connection_id: str, msg: dict
-    ):
+        Notifications are collected for the debounce window, duplicates are dropped and the remaining ones
+        are sent as a single batch.
         """
-        the websocket client sent a message. handle it.
-        """
-        auth_token = msg["token"]
+        while True:
+            items = [await tx_queue.get()]
+            if (
+                isinstance(items[0], websocket.Notification)
+                and self.notification_debounce > 0
+            ):
+                await asyncio.sleep(self.notification_debounce)
+            while not tx_queue.empty():
+                items.append(tx_queue.get_nowait())
+
+            for frame in websocket.encode_messages(items):
+                await ws.send_str(frame)
+
+    async def _authenticate_ws(
+        self, db_pool: Pool, connection_id: int, token: str
+    ) -> dict:
         try:
-            jwt_claims = decode_jwt_token(auth_token, self.cfg["api"]["secret_key"])
+            jwt_claims = decode_jwt_token(token, self.cfg["api"]["secret_key"])
         except jwt.JWTError as exc:
             return websocket.make_error_msg(
                 code=web.HTTPUnauthorized.status_code, msg=str(exc)
             )
 
-        msg_type = msg["type"]
-        user_id = jwt_claims["user_id"]
-        data = msg["data"]
-        if msg_type == "subscribe":
+        if "user_id" not in jwt_claims or "session_id" not in jwt_claims:
+            return websocket.make_error_msg(
+                code=web.HTTPUnauthorized.status_code, msg="invalid token claims"
+            )
+
+        if not await is_session_valid(
+            db_pool,
+            session_id=jwt_claims["session_id"],
+            user_id=jwt_claims["user_id"],
+            session_cache=self.session_cache,
+        ):
+            return websocket.make_error_msg(
+                code=web.HTTPUnauthorized.status_code,
+                msg="provided access token for expired or logged out session",
+            )
+
+        previous_session = self._end_ws_session(connection_id)
+        if (
+            previous_session is not None
+            and previous_session.user_id != jwt_claims["user_id"]
+        ):
+            # subscriptions are bound to the user they were checked for
+            self.subscriptions.remove_connection(connection_id)
+
+        session = websocket.WebsocketSession(
+            user_id=jwt_claims["user_id"],
+            session_id=jwt_claims["session_id"],
+            expires_at=datetime.fromtimestamp(jwt_claims["exp"], tz=timezone.utc),
+        )
+        session.expiry_handle = asyncio.get_running_loop().call_later(
+            (session.expires_at - datetime.now(tz=timezone.utc)).total_seconds(),
+            self._on_ws_session_expired,
+            connection_id,
+            session,
+        )
+        self.ws_sessions[connection_id] = session
+
+        return {"type": "authenticate_success", "data": {"user_id": session.user_id}}
+
+    def _end_ws_session(
+        self, connection_id: int
+    ) -> Optional[websocket.WebsocketSession]:
+        session = self.ws_sessions.pop(connection_id, None)
+        if session is not None and session.expiry_handle is not None:
+            session.expiry_handle.cancel()
+        return session
+
+    def _on_ws_session_expired(
+        self, connection_id: int, session: websocket.WebsocketSession
+    ):
+        """ask the client to authenticate again once its access token expired"""
+        if self.ws_sessions.get(connection_id) is not session:
+            return
+
+        del self.ws_sessions[connection_id]
+        try:
+            self.tx_queues[connection_id].put_nowait(
+                {"type": "authentication_expired", "data": {}}
+            )
+        except (KeyError, asyncio.QueueFull):
+            pass
+
+    async def _subscribe_many(
+        self, db_pool: Pool, connection_id: int, user_id: int, data: dict
+    ) -> Union[dict, list]:
+        subscriptions = [
+            {
+                "subscription_type": subscription["subscription_type"],
+                "element_id": subscription["element_id"],
+                "with_payload": subscription.get("with_payload", False),
+            }
+            for subscription in data.get("subscriptions", [])
+        ]
+
+        async with db_pool.acquire() as connection:
+            if data.get("group_subscription_types"):
+                group_ids = await connection.fetch(
+                    "select group_id from group_membership where user_id = $1",
+                    user_id,
+                )
+                with_payload = data.get("with_payload", False)
+                subscriptions.extend(
+                    {
+                        "subscription_type": subscription_type,
+                        "element_id": row["group_id"],
+                        "with_payload": with_payload
+                        and subscription_type in websocket.PAYLOAD_SUBSCRIPTION_TYPES,
+                    }
+                    for row in group_ids
+                    for subscription_type in data["group_subscription_types"]
+                )
+
+            for subscription in subscriptions:
+                if (
+                    subscription["with_payload"]
+                    and subscription["subscription_type"]
+                    not in websocket.PAYLOAD_SUBSCRIPTION_TYPES
+                ):
+                    return websocket.make_error_msg(
+                        code=web.HTTPBadRequest.status_code,
+                        msg=f"subscription type {subscription['subscription_type']} does not support payloads",
+                    )
+
             try:
+                # either all subscriptions are allowed or none of them are made
                 await connection.execute(
-                    "call subscribe($1, $2, $3, $4)",
-                    connection_id,
+                    "call check_subscriptions($1, $2, $3)",
                     user_id,
-                    data["subscription_type"],
-                    data["element_id"],
+                    [s["subscription_type"] for s in subscriptions],
+                    [s["element_id"] for s in subscriptions],
                 )
-                return {"type": "subscribe_success", "data": data}
             except (asyncpg.RaiseError, asyncpg.PostgresError) as exc:
-                # a specific error was raised in the db
                 return websocket.make_error_msg(
                     code=web.HTTPBadRequest.status_code, msg=str(exc)
                 )
-        elif msg_type == "unsubscribe":
+
+        # resumed subscriptions receive live notifications only after the ones they missed
+        resumed = [
+            (subscription, requested["last_seq"])
+            for subscription, requested in zip(
+                subscriptions, data.get("subscriptions", [])
+            )
+            if "last_seq" in requested
+        ]
+        resumed_ids = {id(subscription) for subscription, _ in resumed}
+        for subscription in subscriptions:
+            self.subscriptions.subscribe(
+                connection_id=connection_id,
+                user_id=user_id,
+                buffered=id(subscription) in resumed_ids,
+                **subscription,
+            )
+
+        missed = []
+        replayed_seqs = []
+        try:
+            for subscription, last_seq in resumed:
+                replay = await self._replay_change_feed(
+                    db_pool, last_seq=last_seq, **subscription
+                )
+                subscription["last_seq"] = last_seq
+                subscription["resync"] = replay is None
+                replayed_seq, notifications = replay or (None, [])
+                replayed_seqs.append(replayed_seq)
+                missed.extend(notifications)
+        except BaseException:
+            for subscription, _ in resumed:
+                self.subscriptions.unsubscribe(
+                    connection_id=connection_id,
+                    user_id=user_id,
+                    subscription_type=subscription["subscription_type"],
+                    element_id=subscription["element_id"],
+                )
+            raise
+
+        released = [
+            notification
+            for (subscription, _), replayed_seq in zip(resumed, replayed_seqs)
+            for notification in self.subscriptions.release(
+                connection_id,
+                subscription["subscription_type"],
+                subscription["element_id"],
+                after_seq=replayed_seq,
+            )
+        ]
+        return [
+            {
+                "type": "subscribe_many_success",
+                "data": {"subscriptions": subscriptions},
+            },
+            *missed,
+            *released,
+        ]
+
+    async def ws_message(self, db_pool: Pool, connection_id: int, msg: dict):
+        """
+        the websocket client sent a message. handle it.
+
+        Clients either authenticate their connection once or send their access token along with every message.
+        """
+        msg_type = msg["type"]
+        data = msg["data"]
+        if msg_type == "authenticate":
+            return await self._authenticate_ws(db_pool, connection_id, data["token"])
+
+        if "token" in msg:
             try:
-                await connection.execute(
-                    "call unsubscribe($1, $2, $3, $4)",
-                    connection_id,
-                    user_id,
-                    data["subscription_type"],
-                    data["element_id"],
+                jwt_claims = decode_jwt_token(
+                    msg["token"], self.cfg["api"]["secret_key"]
+                )
+            except jwt.JWTError as exc:
+                return websocket.make_error_msg(
+                    code=web.HTTPUnauthorized.status_code, msg=str(exc)
+                )
+            user_id = jwt_claims["user_id"]
+        else:
+            session = self.ws_sessions.get(connection_id)
+            if session is None or session.expired:
+                return websocket.make_error_msg(
+                    code=web.HTTPUnauthorized.status_code,
+                    msg="websocket connection is not authenticated",
+                )
+            user_id = session.user_id
+
+        if msg_type == "subscribe":
+            with_payload = data.get("with_payload", False)
+            if (
+                with_payload
+                and data["subscription_type"]
+                not in websocket.PAYLOAD_SUBSCRIPTION_TYPES
+            ):
+                return websocket.make_error_msg(
+                    code=web.HTTPBadRequest.status_code,
+                    msg=f"subscription type {data['subscription_type']} does not support payloads",
+                )
+            if (
+                data.get("with_snapshot", False)
+                and data["subscription_type"]
+                not in websocket.SNAPSHOT_SUBSCRIPTION_TYPES
+            ):
+                return websocket.make_error_msg(
+                    code=web.HTTPBadRequest.status_code,
+                    msg=f"subscription type {data['subscription_type']} does not support snapshots",
+                )
+            try:
+                async with db_pool.acquire() as connection:
+                    await connection.execute(
+                        "call check_subscription($1, $2, $3)",
+                        user_id,
+                        data["subscription_type"],
+                        data["element_id"],
+                    )
+                with_snapshot = data.get("with_snapshot", False)
+                self.subscriptions.subscribe(
+                    connection_id=connection_id,
+                    user_id=user_id,
+                    subscription_type=data["subscription_type"],
+                    element_id=data["element_id"],
+                    with_payload=with_payload,
+                    buffered=with_snapshot or "last_seq" in data,
                 )
-                return {"type": "unsubscribe_success", "data": data}
+                if with_snapshot:
+                    try:
+                        seq, snapshot = await self._read_subscription_snapshot(
+                            db_pool,
+                            user_id,
+                            data["subscription_type"],
+                            data["element_id"],
+                        )
+                    except BaseException:
+                        self.subscriptions.unsubscribe(
+                            connection_id=connection_id,
+                            user_id=user_id,
+                            subscription_type=data["subscription_type"],
+                            element_id=data["element_id"],
+                        )
+                        raise
+                    # changes dispatched while reading the snapshot follow the reply unless they are part of it
+                    return [
+                        websocket.EncodedMessage.encode(
+                            "subscribe_success",
+                            {**data, "seq": seq},
+                            raw={"snapshot": snapshot},
+                        ),
+                        *self.subscriptions.release(
+                            connection_id,
+                            data["subscription_type"],
+                            data["element_id"],
+                            after_seq=seq,
+                        ),
+                    ]
+                if "last_seq" not in data:
+                    return {"type": "subscribe_success", "data": data}
+
+                try:
+                    replay = await self._replay_change_feed(
+                        db_pool,
+                        data["subscription_type"],
+                        data["element_id"],
+                        data["last_seq"],
+                        with_payload,
+                    )
+                except BaseException:
+                    self.subscriptions.unsubscribe(
+                        connection_id=connection_id,
+                        user_id=user_id,
+                        subscription_type=data["subscription_type"],
+                        element_id=data["element_id"],
+                    )
+                    raise
+                # live notifications dispatched while replaying follow the missed ones unless they were replayed
+                replayed_seq, missed = replay or (None, [])
+                return [
+                    {
+                        "type": "subscribe_success",
+                        "data": {**data, "resync": replay is None},
+                    },
+                    *missed,
+                    *self.subscriptions.release(
+                        connection_id,
+                        data["subscription_type"],
+                        data["element_id"],
+                        after_seq=replayed_seq,
+                    ),
+                ]
             except (asyncpg.RaiseError, asyncpg.PostgresError) as exc:
+                # a specific error was raised in the db
                 return websocket.make_error_msg(
                     code=web.HTTPBadRequest.status_code, msg=str(exc)
                 )
+        elif msg_type == "subscribe_many":
+            return await self._subscribe_many(db_pool, connection_id, user_id, data)
+        elif msg_type == "unsubscribe":
+            self.subscriptions.unsubscribe(
+                connection_id=connection_id,
+                user_id=user_id,
+                subscription_type=data["subscription_type"],
+                element_id=data["element_id"],
+            )
+            return {"type": "unsubscribe_success", "data": data}
 
         else:
             return websocket.make_error_msg(
@@ -1,26 +1,47 @@
 import schema
 from aiohttp import web
 
-from abrechnung.http.serializers import AccountSerializer
-from abrechnung.http.utils import validate, json_response
+from abrechnung.http.serializers import (
+    AccountSerializer,
+    AccountBalanceSerializer,
+    AccountBalanceHistorySerializer,
+    LedgerEntrySerializer,
+)
+from abrechnung.http.utils import (
+    validate,
+    json_response,
+    json_stream_response,
+    encode_cursor,
+    decode_cursor,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+)
 
 routes = web.RouteTableDef()
 
+ledger_page_schema = schema.Schema(
+    {
+        schema.Optional("limit"): schema.And(
+            schema.Use(int), lambda n: 0 < n <= MAX_PAGE_SIZE
+        ),
+        schema.Optional("cursor"): schema.Use(decode_cursor),
+        schema.Optional("order"): schema.Or("asc", "desc"),
+    }
+)
+
 
 @routes.get(r"/groups/{group_id:\d+}/accounts")
 async def list_accounts(request):
+    accounts = request.app["account_service"].list_accounts(
+        user_id=request["user"]["user_id"],
+        group_id=int(request.match_info["group_id"]),
+    )
+
     try:
-        accounts = await request.app["account_service"].list_accounts(
-            user_id=request["user"]["user_id"],
-            group_id=int(request.match_info["group_id"]),
-        )
+        return await json_stream_response(request, accounts, AccountSerializer)
     except PermissionError:
         raise web.HTTPForbidden(reason="permission denied")
 
-    serializer = AccountSerializer(accounts)
-
-    return json_response(data=serializer.to_repr())
-
 
 @routes.post(r"/groups/{group_id:\d+}/accounts")
 @validate(schema.Schema({"name": str, "description": str, "type": str}))
@@ -72,3 +93,56 @@ async def delete_account(request: web.Request):
     )
 
     return json_response(status=web.HTTPNoContent.status_code)
+
+
+@routes.get(r"/groups/{group_id:\d+}/balances")
+async def list_account_balances(request: web.Request):
+    balances = await request.app["account_service"].list_account_balances(
+        user_id=request["user"]["user_id"],
+        group_id=int(request.match_info["group_id"]),
+        verify=request.query.get("verify", "false").lower() in ("true", "1"),
+    )
+
+    serializer = AccountBalanceSerializer(balances)
+
+    return json_response(data=serializer.to_repr())
+
+
+@routes.get(r"/groups/{group_id:\d+}/balances/history")
+async def list_account_balance_history(request: web.Request):
+    history = await request.app["account_service"].list_account_balance_history(
+        user_id=request["user"]["user_id"],
+        group_id=int(request.match_info["group_id"]),
+        granularity=request.query.get("granularity", "day"),
+    )
+
+    serializer = AccountBalanceHistorySerializer(history)
+
+    return json_response(data=serializer.to_repr())
+
+
+@routes.get(r"/groups/{group_id:\d+}/accounts/{account_id:\d+}/ledger")
+async def list_account_ledger(request: web.Request):
+    try:
+        query = ledger_page_schema.validate(dict(request.query))
+    except schema.SchemaError as e:
+        raise web.HTTPBadRequest(
+            reason=f"Request is invalid; there are validation errors: {e}"
+        )
+
+    entries, next_key = await request.app["account_service"].list_account_ledger(
+        user_id=request["user"]["user_id"],
+        group_id=int(request.match_info["group_id"]),
+        account_id=int(request.match_info["account_id"]),
+        limit=query.get("limit", DEFAULT_PAGE_SIZE),
+        after=query.get("cursor"),
+        descending=query.get("order") == "desc",
+    )
+
+    serializer = LedgerEntrySerializer(entries)
+    return json_response(
+        data={
+            "entries": serializer.to_repr(),
+            "next_cursor": None if next_key is None else encode_cursor(next_key),
+        }
+    )
@@ -1,12 +1,15 @@
 import logging
 import re
 from datetime import timedelta, datetime, timezone
+from typing import Optional
 
 from aiohttp import web, hdrs
+from asyncpg.pool import Pool
 from jose import jwt
 from schema import Schema
 
-from abrechnung.application import InvalidCommand
+from abrechnung.application import InvalidCommand, prepared_statement
+from abrechnung.application.cache import SessionCache
 from abrechnung.application.users import (
     InvalidPassword,
 )
@@ -20,6 +23,11 @@ routes = web.RouteTableDef()
 REQUEST_AUTH_KEY = "user"
 ACCESS_TOKEN_VALIDITY = timedelta(hours=1)
 
+SESSION_VALIDITY_QUERY = prepared_statement(
+    "select id, valid_until from session "
+    "where id = $1 and user_id = $2 and (valid_until is null or valid_until > now())"
+)
+
 
 def check_request(request, entries):
     for pattern in entries:
@@ -44,10 +52,31 @@ def decode_jwt_token(token: str, secret: str) -> dict:
     return jwt.decode(token, secret, algorithms="HS256")
 
 
+async def is_session_valid(
+    db_pool: Pool,
+    session_id: int,
+    user_id: int,
+    session_cache: Optional[SessionCache] = None,
+) -> bool:
+    """check that a login session has neither expired nor been logged out"""
+    if session_cache is not None and session_cache.is_valid(session_id, user_id):
+        return True
+
+    async with db_pool.acquire() as conn:
+        session = await conn.fetchrow(SESSION_VALIDITY_QUERY, session_id, user_id)
+    if not session:
+        return False
+
+    if session_cache is not None:
+        session_cache.set_valid(session_id, user_id, session["valid_until"])
+    return True
+
+
 def jwt_middleware(
     secret,
     whitelist=tuple(),
     auth_scheme="Bearer",
+    session_cache: Optional[SessionCache] = None,
 ):
     """Mostly taken from https://github.com/hzlmn/aiohttp-jwt"""
     if not (secret and isinstance(secret, str)):
@@ -92,16 +121,15 @@ def jwt_middleware(
         if "user_id" not in decoded or "session_id" not in decoded:
             raise web.HTTPUnauthorized(reason="Invalid token claims")
 
-        async with request.app["db_pool"].acquire() as conn:
-            session_id = await conn.fetchval(
-                "select id from session where id = $1 and user_id = $2 and valid_until is null or valid_until > now()",
-                decoded["session_id"],
-                decoded["user_id"],
+        if not await is_session_valid(
+            request.app["db_pool"],
+            session_id=decoded["session_id"],
+            user_id=decoded["user_id"],
+            session_cache=session_cache,
+        ):
+            raise web.HTTPUnauthorized(
+                reason="provided access token for expired or logged out session"
             )
-            if not session_id:
-                raise web.HTTPUnauthorized(
-                    reason="provided access token for expired or logged out session"
-                )
 
         request[REQUEST_AUTH_KEY] = {
             "user_id": decoded["user_id"],
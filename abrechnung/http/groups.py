@@ -13,7 +13,7 @@ from abrechnung.http.serializers import (
     GroupPreviewSerializer,
     GroupLogSerializer,
 )
-from abrechnung.http.utils import validate, json_response
+from abrechnung.http.utils import validate, json_response, json_stream_response
 
 routes = web.RouteTableDef()
 
@@ -111,14 +111,12 @@ async def list_members(request: web.Request):
 
 @routes.get(r"/groups/{group_id:\d+}/logs")
 async def list_log(request: web.Request):
-    logs = await request.app["group_service"].list_log(
+    logs = request.app["group_service"].list_log(
         user_id=request["user"]["user_id"],
         group_id=int(request.match_info["group_id"]),
     )
 
-    serializer = GroupLogSerializer(logs)
-
-    return json_response(data=serializer.to_repr())
+    return await json_stream_response(request, logs, GroupLogSerializer)
 
 
 @routes.post(r"/groups/{group_id:\d+}/send_message")
@@ -1,7 +1,12 @@
 import abc
 from typing import Union, Type
 
-from abrechnung.domain.accounts import Account
+from abrechnung.domain.accounts import (
+    Account,
+    AccountBalance,
+    AccountBalanceHistory,
+    LedgerEntry,
+)
 from abrechnung.domain.groups import (
     Group,
     GroupMember,
@@ -9,6 +14,7 @@ from abrechnung.domain.groups import (
     GroupPreview,
     GroupLog,
 )
+from abrechnung.domain.settlement import Settlement
 from abrechnung.domain.transactions import (
     Transaction,
     TransactionDetails,
@@ -70,6 +76,41 @@ class AccountSerializer(Serializer):
         }
 
 
+class AccountBalanceSerializer(Serializer):
+    def _to_repr(self, instance: AccountBalance) -> dict:
+        data = {
+            "account_id": instance.account_id,
+            "balance": instance.balance,
+        }
+        if instance.computed_balance is not None:
+            data["computed_balance"] = instance.computed_balance
+            data["drift"] = instance.balance - instance.computed_balance
+
+        return data
+
+
+class AccountBalanceHistorySerializer(Serializer):
+    def _to_repr(self, instance: AccountBalanceHistory) -> dict:
+        return {
+            "account_id": instance.account_id,
+            "periods": instance.periods,
+            "balances": instance.balances,
+        }
+
+
+class LedgerEntrySerializer(Serializer):
+    def _to_repr(self, instance: LedgerEntry) -> dict:
+        return {
+            "transaction_id": instance.transaction_id,
+            "type": instance.type,
+            "description": instance.description,
+            "billed_at": instance.billed_at,
+            "credit": instance.credit,
+            "debit": instance.debit,
+            "balance": instance.balance,
+        }
+
+
 class GroupInviteSerializer(Serializer):
     def _to_repr(self, instance: GroupInvite) -> dict:
         return {
@@ -95,6 +136,16 @@ class GroupLogSerializer(Serializer):
 
 
 class TransactionSerializer(Serializer):
+    # the database renders the same representation in transaction_change_api_json, keep both in sync
+    def __init__(
+        self,
+        instance: Union[list[Transaction], Transaction],
+        with_account_balances: bool = False,
+    ):
+        super().__init__(instance)
+        # the account balances stored for committed states are only included on request
+        self.with_account_balances = with_account_balances
+
     @staticmethod
     def _serialize_purchase_item(item: PurchaseItem):
         return {
@@ -107,7 +158,7 @@ class TransactionSerializer(Serializer):
         }
 
     def _serialize_change(self, change: TransactionDetails):
-        return {
+        data = {
             "description": change.description,
             "value": change.value,
             "currency_symbol": change.currency_symbol,
@@ -120,31 +171,62 @@ class TransactionSerializer(Serializer):
             "debitor_shares": {
                 str(uid): val for uid, val in change.debitor_shares.items()
             },
-            "purchase_items": [
-                self._serialize_purchase_item(item) for item in change.purchase_items
-            ]
-            if change.purchase_items
-            else None,
+            "purchase_items": (
+                [self._serialize_purchase_item(item) for item in change.purchase_items]
+                if change.purchase_items
+                else None
+            ),
         }
+        if self.with_account_balances and change.account_balances is not None:
+            data["account_balances"] = {
+                str(account_id): {
+                    "common_creditors": balance.common_creditors,
+                    "positions": balance.positions,
+                    "common_debitors": balance.common_debitors,
+                }
+                for account_id, balance in change.account_balances.items()
+            }
+
+        return data
 
     def _to_repr(self, instance: Transaction) -> dict:
         data = {
             "id": instance.id,
             "type": instance.type,
-            "pending_changes": {
-                str(uid): self._serialize_change(change)
-                for uid, change in instance.pending_changes.items()
-            }
-            if instance.pending_changes
-            else {},
-            "current_state": self._serialize_change(instance.current_state)
-            if instance.current_state
-            else None,
+            "pending_changes": (
+                {
+                    str(uid): self._serialize_change(change)
+                    for uid, change in instance.pending_changes.items()
+                }
+                if instance.pending_changes
+                else {}
+            ),
+            "current_state": (
+                self._serialize_change(instance.current_state)
+                if instance.current_state
+                else None
+            ),
         }
 
         return data
 
 
+class SettlementSerializer(Serializer):
+    def _to_repr(self, instance: Settlement) -> dict:
+        return {
+            "change_seq": instance.change_seq,
+            "exact": instance.exact,
+            "transfers": [
+                {
+                    "from_account_id": transfer.from_account_id,
+                    "to_account_id": transfer.to_account_id,
+                    "amount": transfer.amount,
+                }
+                for transfer in instance.transfers
+            ],
+        }
+
+
 class UserSerializer(Serializer):
     def _to_repr(self, instance: User) -> dict:
         return {
@@ -1,24 +1,167 @@
+import csv
+import functools
+import io
+import json
 from datetime import date
 
 import schema
 from aiohttp import web
 from aiohttp.abc import Request
 
-from abrechnung.http.serializers import TransactionSerializer
-from abrechnung.http.utils import json_response, validate
+from abrechnung.domain.transactions import NewTransaction, NewPurchaseItem
+from abrechnung.http.serializers import TransactionSerializer, SettlementSerializer
+from abrechnung.http.utils import (
+    json_response,
+    validate,
+    json_stream_response,
+    encode_cursor,
+    decode_cursor,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+)
 
 routes = web.RouteTableDef()
 
+MAX_IMPORT_SIZE = 10000
+# settlement modes, exact minimizes the number of transfers, auto only does so for small groups
+SETTLEMENT_MODES = {"auto": None, "greedy": False, "exact": True}
+
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() in ("true", "1"):
+        return True
+    if value.lower() in ("false", "0"):
+        return False
+    raise ValueError(f"invalid boolean value {value}")
+
+
+def _with_account_balances(request: Request) -> bool:
+    """whether the stored account balances of committed states are requested"""
+    try:
+        return _parse_bool(request.query.get("account_balances", "false"))
+    except ValueError:
+        raise web.HTTPBadRequest(reason="account_balances must be a boolean")
+
+
+transaction_page_schema = schema.Schema(
+    {
+        schema.Optional("limit"): schema.And(
+            schema.Use(int), lambda n: 0 < n <= MAX_PAGE_SIZE
+        ),
+        schema.Optional("cursor"): schema.Use(decode_cursor),
+        schema.Optional("order"): schema.Or("asc", "desc"),
+        schema.Optional("min_billed_at"): schema.Use(date.fromisoformat),
+        schema.Optional("max_billed_at"): schema.Use(date.fromisoformat),
+        schema.Optional("type"): str,
+        schema.Optional("account_id"): schema.Use(int),
+        schema.Optional("deleted"): schema.Use(_parse_bool),
+        schema.Optional("has_pending_changes"): schema.Use(_parse_bool),
+        schema.Optional("account_balances"): schema.Use(_parse_bool),
+    },
+    ignore_extra_keys=True,
+)
+# query parameters which select the paginated transaction list, all other parameters are ignored by the full list
+TRANSACTION_PAGE_PARAMETERS = frozenset(
+    (
+        "limit",
+        "cursor",
+        "order",
+        "min_billed_at",
+        "max_billed_at",
+        "type",
+        "account_id",
+        "deleted",
+        "has_pending_changes",
+    )
+)
+
 
 @routes.get(r"/groups/{group_id:\d+}/transactions")
 async def list_transactions(request):
     group_id: int = int(request.match_info["group_id"])
-    transactions = await request.app["transaction_service"].list_transactions(
+    if "since" in request.query:
+        return await list_transaction_changes(request, group_id)
+    if TRANSACTION_PAGE_PARAMETERS.intersection(request.query):
+        return await list_transactions_page(request, group_id)
+
+    if _with_account_balances(request):
+        # the stored account balances are not part of the api json rendered by the database
+        transactions = request.app["transaction_service"].list_transactions(
+            user_id=request["user"]["user_id"], group_id=group_id
+        )
+        return await json_stream_response(
+            request,
+            transactions,
+            functools.partial(TransactionSerializer, with_account_balances=True),
+        )
+
+    # the api representation of the transactions is rendered by the database and passed through as is
+    transactions = request.app["transaction_service"].list_transactions_json(
         user_id=request["user"]["user_id"], group_id=group_id
     )
 
-    serializer = TransactionSerializer(transactions)
-    return json_response(data=serializer.to_repr())
+    return await json_stream_response(request, transactions)
+
+
+async def list_transaction_changes(request, group_id: int):
+    try:
+        since = int(request.query["since"])
+    except ValueError:
+        raise web.HTTPBadRequest(reason="since must be a change sequence number")
+
+    (
+        change_seq,
+        transactions,
+        deleted_transactions,
+    ) = await request.app["transaction_service"].list_transaction_changes(
+        user_id=request["user"]["user_id"], group_id=group_id, since=since
+    )
+
+    serializer = TransactionSerializer(
+        transactions, with_account_balances=_with_account_balances(request)
+    )
+    return json_response(
+        data={
+            "change_seq": change_seq,
+            "transactions": serializer.to_repr(),
+            "deleted_transactions": deleted_transactions,
+        }
+    )
+
+
+async def list_transactions_page(request, group_id: int):
+    try:
+        query = transaction_page_schema.validate(dict(request.query))
+    except schema.SchemaError as e:
+        raise web.HTTPBadRequest(
+            reason=f"Request is invalid; there are validation errors: {e}"
+        )
+
+    transactions, next_key = await request.app[
+        "transaction_service"
+    ].list_transactions_page(
+        user_id=request["user"]["user_id"],
+        group_id=group_id,
+        limit=query.get("limit", DEFAULT_PAGE_SIZE),
+        after=query.get("cursor"),
+        descending=query.get("order") == "desc",
+        min_billed_at=query.get("min_billed_at"),
+        max_billed_at=query.get("max_billed_at"),
+        transaction_type=query.get("type"),
+        account_id=query.get("account_id"),
+        deleted=query.get("deleted"),
+        has_pending_changes=query.get("has_pending_changes"),
+    )
+
+    serializer = TransactionSerializer(
+        transactions, with_account_balances=query.get("account_balances", False)
+    )
+    return json_response(
+        data={
+            "transactions": serializer.to_repr(),
+            "next_cursor": None if next_key is None else encode_cursor(next_key),
+        }
+    )
 
 
 @routes.post(r"/groups/{group_id:\d+}/transactions")
@@ -51,19 +194,197 @@ async def create_transaction(request: Request, data: dict):
     return json_response(data={"transaction_id": transaction_id})
 
 
-@routes.get(r"/transactions/{transaction_id:\d+}")
-async def get_transaction(request: Request):
+shares_schema = {schema.Optional(schema.Use(int)): schema.Use(float)}
+
+transaction_import_schema = schema.Schema(
+    {
+        "type": str,
+        "description": str,
+        "value": schema.Use(float),
+        "currency_symbol": str,
+        "currency_conversion_rate": schema.Use(float),
+        "billed_at": schema.Use(date.fromisoformat),
+        "creditor_shares": shares_schema,
+        "debitor_shares": shares_schema,
+        schema.Optional("purchase_items", default=[]): [
+            {
+                "name": str,
+                "price": schema.Use(float),
+                schema.Optional("communist_shares", default=0.0): schema.Use(float),
+                schema.Optional("usages", default={}): shares_schema,
+            }
+        ],
+    }
+)
+
+
+def _parse_csv_shares(value: str) -> dict[str, str]:
+    """shares in csv imports are given as 'account_id:shares' pairs separated by ';'"""
+    return dict(share.split(":", 1) for share in value.split(";") if share.strip())
+
+
+def _parse_import_csv(text: str) -> list[dict]:
+    records = []
+    for row in csv.DictReader(io.StringIO(text)):
+        row["creditor_shares"] = _parse_csv_shares(row.get("creditor_shares") or "")
+        row["debitor_shares"] = _parse_csv_shares(row.get("debitor_shares") or "")
+        if row.get("purchase_items"):
+            row["purchase_items"] = json.loads(row["purchase_items"])
+        else:
+            row.pop("purchase_items", None)
+        records.append(row)
+    return records
+
+
+def _parse_import_ndjson(text: str) -> list[dict]:
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _new_transaction(record: dict) -> NewTransaction:
+    return NewTransaction(
+        type=record["type"],
+        description=record["description"],
+        value=record["value"],
+        currency_symbol=record["currency_symbol"],
+        currency_conversion_rate=record["currency_conversion_rate"],
+        billed_at=record["billed_at"],
+        creditor_shares=record["creditor_shares"],
+        debitor_shares=record["debitor_shares"],
+        purchase_items=[
+            NewPurchaseItem(
+                name=item["name"],
+                price=item["price"],
+                communist_shares=item["communist_shares"],
+                usages=item["usages"],
+            )
+            for item in record["purchase_items"]
+        ],
+    )
 
-    transaction = await request.app["transaction_service"].get_transaction(
+
+@routes.post(r"/groups/{group_id:\d+}/transactions/import")
+async def import_transactions(request: Request):
+    """
+    import complete transactions, either as newline delimited json objects or, if the content type is
+    text/csv, as csv with one transaction per row
+    """
+    group_id: int = int(request.match_info["group_id"])
+    text = await request.text()
+
+    try:
+        if request.content_type == "text/csv":
+            records = _parse_import_csv(text)
+        else:
+            records = _parse_import_ndjson(text)
+    except (ValueError, csv.Error) as e:
+        raise web.HTTPBadRequest(reason=f"Request is malformed; could not decode: {e}")
+
+    if len(records) > MAX_IMPORT_SIZE:
+        raise web.HTTPBadRequest(
+            reason=f"Cannot import more than {MAX_IMPORT_SIZE} transactions at once"
+        )
+
+    transactions = []
+    for i, record in enumerate(records):
+        try:
+            transactions.append(
+                _new_transaction(transaction_import_schema.validate(record))
+            )
+        except schema.SchemaError as e:
+            raise web.HTTPBadRequest(
+                reason=f"Request is invalid; there are validation errors in transaction {i}: {e}"
+            )
+
+    transaction_ids = await request.app["transaction_service"].import_transactions(
         user_id=request["user"]["user_id"],
-        transaction_id=int(request.match_info["transaction_id"]),
+        group_id=group_id,
+        transactions=transactions,
+    )
+
+    return json_response(data={"transaction_ids": transaction_ids})
+
+
+@routes.post(r"/groups/{group_id:\d+}/transactions/full")
+async def create_transaction_full(request: Request):
+    """create a transaction including its shares and purchase items in one request"""
+    group_id: int = int(request.match_info["group_id"])
+    try:
+        data = await request.json()
+    except (json.decoder.JSONDecodeError, TypeError):
+        raise web.HTTPBadRequest(
+            reason="Request is malformed; could not decode JSON object."
+        )
+
+    try:
+        commit = schema.Schema(bool).validate(data.pop("commit", False))
+        transaction = _new_transaction(transaction_import_schema.validate(data))
+    except (schema.SchemaError, AttributeError) as e:
+        raise web.HTTPBadRequest(
+            reason=f"Request is invalid; there are validation errors: {e}"
+        )
+
+    transaction = await request.app["transaction_service"].create_transaction_full(
+        user_id=request["user"]["user_id"],
+        group_id=group_id,
+        transaction=transaction,
+        commit=commit,
     )
 
     serializer = TransactionSerializer(transaction)
+    return json_response(data=serializer.to_repr())
+
+
+@routes.get(r"/groups/{group_id:\d+}/settlement")
+async def get_settlement(request: Request):
+    mode = request.query.get("mode", "auto")
+    if mode not in SETTLEMENT_MODES:
+        raise web.HTTPBadRequest(
+            reason=f"mode must be one of {', '.join(SETTLEMENT_MODES)}"
+        )
+
+    settlement = await request.app["transaction_service"].get_settlement(
+        user_id=request["user"]["user_id"],
+        group_id=int(request.match_info["group_id"]),
+        exact=SETTLEMENT_MODES[mode],
+    )
 
+    serializer = SettlementSerializer(settlement)
     return json_response(data=serializer.to_repr())
 
 
+@routes.post(r"/groups/{group_id:\d+}/settlement")
+@validate(schema.Schema({schema.Optional("mode"): schema.Or(*SETTLEMENT_MODES)}))
+async def create_settlement_transfers(request: Request, data: dict):
+    """create the transfers of the current settlement as transactions with pending changes"""
+    transaction_ids = await request.app[
+        "transaction_service"
+    ].create_settlement_transfers(
+        user_id=request["user"]["user_id"],
+        group_id=int(request.match_info["group_id"]),
+        exact=SETTLEMENT_MODES[data.get("mode", "auto")],
+    )
+
+    return json_response(data={"transaction_ids": transaction_ids})
+
+
+@routes.get(r"/transactions/{transaction_id:\d+}")
+async def get_transaction(request: Request):
+    if _with_account_balances(request):
+        transaction = await request.app["transaction_service"].get_transaction(
+            user_id=request["user"]["user_id"],
+            transaction_id=int(request.match_info["transaction_id"]),
+        )
+        serializer = TransactionSerializer(transaction, with_account_balances=True)
+        return json_response(data=serializer.to_repr())
+
+    transaction = await request.app["transaction_service"].get_transaction_json(
+        user_id=request["user"]["user_id"],
+        transaction_id=int(request.match_info["transaction_id"]),
+    )
+
+    return json_response(text=transaction)
+
+
 @routes.post(r"/transactions/{transaction_id:\d+}")
 @validate(
     schema.Schema(
@@ -1,7 +1,10 @@
+import asyncio
+import base64
 import functools
 import json
+import logging
 from datetime import datetime, date
-from typing import Optional, Any
+from typing import Optional, Any, AsyncIterator, Type
 from uuid import UUID
 
 import asyncpg
@@ -11,6 +14,32 @@ from aiohttp.typedefs import LooseHeaders
 from schema import Schema, SchemaError
 
 from abrechnung.application import NotFoundError, InvalidCommand
+from abrechnung.http.serializers import Serializer
+
+logger = logging.getLogger(__name__)
+
+# size in bytes up to which streamed responses are buffered before being written out as one chunk
+STREAM_CHUNK_SIZE = 64 * 1024
+# seconds a client may take to accept a chunk of a streamed response, the database connection the items
+# are read from is held until the response is complete
+STREAM_WRITE_TIMEOUT = 30.0
+
+# number of elements per page of keyset paginated lists
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(key: tuple[date, int]) -> str:
+    """opaque cursor for keyset pagination over lists ordered by (billed_at, transaction id)"""
+    billed_at, transaction_id = key
+    return base64.urlsafe_b64encode(
+        f"{billed_at.isoformat()}:{transaction_id}".encode()
+    ).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[date, int]:
+    billed_at, transaction_id = base64.urlsafe_b64decode(cursor).decode().split(":")
+    return date.fromisoformat(billed_at), int(transaction_id)
 
 
 def validate(request_schema: Schema):
@@ -103,5 +132,74 @@ def json_response(
         reason=reason,
         headers=headers,
         content_type=content_type,
-        dumps=lambda x: json.dumps(x, default=encode_json),
+        dumps=_dumps,
     )
+
+
+def _dumps(data: Any) -> str:
+    return json.dumps(data, default=encode_json)
+
+
+async def json_stream_response(
+    request: web.Request,
+    items: AsyncIterator,
+    serializer: Optional[Type[Serializer]] = None,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    write_timeout: float = STREAM_WRITE_TIMEOUT,
+) -> web.StreamResponse:
+    """
+    Stream a json list of all items serialized with the given serializer as a chunked response.
+    Without a serializer the items are expected to already be json encoded strings.
+
+    The first item is fetched before the response is sent such that exceptions raised when setting up the
+    iteration (e.g. by permission checks) still lead to a proper error response. Errors after that and clients
+    not accepting a chunk within the write timeout abort the connection, such that the truncated body is not
+    taken for a complete one.
+    """
+
+    def encode(item) -> str:
+        if serializer is None:
+            return item
+        return _dumps(serializer(item).to_repr())
+
+    try:
+        first = await items.__anext__()
+    except StopAsyncIteration:
+        return json_response(data=[])
+
+    async def write(data: list[str]):
+        await asyncio.wait_for(
+            response.write("".join(data).encode("utf-8")), timeout=write_timeout
+        )
+
+    response = web.StreamResponse(headers={"Content-Type": "application/json"})
+    try:
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+
+        buffer = ["[", encode(first)]
+        buffered = sum(len(b) for b in buffer)
+        async for item in items:
+            buffer.append(",")
+            buffer.append(encode(item))
+            buffered += len(buffer[-1]) + 1
+            if buffered >= chunk_size:
+                await write(buffer)
+                buffer = []
+                buffered = 0
+
+        buffer.append("]")
+        await write(buffer)
+        await response.write_eof()
+    except Exception:  # including timeouts of the client
+        logger.exception(
+            f"streaming the response to {request.method} {request.path} failed"
+        )
+        response.force_close()
+        if request.transport is not None:
+            request.transport.close()
+    finally:
+        # make sure the database cursor is released if the client went away in the meantime
+        await items.aclose()
+
+    return response
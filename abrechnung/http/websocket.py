@@ -1,22 +1,79 @@
+import asyncio
+import json
 import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional, Union
 
 import schema
 from aiohttp import web
 
+from abrechnung.http.utils import encode_json
+
 logger = logging.getLogger(__name__)
 
 routes = web.RouteTableDef()
 
+# channel on which the database publishes notifications for subscriptions, see notify_users
+SUBSCRIPTION_EVENT_CHANNEL = "subscription_event"
+
+# subscription types for which clients can request notifications to include the changed element
+PAYLOAD_SUBSCRIPTION_TYPES = {"transaction"}
+# subscription types for which clients can request the current state of the subscribed group when subscribing
+SNAPSHOT_SUBSCRIPTION_TYPES = {"transaction", "account", "group_member"}
+# keys of notifications which do not identify the change they describe, i.e. the changed element included as
+# payload and the sequence number of the change feed entry
+NOTIFICATION_VOLATILE_KEYS = {"transaction", "seq"}
+# subscription types whose element is a group, subscribing to them requires being a member of the group
+GROUP_SUBSCRIPTION_TYPES = {
+    "account",
+    "group_member",
+    "group_invite",
+    "group_log",
+    "transaction",
+}
+
+SUBSCRIPTION_SCHEMA = {
+    "subscription_type": str,
+    "element_id": int,
+    schema.Optional("with_payload"): bool,
+    # resume group scoped subscriptions after the last change feed entry the client has seen
+    schema.Optional("last_seq"): int,
+}
+
+SUBSCRIBE_SCHEMA = {
+    **SUBSCRIPTION_SCHEMA,
+    # reply with the current state of the subscribed group instead of replaying missed changes
+    schema.Optional("with_snapshot"): bool,
+}
+
+# messages can either carry their own token or rely on the connection having been authenticated before
 CLIENT_SCHEMA = schema.Schema(
     schema.Or(
+        {
+            "type": "authenticate",
+            "data": {"token": str},
+        },
         {
             "type": "subscribe",
-            "token": str,
-            "data": {"subscription_type": str, "element_id": int},
+            schema.Optional("token"): str,
+            "data": SUBSCRIBE_SCHEMA,
+        },
+        {
+            "type": "subscribe_many",
+            schema.Optional("token"): str,
+            "data": {
+                schema.Optional("subscriptions"): [SUBSCRIPTION_SCHEMA],
+                # subscribe to these types for all groups the user is a member of
+                schema.Optional("group_subscription_types"): [
+                    schema.Or(*GROUP_SUBSCRIPTION_TYPES)
+                ],
+                schema.Optional("with_payload"): bool,
+            },
         },
         {
             "type": "unsubscribe",
-            "token": str,
+            schema.Optional("token"): str,
             "data": {"subscription_type": str, "element_id": int},
         },
     )
@@ -32,11 +89,44 @@ SERVER_SCHEMA = schema.Schema(
                 "element_id": int,
             },
         },
+        {
+            "type": "notification_batch",
+            "data": [
+                {
+                    "subscription_type": str,
+                    "element_id": int,
+                }
+            ],
+        },
+        {"type": "authenticate_success", "data": {"user_id": int}},
+        {"type": "authentication_expired", "data": {}},
+        {
+            "type": "subscribe_many_success",
+            "data": {
+                "subscriptions": [
+                    {
+                        "subscription_type": str,
+                        "element_id": int,
+                        "with_payload": bool,
+                        schema.Optional("last_seq"): int,
+                        schema.Optional("resync"): bool,
+                    }
+                ]
+            },
+        },
         {
             "type": "subscribe_success",
             "data": {
                 "subscription_type": str,
                 "element_id": int,
+                schema.Optional("with_payload"): bool,
+                schema.Optional("last_seq"): int,
+                # the missed changes are no longer available, the client needs to fetch the element again
+                schema.Optional("resync"): bool,
+                schema.Optional("with_snapshot"): bool,
+                # the state of the subscribed group up to and including change feed entry seq
+                schema.Optional("seq"): int,
+                schema.Optional("snapshot"): [dict],
             },
         },
         {
@@ -52,3 +142,246 @@ SERVER_SCHEMA = schema.Schema(
 
 def make_error_msg(code: int, msg: str) -> dict:
     return {"type": "error", "data": {"code": code, "msg": msg}}
+
+
+def notification_key(data: dict) -> tuple:
+    """
+    notifications with the same key describe the same change, e.g. the same transaction of a group
+    """
+    return tuple(
+        sorted(
+            (key, value)
+            for key, value in data.items()
+            if key not in NOTIFICATION_VOLATILE_KEYS
+        )
+    )
+
+
+def encode_with_raw_json(data: dict, raw: Optional[dict[str, str]] = None) -> str:
+    """
+    json encode a dict, adding the given values which are already json encoded, e.g. as rendered by the database
+    """
+    encoded = json.dumps(data, default=encode_json)
+    if not raw:
+        return encoded
+
+    raw_items = ", ".join(f"{json.dumps(key)}: {value}" for key, value in raw.items())
+    return f"{encoded[:-1]}{', ' if data else ''}{raw_items}}}"
+
+
+@dataclass(frozen=True)
+class Notification:
+    """
+    a notification which is json encoded once and shared by the tx queues of all connections it is sent to
+    """
+
+    key: tuple
+    # the json encoded notification data
+    data: str
+    # the websocket frame for sending this notification on its own
+    frame: str
+    # sequence number of the change feed entry the notification was created from, if any
+    seq: Optional[int] = None
+
+    @classmethod
+    def encode(cls, data: dict, raw: Optional[dict[str, str]] = None) -> "Notification":
+        """raw contains additional values which are already json encoded, they do not contribute to the key"""
+        encoded = encode_with_raw_json(data, raw)
+        return cls(
+            key=notification_key(data),
+            data=encoded,
+            frame=f'{{"type": "notification", "data": {encoded}}}\n',
+            seq=data.get("seq"),
+        )
+
+
+@dataclass(frozen=True)
+class EncodedMessage:
+    """a message other than a notification which has already been encoded to a websocket frame"""
+
+    frame: str
+
+    @classmethod
+    def encode(
+        cls, type: str, data: dict, raw: Optional[dict[str, str]] = None
+    ) -> "EncodedMessage":
+        """raw contains additional values of data which are already json encoded"""
+        encoded = encode_with_raw_json(data, raw)
+        return cls(frame=f'{{"type": {json.dumps(type)}, "data": {encoded}}}\n')
+
+
+def encode_messages(
+    messages: list[Union[Notification, EncodedMessage, dict]],
+) -> list[str]:
+    """
+    encode messages from a tx queue to websocket frames, combining consecutive notifications into
+    a single notification batch.
+
+    Within a batch duplicate notifications are dropped, the position of the first one is kept but its
+    data is replaced by the latest one such that included payloads are up to date.
+    All other messages are passed on in order.
+    """
+    frames = []
+    batch: dict[tuple, Notification] = {}
+
+    def flush():
+        if len(batch) == 1:
+            frames.append(batch.popitem()[1].frame)
+        elif batch:
+            data = ", ".join(notification.data for notification in batch.values())
+            frames.append(f'{{"type": "notification_batch", "data": [{data}]}}\n')
+        batch.clear()
+
+    for message in messages:
+        if isinstance(message, Notification):
+            batch[message.key] = message
+        elif isinstance(message, EncodedMessage):
+            flush()
+            frames.append(message.frame)
+        else:
+            flush()
+            frames.append(json.dumps(message, default=encode_json) + "\n")
+
+    flush()
+    return frames
+
+
+@dataclass
+class WebsocketSession:
+    """
+    the user a websocket connection has been authenticated as by an authenticate message.
+
+    Once the access token expires the client is asked to authenticate again.
+    """
+
+    user_id: int
+    session_id: int
+    expires_at: datetime
+    expiry_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def expired(self) -> bool:
+        return datetime.now(tz=timezone.utc) >= self.expires_at
+
+
+@dataclass
+class Subscriber:
+    user_id: int
+    with_payload: bool = False
+    # notifications held back until the reply to the subscription has been queued, None once it has been
+    buffer: Optional[list[Notification]] = None
+
+
+class SubscriptionRegistry:
+    """
+    in memory registry of the subscriptions of all websocket connections of a forwarder.
+
+    Permissions are checked once when subscribing, notifications published by the database on the
+    shared subscription event channel are resolved to the subscribed connections here.
+    """
+
+    def __init__(self):
+        # (subscription_type, element_id) -> connection_id -> subscriber
+        self._subscriptions: dict[tuple[str, int], dict[int, Subscriber]] = {}
+        # connection_id -> subscriptions of this connection
+        self._connections: dict[int, set[tuple[str, int]]] = {}
+
+    def subscribe(
+        self,
+        connection_id: int,
+        user_id: int,
+        subscription_type: str,
+        element_id: int,
+        with_payload: bool = False,
+        buffered: bool = False,
+    ):
+        """
+        buffered subscriptions do not receive notifications until they are released, such that the reply to the
+        subscription can be sent before all notifications dispatched while it is being prepared
+        """
+        subscription = (subscription_type, element_id)
+        self._subscriptions.setdefault(subscription, {})[connection_id] = Subscriber(
+            user_id=user_id, with_payload=with_payload, buffer=[] if buffered else None
+        )
+        self._connections.setdefault(connection_id, set()).add(subscription)
+
+    def release(
+        self,
+        connection_id: int,
+        subscription_type: str,
+        element_id: int,
+        after_seq: Optional[int] = None,
+    ) -> list[Notification]:
+        """
+        stop buffering the notifications of a subscription.
+
+        Returns the buffered notifications except the ones for change feed entries up to and including after_seq
+        which the client already received as part of the reply to the subscription.
+        """
+        subscriber = self._subscriptions.get((subscription_type, element_id), {}).get(
+            connection_id
+        )
+        if subscriber is None or subscriber.buffer is None:
+            return []
+
+        buffered, subscriber.buffer = subscriber.buffer, None
+        return [
+            notification
+            for notification in buffered
+            if after_seq is None
+            or notification.seq is None
+            or notification.seq > after_seq
+        ]
+
+    def unsubscribe(
+        self, connection_id: int, user_id: int, subscription_type: str, element_id: int
+    ):
+        subscription = (subscription_type, element_id)
+        subscribers = self._subscriptions.get(subscription, {})
+        subscriber = subscribers.get(connection_id)
+        if subscriber is None or subscriber.user_id != user_id:
+            return
+
+        del subscribers[connection_id]
+        if not subscribers:
+            del self._subscriptions[subscription]
+        self._connections[connection_id].discard(subscription)
+
+    def remove_connection(self, connection_id: int):
+        for subscription in self._connections.pop(connection_id, set()):
+            subscribers = self._subscriptions[subscription]
+            del subscribers[connection_id]
+            if not subscribers:
+                del self._subscriptions[subscription]
+
+    def remove_group_member(self, group_id: int, user_id: int):
+        """drop all subscriptions to the group of a user which is no longer a member"""
+        for subscription_type in GROUP_SUBSCRIPTION_TYPES:
+            subscribers = self._subscriptions.get((subscription_type, group_id), {})
+            for connection_id, subscriber in list(subscribers.items()):
+                if subscriber.user_id == user_id:
+                    self.unsubscribe(
+                        connection_id, user_id, subscription_type, group_id
+                    )
+
+    def subscribers(
+        self,
+        subscription_type: str,
+        element_id: int,
+        user_ids: Optional[list[int]] = None,
+    ) -> dict[int, Subscriber]:
+        """
+        the connections subscribed to an element, restricted to the given users if any
+        """
+        subscribers = self._subscriptions.get((subscription_type, element_id), {})
+        if user_ids is None:
+            return dict(subscribers)
+
+        return {
+            connection_id: subscriber
+            for connection_id, subscriber in subscribers.items()
+            if subscriber.user_id in user_ids
+        }
+
+    def __len__(self):
+        return sum(len(subscribers) for subscribers in self._subscriptions.values())
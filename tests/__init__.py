@@ -11,7 +11,7 @@ from aiohttp.test_utils import (
 from asyncpg.pool import Pool
 
 from abrechnung.application.users import UserService
-from abrechnung.database import revisions
+from abrechnung.database import revisions, init_connection
 
 lock = threading.Lock()
 
@@ -37,6 +37,7 @@ async def get_test_db() -> Pool:
         database=cfg["dbname"],
         host=cfg["host"],
         port=cfg["port"],
+        init=init_connection,
     )
 
     await revisions.reset_schema(pool)
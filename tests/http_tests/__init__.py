@@ -82,10 +82,21 @@ class BaseHTTPAPITest(AsyncHTTPTestCase):
             self.db_conn, forwarder_id="test_forwarder"
         )
 
-        self.group_service = GroupService(self.db_pool)
-        self.account_service = AccountService(self.db_pool)
-        self.user_service = UserService(self.db_pool, enable_registration=True)
-        self.transaction_service = TransactionService(self.db_pool)
+        permission_cache = self.http_service.permission_cache
+        self.group_service = GroupService(
+            self.db_pool, permission_cache=permission_cache
+        )
+        self.account_service = AccountService(
+            self.db_pool, permission_cache=permission_cache
+        )
+        self.user_service = UserService(
+            self.db_pool,
+            enable_registration=True,
+            session_cache=self.http_service.session_cache,
+        )
+        self.transaction_service = TransactionService(
+            self.db_pool, permission_cache=permission_cache
+        )
 
         app = self.http_service.create_app(db_pool=self.db_pool)
 
@@ -1,3 +1,5 @@
+import asyncio
+
 from aiohttp.test_utils import unittest_run_loop
 from jose import jwt
 
@@ -269,3 +271,28 @@ class AuthAPITest(BaseHTTPAPITest):
         )
         self.assertEqual(204, resp.status)
         await self._fetch_profile(token, expected_status=401)
+
+    @unittest_run_loop
+    async def test_session_cache(self):
+        user_id, password = await self._create_test_user("user1", "user@email.email")
+        resp = await self._login("user1", password, session_name="session1")
+        token = resp["access_token"]
+
+        cache = self.http_service.session_cache
+        profile = await self._fetch_profile(token)
+        session_id = profile["sessions"][0]["id"]
+        self.assertTrue(cache.is_valid(session_id, user_id))
+
+        hits = cache.hits
+        await self._fetch_profile(token)
+        self.assertEqual(hits + 1, cache.hits)
+
+        # sessions removed outside of the api are dropped from the cache via notifications
+        invalidations = cache.invalidations
+        async with self.db_pool.acquire() as conn:
+            await conn.execute("delete from session where id = $1", session_id)
+        for _ in range(50):
+            if cache.invalidations > invalidations:
+                break
+            await asyncio.sleep(0.05)
+        await self._fetch_profile(token, expected_status=401)
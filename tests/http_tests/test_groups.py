@@ -1,3 +1,4 @@
+import asyncio
 from datetime import timedelta, datetime, timezone
 
 from aiohttp.test_utils import unittest_run_loop
@@ -331,6 +332,79 @@ class GroupAPITest(HTTPAPITest):
             list(filter(lambda x: x["user_id"] == user2_id, members))[0]["is_owner"]
         )
 
+    @unittest_run_loop
+    async def test_permission_cache(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        cache = self.http_service.permission_cache
+        await self._fetch_group(group_id)
+        self.assertEqual(
+            (True, True), cache.get_membership(self.test_user_id, group_id)
+        )
+
+        resp = await self._get("/api/v1/metrics")
+        self.assertEqual(200, resp.status)
+        stats = (await resp.json())["permission_cache"]
+        self.assertGreater(stats["hits"], 0)
+        self.assertGreater(stats["memberships"], 0)
+
+        # transaction lookups are counted separately from membership lookups
+        hits, misses = cache.hits, cache.misses
+        transaction_hits = cache.transaction_hits
+        transaction_misses = cache.transaction_misses
+        self.assertIsNone(cache.get_transaction(1234))
+        cache.set_transaction(1234, group_id, "purchase")
+        self.assertEqual((group_id, "purchase"), cache.get_transaction(1234))
+        self.assertEqual((hits, misses), (cache.hits, cache.misses))
+        self.assertEqual(transaction_hits + 1, cache.transaction_hits)
+        self.assertEqual(transaction_misses + 1, cache.transaction_misses)
+
+        # changes made outside of the services are picked up via notifications
+        invalidations = cache.invalidations
+        async with self.db_pool.acquire() as conn:
+            await conn.execute(
+                "update group_membership set can_write = false, is_owner = false "
+                "where group_id = $1 and user_id = $2",
+                group_id,
+                self.test_user_id,
+            )
+        for _ in range(50):
+            if cache.invalidations > invalidations:
+                break
+            await asyncio.sleep(0.05)
+        self.assertIsNone(cache.get_membership(self.test_user_id, group_id))
+
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}",
+            json={
+                "name": "name2",
+                "description": "description2",
+                "currency_symbol": "$",
+                "terms": "new terms",
+            },
+        )
+        self.assertEqual(403, resp.status)
+
+        # leaving the group is reflected immediately
+        user2_id, _ = await self._create_test_user("user2", "user2@email.stuff")
+        async with self.db_pool.acquire() as conn:
+            await conn.execute(
+                "insert into group_membership (user_id, group_id, invited_by) values ($1, $2, $3)",
+                user2_id,
+                group_id,
+                self.test_user_id,
+            )
+        await self._fetch_group(group_id)
+        await self.group_service.leave_group(
+            user_id=self.test_user_id, group_id=group_id
+        )
+        await self._fetch_group(group_id, expected_status=404)
+
     @unittest_run_loop
     async def test_get_account(self):
         group_id = await self.group_service.create_group(
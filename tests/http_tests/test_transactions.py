@@ -1,8 +1,14 @@
+import json
 from datetime import date
 from pprint import pprint
+from unittest import mock
 
+import aiohttp
+import asyncpg
 from aiohttp.test_utils import unittest_run_loop
 
+from abrechnung.application.transactions import TransactionService
+from abrechnung.http.serializers import TransactionSerializer
 from tests.http_tests import HTTPAPITest
 
 
@@ -691,3 +697,1118 @@ class TransactionAPITest(HTTPAPITest):
         self.assertIsNotNone(t["current_state"]["purchase_items"])
         self.assertEqual(1, len(t["current_state"]["purchase_items"]))
         self.assertTrue(t["current_state"]["purchase_items"][0]["deleted"])
+
+    @unittest_run_loop
+    async def test_transaction_snapshot_consistency(self):
+        group_id, transaction_id = await self._create_group_with_transaction("purchase")
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+        await self._post_debitor_share(transaction_id, account1_id, 1.0)
+        await self._post_creditor_share(transaction_id, account2_id, 1.0)
+        resp = await self._post(
+            f"/api/v1/transactions/{transaction_id}/purchase_items",
+            json={"name": "carrots", "price": 12.22, "communist_shares": 1},
+        )
+        self.assertEqual(200, resp.status)
+        await self._commit_transaction(transaction_id)
+        await self._post_debitor_share(transaction_id, account2_id, 2.0)
+
+        inconsistencies = await self.db_conn.fetch(
+            "select * from check_transaction_snapshots()"
+        )
+        self.assertEqual(0, len(inconsistencies))
+
+        n_rows = await self.db_conn.fetchval(
+            "select count(*) from transaction_snapshot where transaction_id = $1",
+            transaction_id,
+        )
+        self.assertEqual(2, n_rows)
+
+        # the snapshot rows are computed per transaction but have to match the full state views
+        def normalize(details: dict) -> dict:
+            for key in ("creditor_shares", "debitor_shares"):
+                details[key].sort(key=lambda s: s["account_id"])
+            return details
+
+        expected = await self.db_conn.fetch(
+            "select null::integer as pending_user_id, to_jsonb(cts)::text as details "
+            "from committed_transaction_state cts where cts.id = $1 "
+            "union all "
+            "select ptr.user_id, to_jsonb(ptr)::text "
+            "from pending_transaction_revisions ptr where ptr.id = $1",
+            transaction_id,
+        )
+        snapshot = await self.db_conn.fetch(
+            "select pending_user_id, details::text as details "
+            "from transaction_snapshot where transaction_id = $1",
+            transaction_id,
+        )
+        self.assertEqual(
+            {
+                r["pending_user_id"]: normalize(json.loads(r["details"]))
+                for r in expected
+            },
+            {
+                r["pending_user_id"]: normalize(json.loads(r["details"]))
+                for r in snapshot
+            },
+        )
+
+        await self.db_conn.execute(
+            "delete from transaction_snapshot where transaction_id = $1 and pending_user_id is null",
+            transaction_id,
+        )
+        inconsistencies = await self.db_conn.fetch(
+            "select * from check_transaction_snapshots()"
+        )
+        self.assertEqual(1, len(inconsistencies))
+        self.assertEqual("missing", inconsistencies[0]["problem"])
+
+        await self.db_conn.execute("call rebuild_transaction_snapshots()")
+        inconsistencies = await self.db_conn.fetch(
+            "select * from check_transaction_snapshots()"
+        )
+        self.assertEqual(0, len(inconsistencies))
+
+        t = await self._fetch_transaction(transaction_id)
+        self.assertEqual(1, len(t["current_state"]["purchase_items"]))
+        self.assertEqual(
+            2.0,
+            t["pending_changes"][str(self.test_user_id)]["debitor_shares"][
+                str(account2_id)
+            ],
+        )
+
+    async def _fetch_balances(self, group_id: int, verify: bool = False) -> dict:
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/balances",
+            params={"verify": "true" if verify else "false"},
+        )
+        self.assertEqual(200, resp.status)
+        ret_data = await resp.json()
+        return {b["account_id"]: b for b in ret_data}
+
+    @unittest_run_loop
+    async def test_account_balances(self):
+        group_id, transaction_id = await self._create_group_with_transaction("purchase")
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+        await self._post_creditor_share(transaction_id, account1_id, 1.0)
+        await self._post_debitor_share(transaction_id, account1_id, 1.0)
+        await self._post_debitor_share(transaction_id, account2_id, 1.0)
+        resp = await self._post(
+            f"/api/v1/transactions/{transaction_id}/purchase_items",
+            json={"name": "carrots", "price": 20, "communist_shares": 0},
+        )
+        self.assertEqual(200, resp.status)
+        item_id = (await resp.json())["item_id"]
+        resp = await self._post(
+            f"/api/v1/purchase_items/{item_id}/shares",
+            json={"account_id": account2_id, "share_amount": 1},
+        )
+        self.assertEqual(204, resp.status)
+
+        # nothing has been committed yet
+        balances = await self._fetch_balances(group_id)
+        self.assertEqual(0, balances[account1_id]["balance"])
+        self.assertEqual(0, balances[account2_id]["balance"])
+
+        await self._commit_transaction(transaction_id)
+        balances = await self._fetch_balances(group_id)
+        self.assertAlmostEqual(
+            (122.22 - 102.22 / 2) * 1.22, balances[account1_id]["balance"]
+        )
+        self.assertAlmostEqual(
+            -(20 + 102.22 / 2) * 1.22, balances[account2_id]["balance"]
+        )
+
+        # pending changes do not affect the balances
+        await self._update_transaction(
+            transaction_id,
+            value=220,
+            description="description123",
+            billed_at=date.today(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+        )
+        balances = await self._fetch_balances(group_id)
+        self.assertAlmostEqual(
+            (122.22 - 102.22 / 2) * 1.22, balances[account1_id]["balance"]
+        )
+
+        await self._commit_transaction(transaction_id)
+        balances = await self._fetch_balances(group_id, verify=True)
+        self.assertAlmostEqual(220 - 200 / 2, balances[account1_id]["balance"])
+        self.assertAlmostEqual(-(20 + 200 / 2), balances[account2_id]["balance"])
+        for balance in balances.values():
+            self.assertAlmostEqual(0, balance["drift"])
+
+        # introduce drift into the cache which verification has to detect
+        await self.db_conn.execute(
+            "update account_balance_cache set balance = balance + 1 where account_id = $1",
+            account1_id,
+        )
+        balances = await self._fetch_balances(group_id, verify=True)
+        self.assertAlmostEqual(1, balances[account1_id]["drift"])
+        self.assertAlmostEqual(0, balances[account2_id]["drift"])
+
+        await self.db_conn.execute("call rebuild_account_balance_cache()")
+        await self._delete_transaction(transaction_id)
+        balances = await self._fetch_balances(group_id, verify=True)
+        for balance in balances.values():
+            self.assertAlmostEqual(0, balance["balance"])
+            self.assertAlmostEqual(0, balance["drift"])
+
+    async def _fetch_balance_history(self, group_id: int, granularity: str) -> dict:
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/balances/history",
+            params={"granularity": granularity},
+        )
+        self.assertEqual(200, resp.status)
+        ret_data = await resp.json()
+        return {
+            h["account_id"]: dict(zip(h["periods"], h["balances"])) for h in ret_data
+        }
+
+    @unittest_run_loop
+    async def test_account_balance_history(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+
+        transaction_ids = []
+        for billed_at, value in (
+            ("2021-01-03", 10),
+            ("2021-01-03", 5),
+            ("2021-01-20", 20),
+            ("2021-03-01", 40),
+        ):
+            resp = await self._post(
+                f"/api/v1/groups/{group_id}/transactions/full",
+                json={
+                    "type": "transfer",
+                    "description": "transfer",
+                    "value": value,
+                    "currency_symbol": "€",
+                    "currency_conversion_rate": 1.0,
+                    "billed_at": billed_at,
+                    "creditor_shares": {str(account1_id): 1},
+                    "debitor_shares": {str(account2_id): 1},
+                    "purchase_items": [],
+                    "commit": True,
+                },
+            )
+            self.assertEqual(200, resp.status)
+            transaction_ids.append((await resp.json())["id"])
+
+        history = await self._fetch_balance_history(group_id, "day")
+        self.assertEqual(
+            {"2021-01-03": 15, "2021-01-20": 35, "2021-03-01": 75}, history[account1_id]
+        )
+        self.assertEqual(
+            {"2021-01-03": -15, "2021-01-20": -35, "2021-03-01": -75},
+            history[account2_id],
+        )
+
+        # moving a transaction to another day moves its effect on the balances
+        await self._update_transaction(
+            transaction_ids[2],
+            value=20,
+            description="transfer",
+            billed_at=date(2021, 2, 10),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+        )
+        await self._commit_transaction(transaction_ids[2])
+        history = await self._fetch_balance_history(group_id, "month")
+        self.assertEqual(
+            {"2021-01-01": 15, "2021-02-01": 35, "2021-03-01": 75}, history[account1_id]
+        )
+        history = await self._fetch_balance_history(group_id, "week")
+        # 2021-02-10 is a wednesday, weeks start on mondays
+        self.assertEqual(35, history[account1_id]["2021-02-08"])
+
+        await self._delete_transaction(transaction_ids[3])
+        history = await self._fetch_balance_history(group_id, "day")
+        self.assertEqual({"2021-01-03": 15, "2021-02-10": 35}, history[account1_id])
+
+        # the incrementally maintained history and checkpoints match a full recomputation
+        checkpoint_query = (
+            "select account_id, month, balance from account_balance_checkpoint "
+            "where group_id = $1 order by account_id, month"
+        )
+        checkpoints = await self.db_conn.fetch(checkpoint_query, group_id)
+        self.assertEqual(
+            [(date(2021, 1, 1), 15), (date(2021, 2, 1), 35)],
+            [
+                (c["month"], c["balance"])
+                for c in checkpoints
+                if c["account_id"] == account1_id
+            ],
+        )
+        await self.db_conn.execute("call rebuild_account_balance_cache()")
+        self.assertEqual(history, await self._fetch_balance_history(group_id, "day"))
+        self.assertEqual(
+            checkpoints, await self.db_conn.fetch(checkpoint_query, group_id)
+        )
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/balances/history",
+            params={"granularity": "hour"},
+        )
+        self.assertEqual(400, resp.status)
+
+    async def _fetch_ledger(self, group_id: int, account_id: int, **params) -> list:
+        """fetch all pages of the ledger of an account"""
+        entries = []
+        cursor = None
+        while True:
+            if cursor is not None:
+                params["cursor"] = cursor
+            resp = await self._get(
+                f"/api/v1/groups/{group_id}/accounts/{account_id}/ledger",
+                params=params,
+            )
+            self.assertEqual(200, resp.status)
+            page = await resp.json()
+            entries.extend(page["entries"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return entries
+
+    @unittest_run_loop
+    async def test_account_ledger(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+        account3_id = await self._create_account(group_id, "account3")
+
+        transactions = [
+            {
+                "type": "purchase",
+                "description": "groceries",
+                "value": 100,
+                "billed_at": "2021-01-03",
+                "creditor_shares": {str(account1_id): 1},
+                "debitor_shares": {str(account1_id): 1, str(account2_id): 1},
+                "purchase_items": [
+                    {
+                        "name": "carrots",
+                        "price": 20,
+                        "communist_shares": 0,
+                        "usages": {str(account2_id): 1},
+                    }
+                ],
+            },
+            {
+                "type": "transfer",
+                "description": "unrelated",
+                "value": 10,
+                "billed_at": "2021-01-03",
+                "creditor_shares": {str(account1_id): 1},
+                "debitor_shares": {str(account3_id): 1},
+                "purchase_items": [],
+            },
+        ] + [
+            {
+                "type": "transfer",
+                "description": f"payback{i}",
+                "value": 10,
+                "billed_at": f"2021-02-0{i + 1}",
+                "creditor_shares": {str(account2_id): 1},
+                "debitor_shares": {str(account1_id): 1},
+                "purchase_items": [],
+            }
+            for i in range(5)
+        ]
+        transaction_ids = []
+        for transaction in transactions:
+            resp = await self._post(
+                f"/api/v1/groups/{group_id}/transactions/full",
+                json=dict(
+                    transaction,
+                    currency_symbol="€",
+                    currency_conversion_rate=1.0,
+                    commit=True,
+                ),
+            )
+            self.assertEqual(200, resp.status)
+            transaction_ids.append((await resp.json())["id"])
+        # pending changes do not show up in the ledger
+        await self._update_transaction(
+            transaction_ids[2],
+            value=1000,
+            description="payback0",
+            billed_at=date(2021, 2, 1),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+        )
+
+        ledger = await self._fetch_ledger(group_id, account2_id, limit=2)
+        self.assertEqual(
+            [transaction_ids[0]] + transaction_ids[2:],
+            [entry["transaction_id"] for entry in ledger],
+        )
+        self.assertEqual(0, ledger[0]["credit"])
+        # half of the value not covered by the purchase item plus the purchase item
+        self.assertAlmostEqual(80 / 2 + 20, ledger[0]["debit"])
+        self.assertAlmostEqual(-60, ledger[0]["balance"])
+        self.assertEqual("payback0", ledger[1]["description"])
+        self.assertEqual("2021-02-01", ledger[1]["billed_at"])
+        self.assertEqual(10, ledger[1]["credit"])
+        self.assertAlmostEqual(-50, ledger[1]["balance"])
+        balances = await self._fetch_balances(group_id)
+        self.assertAlmostEqual(-10, ledger[-1]["balance"])
+        self.assertAlmostEqual(balances[account2_id]["balance"], ledger[-1]["balance"])
+
+        # the running balance does not depend on the page boundaries or the order
+        self.assertEqual(
+            list(reversed(ledger)),
+            await self._fetch_ledger(group_id, account2_id, limit=3, order="desc"),
+        )
+        ledger = await self._fetch_ledger(group_id, account1_id, limit=1)
+        self.assertEqual(7, len(ledger))
+        self.assertAlmostEqual(100 - 80 / 2, ledger[0]["balance"])
+        self.assertAlmostEqual(100 - 80 / 2 + 10, ledger[1]["balance"])
+        self.assertAlmostEqual(balances[account1_id]["balance"], ledger[-1]["balance"])
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/accounts/{account1_id + 1000}/ledger"
+        )
+        self.assertEqual(404, resp.status)
+
+    async def _fetch_transaction_changes(self, group_id: int, since: int) -> dict:
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions", params={"since": since}
+        )
+        self.assertEqual(200, resp.status)
+        return await resp.json()
+
+    @unittest_run_loop
+    async def test_transaction_delta_sync(self):
+        group_id, transaction1_id = await self._create_group_with_transaction(
+            "transfer"
+        )
+        transaction2_id = await self.transaction_service.create_transaction(
+            user_id=self.test_user_id,
+            group_id=group_id,
+            type="transfer",
+            description="description123",
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            billed_at=date.today(),
+            value=10,
+        )
+
+        changes = await self._fetch_transaction_changes(group_id, since=0)
+        self.assertEqual(
+            {transaction1_id, transaction2_id},
+            {t["id"] for t in changes["transactions"]},
+        )
+        self.assertEqual([], changes["deleted_transactions"])
+        change_seq = changes["change_seq"]
+
+        changes = await self._fetch_transaction_changes(group_id, since=change_seq)
+        self.assertEqual(change_seq, changes["change_seq"])
+        self.assertEqual([], changes["transactions"])
+
+        account1_id = await self._create_account(group_id, "account1")
+        await self._post_creditor_share(transaction2_id, account1_id, 1.0)
+        changes = await self._fetch_transaction_changes(group_id, since=change_seq)
+        self.assertLess(change_seq, changes["change_seq"])
+        self.assertEqual([transaction2_id], [t["id"] for t in changes["transactions"]])
+        self.assertEqual(
+            1.0,
+            changes["transactions"][0]["pending_changes"][str(self.test_user_id)][
+                "creditor_shares"
+            ][str(account1_id)],
+        )
+        change_seq = changes["change_seq"]
+
+        await self._delete_transaction(transaction1_id)
+        changes = await self._fetch_transaction_changes(group_id, since=change_seq)
+        self.assertEqual([], changes["transactions"])
+        self.assertEqual([transaction1_id], changes["deleted_transactions"])
+        change_seq = changes["change_seq"]
+
+        # the pending changes of a user leaving the group disappear together with the transaction
+        user2_id, _ = await self._create_test_user("user2", "user2@email.stuff")
+        async with self.db_pool.acquire() as conn:
+            await conn.execute(
+                "insert into group_membership (user_id, group_id, invited_by) values ($1, $2, $3)",
+                user2_id,
+                group_id,
+                self.test_user_id,
+            )
+        transaction3_id = await self.transaction_service.create_transaction(
+            user_id=user2_id,
+            group_id=group_id,
+            type="transfer",
+            description="description123",
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            billed_at=date.today(),
+            value=10,
+        )
+        changes = await self._fetch_transaction_changes(group_id, since=change_seq)
+        self.assertEqual([transaction3_id], [t["id"] for t in changes["transactions"]])
+        change_seq = changes["change_seq"]
+
+        await self.group_service.leave_group(user_id=user2_id, group_id=group_id)
+        changes = await self._fetch_transaction_changes(group_id, since=change_seq)
+        self.assertEqual([], changes["transactions"])
+        self.assertEqual([transaction3_id], changes["deleted_transactions"])
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions", params={"since": "foo"}
+        )
+        self.assertEqual(400, resp.status)
+
+    async def _fetch_transaction_page(
+        self, group_id: int, expected_status: int = 200, **params
+    ) -> dict:
+        resp = await self._get(f"/api/v1/groups/{group_id}/transactions", params=params)
+        self.assertEqual(expected_status, resp.status)
+        return await resp.json()
+
+    @unittest_run_loop
+    async def test_list_transactions_paginated(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+        transaction_ids = []
+        for day in range(1, 6):
+            transaction_id = await self.transaction_service.create_transaction(
+                user_id=self.test_user_id,
+                group_id=group_id,
+                type="transfer",
+                description=f"transaction {day}",
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                billed_at=date(2021, 1, day),
+                value=10,
+            )
+            await self._post_creditor_share(transaction_id, account1_id, 1.0)
+            await self._post_debitor_share(transaction_id, account2_id, 1.0)
+            transaction_ids.append(transaction_id)
+
+        # commit all but the last one
+        for transaction_id in transaction_ids[:-1]:
+            await self._commit_transaction(transaction_id)
+        await self._delete_transaction(transaction_ids[1])
+
+        fetched = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor is not None:
+                params["cursor"] = cursor
+            page = await self._fetch_transaction_page(group_id, **params)
+            self.assertLessEqual(len(page["transactions"]), 2)
+            fetched.extend(t["id"] for t in page["transactions"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(transaction_ids, fetched)
+
+        page = await self._fetch_transaction_page(group_id, order="desc", limit=2)
+        self.assertEqual(
+            transaction_ids[::-1][:2], [t["id"] for t in page["transactions"]]
+        )
+
+        page = await self._fetch_transaction_page(
+            group_id, min_billed_at="2021-01-02", max_billed_at="2021-01-03"
+        )
+        self.assertEqual(transaction_ids[1:3], [t["id"] for t in page["transactions"]])
+        self.assertIsNone(page["next_cursor"])
+
+        page = await self._fetch_transaction_page(group_id, deleted="false")
+        self.assertNotIn(transaction_ids[1], [t["id"] for t in page["transactions"]])
+        self.assertEqual(4, len(page["transactions"]))
+
+        page = await self._fetch_transaction_page(group_id, has_pending_changes="true")
+        self.assertEqual([transaction_ids[-1]], [t["id"] for t in page["transactions"]])
+
+        # account filters apply to the state visible to the user
+        await self._switch_debitor_share(transaction_ids[0], account1_id, 1.0)
+        page = await self._fetch_transaction_page(group_id, account_id=account2_id)
+        self.assertEqual(transaction_ids[1:], [t["id"] for t in page["transactions"]])
+
+        page = await self._fetch_transaction_page(group_id, type="purchase")
+        self.assertEqual([], page["transactions"])
+
+        await self._fetch_transaction_page(group_id, expected_status=400, limit=0)
+        await self._fetch_transaction_page(
+            group_id, expected_status=400, cursor="invalid"
+        )
+
+    @unittest_run_loop
+    async def test_list_transactions_streamed(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        resp = await self._get(f"/api/v1/groups/{group_id}/transactions")
+        self.assertEqual(200, resp.status)
+        self.assertEqual([], await resp.json())
+
+        transaction_ids = []
+        for i in range(20):
+            transaction_id = await self.transaction_service.create_transaction(
+                user_id=self.test_user_id,
+                group_id=group_id,
+                type="transfer",
+                description="a" * 10000,
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                billed_at=date.today(),
+                value=i,
+            )
+            transaction_ids.append(transaction_id)
+
+        resp = await self._get(f"/api/v1/groups/{group_id}/transactions")
+        self.assertEqual(200, resp.status)
+        self.assertEqual("chunked", resp.headers.get("Transfer-Encoding"))
+        ret_data = await resp.json()
+        self.assertEqual(transaction_ids, [t["id"] for t in ret_data])
+
+        # query parameters other than the paging and filter ones keep the full list
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions", params={"_": "1234"}
+        )
+        self.assertEqual(200, resp.status)
+        self.assertEqual(ret_data, await resp.json())
+
+        # permission errors are still reported properly
+        resp = await self._get(f"/api/v1/groups/{group_id + 1}/transactions")
+        self.assertEqual(404, resp.status)
+
+    @unittest_run_loop
+    async def test_list_transactions_stream_error(self):
+        group_id, transaction_id = await self._create_group_with_transaction("transfer")
+        transaction_json = await self.transaction_service.get_transaction_json(
+            user_id=self.test_user_id, transaction_id=transaction_id
+        )
+
+        async def list_transactions_json(_self, *, user_id: int, group_id: int):
+            yield transaction_json
+            raise asyncpg.InterfaceError(
+                "connection was closed in the middle of operation"
+            )
+
+        # errors after the response has been started abort the connection instead of ending the body
+        with mock.patch.object(
+            TransactionService, "list_transactions_json", list_transactions_json
+        ), self.assertLogs("abrechnung.http.utils", level="ERROR"):
+            resp = await self._get(f"/api/v1/groups/{group_id}/transactions")
+            self.assertEqual(200, resp.status)
+            with self.assertRaises(aiohttp.ClientError):
+                await resp.read()
+
+    @unittest_run_loop
+    async def test_transaction_api_json_matches_serializer(self):
+        group_id, transaction_id = await self._create_group_with_transaction("purchase")
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+        await self._post_creditor_share(transaction_id, account1_id, 1.0)
+        await self._post_debitor_share(transaction_id, account2_id, 2.5)
+        for name in ["carrots", "potatoes"]:
+            resp = await self._post(
+                f"/api/v1/transactions/{transaction_id}/purchase_items",
+                json={"name": name, "price": 12.5, "communist_shares": 1},
+            )
+            self.assertEqual(200, resp.status)
+            item_id = (await resp.json())["item_id"]
+        resp = await self._post(
+            f"/api/v1/purchase_items/{item_id}/shares",
+            json={"account_id": account1_id, "share_amount": 1.5},
+        )
+        self.assertEqual(204, resp.status)
+        await self._commit_transaction(transaction_id)
+        await self._post_debitor_share(transaction_id, account1_id, 1.0)
+        # a transaction without any purchase items or shares
+        _, transaction2_id = await self._create_group_with_transaction("transfer")
+
+        for t_id in [transaction_id, transaction2_id]:
+            transaction = await self.transaction_service.get_transaction(
+                user_id=self.test_user_id, transaction_id=t_id
+            )
+            expected = TransactionSerializer(transaction).to_repr()
+            self.assertEqual(expected, await self._fetch_transaction(t_id))
+
+        resp = await self._get(f"/api/v1/groups/{group_id}/transactions")
+        self.assertEqual(200, resp.status)
+        transaction = await self.transaction_service.get_transaction(
+            user_id=self.test_user_id, transaction_id=transaction_id
+        )
+        self.assertEqual(
+            [TransactionSerializer(transaction).to_repr()], await resp.json()
+        )
+
+    @unittest_run_loop
+    async def test_import_transactions(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+
+        records = [
+            {
+                "type": "purchase",
+                "description": "groceries",
+                "value": 100,
+                "currency_symbol": "€",
+                "currency_conversion_rate": 1.0,
+                "billed_at": "2021-01-03",
+                "creditor_shares": {str(account1_id): 1},
+                "debitor_shares": {str(account1_id): 1, str(account2_id): 1},
+                "purchase_items": [
+                    {
+                        "name": "carrots",
+                        "price": 20,
+                        "communist_shares": 0,
+                        "usages": {str(account2_id): 1},
+                    }
+                ],
+            },
+            {
+                "type": "transfer",
+                "description": "payback",
+                "value": 60,
+                "currency_symbol": "€",
+                "currency_conversion_rate": 1.0,
+                "billed_at": "2021-01-04",
+                "creditor_shares": {str(account2_id): 1},
+                "debitor_shares": {str(account1_id): 1},
+            },
+        ]
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/import",
+            data="\n".join(json.dumps(record) for record in records),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        self.assertEqual(200, resp.status)
+        transaction_ids = (await resp.json())["transaction_ids"]
+        self.assertEqual(2, len(transaction_ids))
+
+        t = await self._fetch_transaction(transaction_ids[0])
+        self.assertEqual({}, t["pending_changes"])
+        self.assertEqual(100, t["current_state"]["value"])
+        self.assertEqual(1, len(t["current_state"]["purchase_items"]))
+        self.assertEqual(
+            {str(account2_id): 1},
+            t["current_state"]["purchase_items"][0]["usages"],
+        )
+        balances = await self._fetch_balances(group_id, verify=True)
+        self.assertAlmostEqual(100 - 80 / 2 - 60, balances[account1_id]["balance"])
+        self.assertAlmostEqual(-(20 + 80 / 2) + 60, balances[account2_id]["balance"])
+        for balance in balances.values():
+            self.assertAlmostEqual(0, balance["drift"])
+        history = await self._fetch_balance_history(group_id, "day")
+        self.assertEqual(["2021-01-03", "2021-01-04"], list(history[account1_id]))
+        self.assertAlmostEqual(
+            balances[account1_id]["balance"], history[account1_id]["2021-01-04"]
+        )
+        self.assertEqual(
+            [], await self.db_conn.fetch("select * from check_transaction_snapshots()")
+        )
+
+        csv_data = (
+            "type,description,value,currency_symbol,currency_conversion_rate,billed_at,creditor_shares,debitor_shares\n"
+            f"mimo,dinner,30,€,1.0,2021-01-05,{account1_id}:1,{account1_id}:1;{account2_id}:2\n"
+        )
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/import",
+            data=csv_data.encode("utf-8"),
+            headers={"Content-Type": "text/csv"},
+        )
+        self.assertEqual(200, resp.status)
+        (transaction_id,) = (await resp.json())["transaction_ids"]
+        t = await self._fetch_transaction(transaction_id)
+        self.assertEqual(
+            {str(account1_id): 1, str(account2_id): 2},
+            t["current_state"]["debitor_shares"],
+        )
+
+        # invalid transactions abort the whole import
+        n_transactions = await self.db_conn.fetchval(
+            "select count(*) from transaction where group_id = $1", group_id
+        )
+        invalid = dict(records[1], debitor_shares={})
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/import",
+            data="\n".join(json.dumps(record) for record in [records[0], invalid]),
+        )
+        self.assertEqual(400, resp.status)
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/import",
+            data=json.dumps(dict(records[1], value="abc")),
+        )
+        self.assertEqual(400, resp.status)
+        self.assertEqual(
+            n_transactions,
+            await self.db_conn.fetchval(
+                "select count(*) from transaction where group_id = $1", group_id
+            ),
+        )
+
+    @unittest_run_loop
+    async def test_create_transaction_full(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+
+        data = {
+            "type": "purchase",
+            "description": "receipt",
+            "value": 100,
+            "currency_symbol": "€",
+            "currency_conversion_rate": 1.0,
+            "billed_at": "2021-01-03",
+            "creditor_shares": {str(account1_id): 1},
+            "debitor_shares": {str(account1_id): 1, str(account2_id): 1},
+            "purchase_items": [
+                {
+                    "name": f"item{i}",
+                    "price": 2,
+                    "communist_shares": 1,
+                    "usages": {str(account2_id): 1},
+                }
+                for i in range(30)
+            ],
+        }
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/full", json=data
+        )
+        self.assertEqual(200, resp.status)
+        t = await resp.json()
+        self.assertIsNone(t["current_state"])
+        pending = t["pending_changes"][str(self.test_user_id)]
+        self.assertEqual(30, len(pending["purchase_items"]))
+        self.assertEqual({str(account2_id): 1}, pending["purchase_items"][0]["usages"])
+        self.assertEqual(t, await self._fetch_transaction(t["id"]))
+
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/full",
+            json=dict(data, commit=True),
+        )
+        self.assertEqual(200, resp.status)
+        t = await resp.json()
+        self.assertEqual({}, t["pending_changes"])
+        self.assertEqual(
+            {str(account1_id): 1.0, str(account2_id): 1.0},
+            t["current_state"]["debitor_shares"],
+        )
+        balances = await self._fetch_balances(group_id, verify=True)
+        # each item costs 2, half of which is billed to account2 directly
+        self.assertAlmostEqual(100 - (100 - 30) / 2, balances[account1_id]["balance"])
+        for balance in balances.values():
+            self.assertAlmostEqual(0, balance["drift"])
+
+        # incomplete transactions can only be created without committing them
+        incomplete = dict(data, debitor_shares={}, purchase_items=[])
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/full",
+            json=dict(incomplete, commit=True),
+        )
+        self.assertEqual(400, resp.status)
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/full", json=incomplete
+        )
+        self.assertEqual(200, resp.status)
+
+        # read-only members can neither create nor commit transactions
+        user2_id, _ = await self._create_test_user("user2", "user2@email.stuff")
+        group2_id = await self.group_service.create_group(
+            user_id=user2_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account3_id = await self.account_service.create_account(
+            user_id=user2_id,
+            group_id=group2_id,
+            type="personal",
+            name="account3",
+            description="description",
+        )
+        async with self.db_pool.acquire() as conn:
+            await conn.execute(
+                "insert into group_membership (user_id, group_id, invited_by, can_write) "
+                "values ($1, $2, $3, false)",
+                self.test_user_id,
+                group2_id,
+                user2_id,
+            )
+        read_only = dict(
+            data,
+            creditor_shares={str(account3_id): 1},
+            debitor_shares={str(account3_id): 1},
+            purchase_items=[],
+        )
+        for commit in (False, True):
+            resp = await self._post(
+                f"/api/v1/groups/{group2_id}/transactions/full",
+                json=dict(read_only, commit=commit),
+            )
+            self.assertEqual(403, resp.status)
+        n_transactions = await self.db_conn.fetchval(
+            "select count(*) from transaction where group_id = $1", group2_id
+        )
+        self.assertEqual(0, n_transactions)
+
+    async def _fetch_settlement(self, group_id: int, mode: str = "auto") -> dict:
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/settlement", params={"mode": mode}
+        )
+        self.assertEqual(200, resp.status)
+        return await resp.json()
+
+    @unittest_run_loop
+    async def test_settlement(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account_ids = [
+            await self._create_account(group_id, f"account{i}") for i in range(5)
+        ]
+        # a greedy settlement lets account0 pay account4 as both have the largest balances,
+        # which results in one more transfer than necessary
+        for creditor, debitor, value in ((3, 0, 6), (4, 1, 5), (4, 2, 5)):
+            resp = await self._post(
+                f"/api/v1/groups/{group_id}/transactions/full",
+                json={
+                    "type": "transfer",
+                    "description": "transfer",
+                    "value": value,
+                    "currency_symbol": "€",
+                    "currency_conversion_rate": 1.0,
+                    "billed_at": "2021-01-03",
+                    "creditor_shares": {str(account_ids[creditor]): 1},
+                    "debitor_shares": {str(account_ids[debitor]): 1},
+                    "purchase_items": [],
+                    "commit": True,
+                },
+            )
+            self.assertEqual(200, resp.status)
+
+        settlement = await self._fetch_settlement(group_id, mode="exact")
+        self.assertTrue(settlement["exact"])
+        self.assertEqual(3, len(settlement["transfers"]))
+        balances = await self._fetch_balances(group_id)
+        for transfer in settlement["transfers"]:
+            balances[transfer["from_account_id"]]["balance"] += transfer["amount"]
+            balances[transfer["to_account_id"]]["balance"] -= transfer["amount"]
+        for balance in balances.values():
+            self.assertAlmostEqual(0, balance["balance"])
+
+        # settlements are cached until the group changes
+        cache = self.http_service.settlement_cache
+        hits = cache.hits
+        self.assertEqual(settlement, await self._fetch_settlement(group_id, "exact"))
+        self.assertEqual(hits + 1, cache.hits)
+        greedy = await self._fetch_settlement(group_id, mode="greedy")
+        self.assertFalse(greedy["exact"])
+        self.assertEqual(4, len(greedy["transfers"]))
+        self.assertEqual(settlement["change_seq"], greedy["change_seq"])
+
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/settlement", params={"mode": "fastest"}
+        )
+        self.assertEqual(400, resp.status)
+
+        # creating the transfers does not populate the cache, its balances might not match the change_seq
+        cache.clear()
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/settlement", json={"mode": "exact"}
+        )
+        self.assertEqual(200, resp.status)
+        transaction_ids = (await resp.json())["transaction_ids"]
+        self.assertEqual(3, len(transaction_ids))
+        self.assertEqual(0, cache.stats()["settlements"])
+
+        # the transfers are created with pending changes only
+        after_create = await self._fetch_settlement(group_id, mode="exact")
+        self.assertLess(settlement["change_seq"], after_create["change_seq"])
+        self.assertEqual(settlement["transfers"], after_create["transfers"])
+        for transaction_id in transaction_ids:
+            t = await self._fetch_transaction(transaction_id)
+            self.assertEqual("transfer", t["type"])
+            self.assertIsNone(t["current_state"])
+            await self._commit_transaction(transaction_id)
+
+        settlement = await self._fetch_settlement(group_id)
+        self.assertEqual([], settlement["transfers"])
+        balances = await self._fetch_balances(group_id, verify=True)
+        for balance in balances.values():
+            self.assertAlmostEqual(0, balance["balance"])
+            self.assertAlmostEqual(0, balance["drift"])
+
+    @unittest_run_loop
+    async def test_transaction_account_balances(self):
+        group_id = await self.group_service.create_group(
+            user_id=self.test_user_id,
+            name="name",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        account1_id = await self._create_account(group_id, "account1")
+        account2_id = await self._create_account(group_id, "account2")
+        account3_id = await self._create_account(group_id, "account3")
+
+        data = {
+            "type": "purchase",
+            "description": "receipt",
+            "value": 100,
+            "currency_symbol": "$",
+            "currency_conversion_rate": 2.0,
+            "billed_at": "2021-01-03",
+            "creditor_shares": {str(account1_id): 1},
+            "debitor_shares": {str(account1_id): 1, str(account2_id): 3},
+            "purchase_items": [
+                {
+                    "name": "item",
+                    "price": 20,
+                    "communist_shares": 1,
+                    "usages": {str(account3_id): 3},
+                }
+            ],
+            "commit": True,
+        }
+        resp = await self._post(
+            f"/api/v1/groups/{group_id}/transactions/full", json=data
+        )
+        self.assertEqual(200, resp.status)
+        transaction_id = (await resp.json())["id"]
+
+        # the breakdown is only included on request
+        t = await self._fetch_transaction(transaction_id)
+        self.assertNotIn("account_balances", t["current_state"])
+
+        resp = await self._get(
+            f"/api/v1/transactions/{transaction_id}",
+            params={"account_balances": "true"},
+        )
+        self.assertEqual(200, resp.status)
+        t = await resp.json()
+        account_balances = t["current_state"]["account_balances"]
+        rows = await self.db_conn.fetch(
+            "select e.* from transaction_snapshot ts, transaction_balance_effects(ts.details) e "
+            "where ts.transaction_id = $1 and ts.pending_user_id is null",
+            transaction_id,
+        )
+        self.assertEqual(
+            {str(row["account_id"]) for row in rows}, set(account_balances)
+        )
+        for row in rows:
+            account_balance = account_balances[str(row["account_id"])]
+            for part in ("common_creditors", "positions", "common_debitors"):
+                self.assertAlmostEqual(row[part], account_balance[part])
+        # in the group currency, account3 uses 3 of the 4 shares of the item
+        self.assertAlmostEqual(30, account_balances[str(account3_id)]["positions"])
+        self.assertAlmostEqual(
+            200, account_balances[str(account1_id)]["common_creditors"]
+        )
+
+        # pending changes have no stored breakdown, committing them stores a new one
+        await self._update_transaction(
+            transaction_id,
+            value=50,
+            currency_symbol="$",
+            currency_conversion_rate=2.0,
+            description="receipt",
+            billed_at=date(2021, 1, 3),
+        )
+        transactions = (
+            await self._fetch_transaction_page(
+                group_id, limit=10, account_balances="true"
+            )
+        )["transactions"]
+        self.assertEqual(1, len(transactions))
+        pending = transactions[0]["pending_changes"][str(self.test_user_id)]
+        self.assertNotIn("account_balances", pending)
+        self.assertEqual(
+            account_balances, transactions[0]["current_state"]["account_balances"]
+        )
+
+        # the full list includes the breakdown as well
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions",
+            params={"account_balances": "true"},
+        )
+        self.assertEqual(200, resp.status)
+        transactions = await resp.json()
+        self.assertEqual([transaction_id], [t["id"] for t in transactions])
+        self.assertEqual(
+            account_balances, transactions[0]["current_state"]["account_balances"]
+        )
+        self.assertNotIn(
+            "account_balances",
+            transactions[0]["pending_changes"][str(self.test_user_id)],
+        )
+        resp = await self._get(f"/api/v1/groups/{group_id}/transactions")
+        self.assertNotIn("account_balances", (await resp.json())[0]["current_state"])
+
+        await self._commit_transaction(transaction_id)
+        resp = await self._get(
+            f"/api/v1/groups/{group_id}/transactions",
+            params={"since": 0, "account_balances": "true"},
+        )
+        self.assertEqual(200, resp.status)
+        t = (await resp.json())["transactions"][0]
+        account_balances = t["current_state"]["account_balances"]
+        # the remaining 70 of the new value are split among the debitors
+        self.assertAlmostEqual(
+            100, account_balances[str(account1_id)]["common_creditors"]
+        )
+        self.assertAlmostEqual(
+            17.5, account_balances[str(account1_id)]["common_debitors"]
+        )
+        self.assertAlmostEqual(
+            52.5, account_balances[str(account2_id)]["common_debitors"]
+        )
+        self.assertAlmostEqual(30, account_balances[str(account3_id)]["positions"])
+
+        resp = await self._get(
+            f"/api/v1/transactions/{transaction_id}",
+            params={"account_balances": "maybe"},
+        )
+        self.assertEqual(400, resp.status)
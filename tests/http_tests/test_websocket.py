@@ -1,12 +1,17 @@
 import asyncio
 import json
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone
 
 import aiohttp
 from aiohttp import web
-from aiohttp.test_utils import unittest_run_loop
+from aiohttp.test_utils import unittest_run_loop, TestClient, TestServer
+from jose import jwt
 
+from abrechnung.config import Config
+from abrechnung.domain.transactions import NewTransaction, NewPurchaseItem
+from abrechnung.http import HTTPService
 from abrechnung.http.auth import token_for_user
+from abrechnung.http.websocket import GROUP_SUBSCRIPTION_TYPES
 from tests.http_tests import BaseHTTPAPITest
 
 
@@ -15,6 +20,19 @@ class WebsocketAPITest(BaseHTTPAPITest):
         resp = await ws.receive(timeout=1)
         self.assertEqual(resp.type, aiohttp.WSMsgType.TEXT)
         resp_json = json.loads(resp.data)
+        # group scoped notifications carry the sequence number of their change feed entry,
+        # which is only compared if it is part of the expected message
+        if resp_json["type"] in ("notification", "notification_batch"):
+            received = resp_json["data"]
+            expected = expected_msg["data"]
+            if resp_json["type"] == "notification":
+                received, expected = [received], [expected]
+            for notification, expected_notification in zip(received, expected):
+                if (
+                    notification["subscription_type"] in GROUP_SUBSCRIPTION_TYPES
+                    and "seq" not in expected_notification
+                ):
+                    self.assertIsInstance(notification.pop("seq"), int)
         self.assertDictEqual(expected_msg, resp_json)
 
     @unittest_run_loop
@@ -249,3 +267,974 @@ class WebsocketAPITest(BaseHTTPAPITest):
                 },
             },
         )
+
+    async def expect_no_ws_message(self, ws: web.WebSocketResponse):
+        with self.assertRaises(asyncio.TimeoutError):
+            await ws.receive(timeout=0.5)
+
+    @unittest_run_loop
+    async def test_transaction_notifications_coalesced(self):
+        user_id, password = await self._create_test_user(
+            username="user", email="email@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user", password=password, session_name="session1"
+        )
+        token = token_for_user(
+            user_id, session_id=session_id, secret_key=self.secret_key
+        )
+        group_id = await self.group_service.create_group(
+            user_id=user_id,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+        account_id = await self.account_service.create_account(
+            user_id=user_id,
+            group_id=group_id,
+            type="personal",
+            name="account1",
+            description="asdf",
+        )
+
+        ws = await self.client.ws_connect("/api/v1/ws")
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "token": token,
+                "data": {"subscription_type": "transaction", "element_id": group_id},
+            }
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "subscribe_success",
+                "data": {"element_id": group_id, "subscription_type": "transaction"},
+            },
+        )
+
+        transaction = await self.transaction_service.create_transaction_full(
+            user_id=user_id,
+            group_id=group_id,
+            transaction=NewTransaction(
+                type="purchase",
+                description="receipt",
+                value=100,
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                billed_at=date.today(),
+                creditor_shares={account_id: 1.0},
+                debitor_shares={account_id: 1.0},
+                purchase_items=[
+                    NewPurchaseItem(
+                        name=f"item{i}",
+                        price=1.0,
+                        communist_shares=1.0,
+                        usages={account_id: 1.0},
+                    )
+                    for i in range(20)
+                ],
+            ),
+            commit=True,
+        )
+        expected = {
+            "type": "notification",
+            "data": {
+                "element_id": group_id,
+                "transaction_id": transaction.id,
+                "subscription_type": "transaction",
+            },
+        }
+        await self.expect_ws_message(ws, expected)
+        await self.expect_no_ws_message(ws)
+
+        # copying all shares and purchase items into a new pending change results in a single notification
+        await self.transaction_service.create_transaction_change(
+            user_id=user_id, transaction_id=transaction.id
+        )
+        await self.expect_ws_message(ws, expected)
+        await self.expect_no_ws_message(ws)
+
+    @unittest_run_loop
+    async def test_transaction_notification_payload(self):
+        user_id, password = await self._create_test_user(
+            username="user", email="email@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user", password=password, session_name="session1"
+        )
+        token = token_for_user(
+            user_id, session_id=session_id, secret_key=self.secret_key
+        )
+        group_id = await self.group_service.create_group(
+            user_id=user_id,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+
+        ws = await self.client.ws_connect("/api/v1/ws")
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "token": token,
+                "data": {
+                    "subscription_type": "account",
+                    "element_id": group_id,
+                    "with_payload": True,
+                },
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("error", resp["type"])
+
+        subscription = {
+            "subscription_type": "transaction",
+            "element_id": group_id,
+            "with_payload": True,
+        }
+        await ws.send_json({"type": "subscribe", "token": token, "data": subscription})
+        await self.expect_ws_message(
+            ws, {"type": "subscribe_success", "data": subscription}
+        )
+
+        transaction_id = await self.transaction_service.create_transaction(
+            user_id=user_id,
+            group_id=group_id,
+            type="transfer",
+            value=1.2,
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            billed_at=date.today(),
+            description="asdf",
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("notification", resp["type"])
+        self.assertEqual(transaction_id, resp["data"]["transaction_id"])
+        self.assertEqual(
+            json.loads(
+                await self.transaction_service.get_transaction_json(
+                    user_id=user_id, transaction_id=transaction_id
+                )
+            ),
+            resp["data"]["transaction"],
+        )
+
+        # subscribing again without payload switches back to plain notifications
+        subscription["with_payload"] = False
+        await ws.send_json({"type": "subscribe", "token": token, "data": subscription})
+        await self.expect_ws_message(
+            ws, {"type": "subscribe_success", "data": subscription}
+        )
+        await self.transaction_service.delete_transaction(
+            user_id=user_id, transaction_id=transaction_id
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "notification",
+                "data": {
+                    "element_id": group_id,
+                    "transaction_id": transaction_id,
+                    "subscription_type": "transaction",
+                },
+            },
+        )
+
+    @unittest_run_loop
+    async def test_subscription_registry(self):
+        user1_id, _ = await self._create_test_user(
+            username="user1", email="email1@email.com"
+        )
+        user2_id, password = await self._create_test_user(
+            username="user2", email="email2@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user2", password=password, session_name="session1"
+        )
+        token = token_for_user(
+            user2_id, session_id=session_id, secret_key=self.secret_key
+        )
+        group_id = await self.group_service.create_group(
+            user_id=user1_id,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+
+        ws = await self.client.ws_connect("/api/v1/ws")
+        # subscribing to a group without being a member is rejected
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "token": token,
+                "data": {"subscription_type": "transaction", "element_id": group_id},
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("error", resp["type"])
+
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "token": token,
+                "data": {"subscription_type": "group", "element_id": user2_id},
+            }
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "subscribe_success",
+                "data": {"subscription_type": "group", "element_id": user2_id},
+            },
+        )
+        await self.db_conn.execute(
+            "insert into group_membership (user_id, group_id, invited_by) values ($1, $2, $3)",
+            user2_id,
+            group_id,
+            user1_id,
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "notification",
+                "data": {
+                    "subscription_type": "group",
+                    "element_id": user2_id,
+                    "group_id": group_id,
+                },
+            },
+        )
+
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "token": token,
+                "data": {"subscription_type": "transaction", "element_id": group_id},
+            }
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "subscribe_success",
+                "data": {"subscription_type": "transaction", "element_id": group_id},
+            },
+        )
+        self.assertEqual(2, len(self.http_service.subscriptions))
+        # subscriptions are only kept in memory
+        self.assertEqual(
+            0, await self.db_conn.fetchval("select count(*) from subscription")
+        )
+
+        # leaving the group ends the subscriptions to it
+        await self.db_conn.execute(
+            "delete from group_membership where user_id = $1 and group_id = $2",
+            user2_id,
+            group_id,
+        )
+        for _ in range(50):
+            if len(self.http_service.subscriptions) == 1:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(1, len(self.http_service.subscriptions))
+
+        await self.transaction_service.create_transaction(
+            user_id=user1_id,
+            group_id=group_id,
+            type="transfer",
+            value=1.2,
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+            billed_at=date.today(),
+            description="asdf",
+        )
+        await self.expect_no_ws_message(ws)
+
+        await ws.close()
+        for _ in range(50):
+            if len(self.http_service.subscriptions) == 0:
+                break
+            await asyncio.sleep(0.05)
+        self.assertEqual(0, len(self.http_service.subscriptions))
+
+    @unittest_run_loop
+    async def test_notification_batch(self):
+        user_id, password = await self._create_test_user(
+            username="user", email="email@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user", password=password, session_name="session1"
+        )
+        token = token_for_user(
+            user_id, session_id=session_id, secret_key=self.secret_key
+        )
+        group_id = await self.group_service.create_group(
+            user_id=user_id,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+
+        ws = await self.client.ws_connect("/api/v1/ws")
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "token": token,
+                "data": {"subscription_type": "transaction", "element_id": group_id},
+            }
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "subscribe_success",
+                "data": {"element_id": group_id, "subscription_type": "transaction"},
+            },
+        )
+
+        # make sure all changes below end up in the same debounce window
+        self.http_service.notification_debounce = 0.5
+        transaction_ids = []
+        for i in range(2):
+            transaction_id = await self.transaction_service.create_transaction(
+                user_id=user_id,
+                group_id=group_id,
+                type="transfer",
+                description=f"transfer {i}",
+                billed_at=date.today(),
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                value=10,
+            )
+            transaction_ids.append(transaction_id)
+
+        # a further change to the first transaction does not lead to another notification
+        await self.transaction_service.update_transaction(
+            user_id=user_id,
+            transaction_id=transaction_ids[0],
+            value=20,
+            description="transfer 0",
+            billed_at=date.today(),
+            currency_symbol="€",
+            currency_conversion_rate=1.0,
+        )
+
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "notification_batch",
+                "data": [
+                    {
+                        "element_id": group_id,
+                        "transaction_id": transaction_id,
+                        "subscription_type": "transaction",
+                    }
+                    for transaction_id in transaction_ids
+                ],
+            },
+        )
+        await self.expect_no_ws_message(ws)
+
+    @unittest_run_loop
+    async def test_websocket_compression(self):
+        ws = await self.client.ws_connect("/api/v1/ws", compress=15)
+        self.assertEqual(15, ws.compress)
+        await ws.close()
+
+        # the negotiated extension is announced in the handshake response
+        resp = await self.client.get(
+            "/api/v1/ws",
+            headers={
+                "Upgrade": "websocket",
+                "Connection": "Upgrade",
+                "Sec-WebSocket-Version": "13",
+                "Sec-WebSocket-Key": "dGhlIHNhbXBsZSBub25jZQ==",
+                "Sec-WebSocket-Extensions": "permessage-deflate",
+            },
+        )
+        self.assertEqual(101, resp.status)
+        self.assertIn(
+            "permessage-deflate", resp.headers.get("Sec-WebSocket-Extensions", "")
+        )
+        resp.close()
+
+        self.http_service.websocket_compress = False
+        ws = await self.client.ws_connect("/api/v1/ws", compress=15)
+        self.assertEqual(0, ws.compress)
+        await ws.close()
+
+    @unittest_run_loop
+    async def test_authenticate_and_subscribe_many(self):
+        user_id, password = await self._create_test_user(
+            username="user", email="email@email.com"
+        )
+        other_user_id, _ = await self._create_test_user(
+            username="user2", email="email2@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user", password=password, session_name="session1"
+        )
+        group_ids = [
+            await self.group_service.create_group(
+                user_id=user_id,
+                name=f"group{i}",
+                description="asdf",
+                currency_symbol="€",
+                terms="terms...",
+            )
+            for i in range(2)
+        ]
+        other_group_id = await self.group_service.create_group(
+            user_id=other_user_id,
+            name="other group",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+
+        ws = await self.client.ws_connect("/api/v1/ws")
+        subscribe_msg = {
+            "type": "subscribe",
+            "data": {"subscription_type": "group", "element_id": user_id},
+        }
+        await ws.send_json(subscribe_msg)
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("error", resp["type"])
+        self.assertEqual(web.HTTPUnauthorized.status_code, resp["data"]["code"])
+
+        # the access token is only valid for a short time
+        token = jwt.encode(
+            {
+                "exp": datetime.now(tz=timezone.utc) + timedelta(seconds=2),
+                "user_id": user_id,
+                "session_id": session_id,
+            },
+            self.secret_key,
+        )
+        await ws.send_json({"type": "authenticate", "data": {"token": token}})
+        await self.expect_ws_message(
+            ws, {"type": "authenticate_success", "data": {"user_id": user_id}}
+        )
+
+        # subscriptions to groups the user is not a member of fail as a whole
+        await ws.send_json(
+            {
+                "type": "subscribe_many",
+                "data": {
+                    "subscriptions": [
+                        {"subscription_type": "group", "element_id": user_id},
+                        {"subscription_type": "account", "element_id": other_group_id},
+                    ]
+                },
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("error", resp["type"])
+        self.assertEqual(0, len(self.http_service.subscriptions))
+
+        await ws.send_json(
+            {
+                "type": "subscribe_many",
+                "data": {
+                    "subscriptions": [
+                        {"subscription_type": "group", "element_id": user_id}
+                    ],
+                    "group_subscription_types": ["account", "transaction"],
+                    "with_payload": True,
+                },
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("subscribe_many_success", resp["type"])
+        self.assertCountEqual(
+            [
+                {
+                    "subscription_type": "group",
+                    "element_id": user_id,
+                    "with_payload": False,
+                },
+                *[
+                    {
+                        "subscription_type": subscription_type,
+                        "element_id": group_id,
+                        "with_payload": subscription_type == "transaction",
+                    }
+                    for group_id in group_ids
+                    for subscription_type in ["account", "transaction"]
+                ],
+            ],
+            resp["data"]["subscriptions"],
+        )
+        self.assertEqual(5, len(self.http_service.subscriptions))
+
+        # once the token expired the client is asked to authenticate again
+        resp = json.loads((await ws.receive(timeout=3)).data)
+        self.assertEqual({"type": "authentication_expired", "data": {}}, resp)
+        await ws.send_json(subscribe_msg)
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("error", resp["type"])
+        self.assertEqual(web.HTTPUnauthorized.status_code, resp["data"]["code"])
+
+        token = token_for_user(
+            user_id, session_id=session_id, secret_key=self.secret_key
+        )
+        await ws.send_json({"type": "authenticate", "data": {"token": token}})
+        await self.expect_ws_message(
+            ws, {"type": "authenticate_success", "data": {"user_id": user_id}}
+        )
+        # the subscriptions are kept when authenticating again as the same user
+        self.assertEqual(5, len(self.http_service.subscriptions))
+
+    async def wait_for_dispatch(self, group_id: int):
+        """wait until the forwarder has dispatched all change feed entries of a group"""
+        seq = await self.db_conn.fetchval(
+            "select max(seq) from change_feed where group_id = $1", group_id
+        )
+        for _ in range(50):
+            if self.http_service.change_feed_seqs.get(group_id, 0) >= seq:
+                return
+            await asyncio.sleep(0.05)
+        self.fail("change was not dispatched")
+
+    async def receive_notifications(self, ws: web.WebSocketResponse) -> list[dict]:
+        """all notifications received until the connection is quiet for a while"""
+        notifications = []
+        while True:
+            try:
+                resp = json.loads((await ws.receive(timeout=0.5)).data)
+            except asyncio.TimeoutError:
+                return notifications
+            if resp["type"] == "notification":
+                notifications.append(resp["data"])
+            else:
+                self.assertEqual("notification_batch", resp["type"])
+                notifications.extend(resp["data"])
+
+    @unittest_run_loop
+    async def test_resume_from_change_feed(self):
+        user_id, password = await self._create_test_user(
+            username="user", email="email@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user", password=password, session_name="session1"
+        )
+        token = token_for_user(
+            user_id, session_id=session_id, secret_key=self.secret_key
+        )
+        group_id = await self.group_service.create_group(
+            user_id=user_id,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+
+        async def create_transaction(description: str) -> int:
+            return await self.transaction_service.create_transaction(
+                user_id=user_id,
+                group_id=group_id,
+                type="transfer",
+                description=description,
+                billed_at=date.today(),
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                value=10,
+            )
+
+        subscribe_msg = {
+            "type": "subscribe",
+            "token": token,
+            "data": {"subscription_type": "transaction", "element_id": group_id},
+        }
+        ws = await self.client.ws_connect("/api/v1/ws")
+        await ws.send_json(subscribe_msg)
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("subscribe_success", resp["type"])
+
+        transaction1_id = await create_transaction("transfer 1")
+        notifications = await self.receive_notifications(ws)
+        self.assertEqual(1, len(notifications))
+        self.assertEqual(transaction1_id, notifications[0]["transaction_id"])
+        last_seq = notifications[0]["seq"]
+        await ws.close()
+
+        # changes made while the client is disconnected are delivered when it resumes its subscription
+        transaction2_id = await create_transaction("transfer 2")
+        await self.account_service.create_account(
+            user_id=user_id,
+            group_id=group_id,
+            type="personal",
+            name="account1",
+            description="asdf",
+        )
+
+        ws = await self.client.ws_connect("/api/v1/ws")
+        await ws.send_json(
+            {**subscribe_msg, "data": {**subscribe_msg["data"], "last_seq": last_seq}}
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "subscribe_success",
+                "data": {
+                    "subscription_type": "transaction",
+                    "element_id": group_id,
+                    "last_seq": last_seq,
+                    "resync": False,
+                },
+            },
+        )
+        notifications = await self.receive_notifications(ws)
+        self.assertEqual(
+            [transaction2_id],
+            [notification["transaction_id"] for notification in notifications],
+        )
+        self.assertTrue(all(n["seq"] > last_seq for n in notifications))
+        resume_seq = notifications[-1]["seq"]
+
+        # live changes dispatched while replaying are sent after the missed ones and only once
+        replay_change_feed = self.http_service._replay_change_feed
+        created_ids = []
+
+        async def replay_concurrently(*args, **kwargs):
+            created_ids.append(await create_transaction("before replay"))
+            await self.wait_for_dispatch(group_id)
+            replay = await replay_change_feed(*args, **kwargs)
+            created_ids.append(await create_transaction("after replay"))
+            await self.wait_for_dispatch(group_id)
+            return replay
+
+        for subscribe_many in (False, True):
+            await ws.close()
+            missed_id = await create_transaction("while disconnected")
+            created_ids.clear()
+            subscription = {**subscribe_msg["data"], "last_seq": resume_seq}
+            if subscribe_many:
+                resume_msg = {
+                    "type": "subscribe_many",
+                    "token": token,
+                    "data": {"subscriptions": [subscription]},
+                }
+            else:
+                resume_msg = {**subscribe_msg, "data": subscription}
+
+            ws = await self.client.ws_connect("/api/v1/ws")
+            self.http_service._replay_change_feed = replay_concurrently
+            try:
+                await ws.send_json(resume_msg)
+                resp = json.loads((await ws.receive(timeout=2)).data)
+            finally:
+                self.http_service._replay_change_feed = replay_change_feed
+            self.assertIn(resp["type"], ("subscribe_success", "subscribe_many_success"))
+            notifications = await self.receive_notifications(ws)
+            self.assertEqual(
+                [missed_id, *created_ids],
+                [notification["transaction_id"] for notification in notifications],
+            )
+            seqs = [notification["seq"] for notification in notifications]
+            self.assertEqual(sorted(seqs), seqs)
+            resume_seq = seqs[-1]
+
+        # once the missed changes have been pruned the client needs to fetch everything again
+        await self.db_conn.execute("call prune_change_feed('0 seconds')")
+        self.assertEqual(
+            0, await self.db_conn.fetchval("select count(*) from change_feed")
+        )
+        await ws.send_json(
+            {**subscribe_msg, "data": {**subscribe_msg["data"], "last_seq": last_seq}}
+        )
+        await self.expect_ws_message(
+            ws,
+            {
+                "type": "subscribe_success",
+                "data": {
+                    "subscription_type": "transaction",
+                    "element_id": group_id,
+                    "last_seq": last_seq,
+                    "resync": True,
+                },
+            },
+        )
+        await self.expect_no_ws_message(ws)
+
+    @unittest_run_loop
+    async def test_subscribe_with_snapshot(self):
+        user_id, password = await self._create_test_user(
+            username="user", email="email@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user", password=password, session_name="session1"
+        )
+        token = token_for_user(
+            user_id, session_id=session_id, secret_key=self.secret_key
+        )
+        group_id = await self.group_service.create_group(
+            user_id=user_id,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+        account_id = await self.account_service.create_account(
+            user_id=user_id,
+            group_id=group_id,
+            type="personal",
+            name="account1",
+            description="asdf",
+        )
+
+        async def create_transaction(description: str) -> int:
+            return await self.transaction_service.create_transaction(
+                user_id=user_id,
+                group_id=group_id,
+                type="transfer",
+                description=description,
+                billed_at=date.today(),
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                value=10,
+            )
+
+        transaction1_id = await create_transaction("transfer 1")
+
+        ws = await self.client.ws_connect("/api/v1/ws")
+        await ws.send_json({"type": "authenticate", "data": {"token": token}})
+        await self.expect_ws_message(
+            ws, {"type": "authenticate_success", "data": {"user_id": user_id}}
+        )
+
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "data": {
+                    "subscription_type": "transaction",
+                    "element_id": group_id,
+                    "with_snapshot": True,
+                },
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("subscribe_success", resp["type"])
+        self.assertEqual(
+            await self.db_conn.fetchval(
+                "select seq from group_change_sequence where group_id = $1", group_id
+            ),
+            resp["data"]["seq"],
+        )
+        self.assertEqual([transaction1_id], [t["id"] for t in resp["data"]["snapshot"]])
+        self.assertEqual(
+            json.loads(
+                await self.transaction_service.get_transaction_json(
+                    user_id=user_id, transaction_id=transaction1_id
+                )
+            ),
+            resp["data"]["snapshot"][0],
+        )
+        snapshot_seq = resp["data"]["seq"]
+
+        # changes after the snapshot are delivered with a higher sequence number
+        transaction2_id = await create_transaction("transfer 2")
+        notifications = await self.receive_notifications(ws)
+        self.assertEqual(
+            [transaction2_id], [n["transaction_id"] for n in notifications]
+        )
+        self.assertTrue(all(n["seq"] > snapshot_seq for n in notifications))
+
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "data": {
+                    "subscription_type": "account",
+                    "element_id": group_id,
+                    "with_snapshot": True,
+                },
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("subscribe_success", resp["type"])
+        self.assertEqual([account_id], [a["id"] for a in resp["data"]["snapshot"]])
+
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "data": {
+                    "subscription_type": "group_member",
+                    "element_id": group_id,
+                    "with_snapshot": True,
+                },
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("subscribe_success", resp["type"])
+        self.assertEqual([user_id], [m["user_id"] for m in resp["data"]["snapshot"]])
+
+        await ws.send_json(
+            {
+                "type": "subscribe",
+                "data": {
+                    "subscription_type": "group",
+                    "element_id": user_id,
+                    "with_snapshot": True,
+                },
+            }
+        )
+        resp = json.loads((await ws.receive(timeout=1)).data)
+        self.assertEqual("error", resp["type"])
+
+        # changes dispatched while the snapshot is being read are sent after it unless they are part of it
+        read_subscription_snapshot = self.http_service._read_subscription_snapshot
+        created_ids = []
+
+        async def read_snapshot_concurrently(*args):
+            created_ids.append(await create_transaction("before snapshot"))
+            await self.wait_for_dispatch(group_id)
+            snapshot = await read_subscription_snapshot(*args)
+            created_ids.append(await create_transaction("after snapshot"))
+            await self.wait_for_dispatch(group_id)
+            return snapshot
+
+        self.http_service._read_subscription_snapshot = read_snapshot_concurrently
+        try:
+            await ws.send_json(
+                {
+                    "type": "subscribe",
+                    "data": {
+                        "subscription_type": "transaction",
+                        "element_id": group_id,
+                        "with_snapshot": True,
+                    },
+                }
+            )
+            resp = json.loads((await ws.receive(timeout=2)).data)
+        finally:
+            self.http_service._read_subscription_snapshot = read_subscription_snapshot
+        self.assertEqual("subscribe_success", resp["type"])
+        self.assertEqual(
+            [transaction1_id, transaction2_id, created_ids[0]],
+            [t["id"] for t in resp["data"]["snapshot"]],
+        )
+        notifications = await self.receive_notifications(ws)
+        self.assertEqual([created_ids[1]], [n["transaction_id"] for n in notifications])
+        self.assertTrue(all(n["seq"] > resp["data"]["seq"] for n in notifications))
+
+    @unittest_run_loop
+    async def test_multiple_forwarders(self):
+        user_id, password = await self._create_test_user(
+            username="user", email="email@email.com"
+        )
+        _, session_id, _ = await self.user_service.login_user(
+            "user", password=password, session_name="session1"
+        )
+        token = token_for_user(
+            user_id, session_id=session_id, secret_key=self.secret_key
+        )
+        group_id = await self.group_service.create_group(
+            user_id=user_id,
+            name="group1",
+            description="asdf",
+            currency_symbol="€",
+            terms="terms...",
+        )
+
+        # a second api instance with a generated forwarder id running against the same database
+        http_service2 = HTTPService(
+            config=Config(
+                {"api": {"secret_key": self.secret_key, "heartbeat_interval": 0.1}}
+            )
+        )
+        self.assertNotEqual("test_forwarder", http_service2.forwarder_id)
+        conn2 = await self.db_pool.acquire()
+        await http_service2._register_forwarder(
+            conn2, forwarder_id=http_service2.forwarder_id
+        )
+        client2 = TestClient(TestServer(http_service2.create_app(db_pool=self.db_pool)))
+        await client2.start_server()
+
+        try:
+            self.assertCountEqual(
+                ["test_forwarder", http_service2.forwarder_id],
+                [
+                    row["id"]
+                    for row in await self.db_conn.fetch("select id from forwarder")
+                ],
+            )
+
+            websockets = [
+                await self.client.ws_connect("/api/v1/ws"),
+                await client2.ws_connect("/api/v1/ws"),
+            ]
+            for ws in websockets:
+                await ws.send_json(
+                    {
+                        "type": "subscribe",
+                        "token": token,
+                        "data": {
+                            "subscription_type": "transaction",
+                            "element_id": group_id,
+                        },
+                    }
+                )
+                resp = json.loads((await ws.receive(timeout=1)).data)
+                self.assertEqual("subscribe_success", resp["type"])
+
+            # every forwarder delivers the notification to its own connections
+            transaction_id = await self.transaction_service.create_transaction(
+                user_id=user_id,
+                group_id=group_id,
+                type="transfer",
+                description="transfer",
+                billed_at=date.today(),
+                currency_symbol="€",
+                currency_conversion_rate=1.0,
+                value=10,
+            )
+            for ws in websockets:
+                await self.expect_ws_message(
+                    ws,
+                    {
+                        "type": "notification",
+                        "data": {
+                            "element_id": group_id,
+                            "transaction_id": transaction_id,
+                            "subscription_type": "transaction",
+                        },
+                    },
+                )
+
+            # a crashed forwarder stops sending heartbeats and is removed together with its leftovers
+            channel_id = await self.db_conn.fetchval(
+                "insert into forwarder (id, last_seen, heartbeat_interval) "
+                "values ('crashed', now() - interval '1 hour', '1 second') returning channel_id"
+            )
+            await self.db_conn.execute(
+                "insert into connection (channel_id) values ($1)", channel_id
+            )
+            for _ in range(50):
+                if not await self.db_conn.fetchval(
+                    "select exists(select from forwarder where id = 'crashed')"
+                ):
+                    break
+                await asyncio.sleep(0.05)
+            self.assertEqual(
+                0,
+                await self.db_conn.fetchval(
+                    "select count(*) from connection where channel_id = $1", channel_id
+                ),
+            )
+            # running forwarders are kept alive by their heartbeats
+            self.assertCountEqual(
+                ["test_forwarder", http_service2.forwarder_id],
+                [
+                    row["id"]
+                    for row in await self.db_conn.fetch("select id from forwarder")
+                ],
+            )
+        finally:
+            await client2.close()
+            await http_service2._unregister_forwarder(
+                conn2, forwarder_id=http_service2.forwarder_id
+            )
+            await self.db_pool.release(conn2)
@@ -0,0 +1,140 @@
+from datetime import date
+
+import numpy as np
+from aiohttp.test_utils import unittest_run_loop
+
+from abrechnung.application.accounts import AccountService
+from abrechnung.application.balance_engine import BalanceEffects, load_group_shares
+from abrechnung.application.groups import GroupService
+from abrechnung.application.transactions import TransactionService
+from abrechnung.domain.transactions import NewTransaction, NewPurchaseItem
+from tests import AsyncTestCase
+
+
+class BalanceEngineTest(AsyncTestCase):
+    async def setUpAsync(self) -> None:
+        self.group_service = GroupService(self.db_pool)
+        self.account_service = AccountService(self.db_pool)
+        self.transaction_service = TransactionService(self.db_pool)
+        self.user_id, _ = await self._create_test_user("user", "email@email.stuff")
+        self.group_id = await self.group_service.create_group(
+            user_id=self.user_id,
+            name="group",
+            description="description",
+            currency_symbol="€",
+            terms="terms",
+        )
+        self.account_ids = [
+            await self.account_service.create_account(
+                user_id=self.user_id,
+                group_id=self.group_id,
+                type="personal",
+                name=f"account{i}",
+                description="description",
+            )
+            for i in range(4)
+        ]
+
+    async def _create_transaction(
+        self,
+        creditor_shares: dict[int, float],
+        debitor_shares: dict[int, float],
+        purchase_items: list[NewPurchaseItem] = None,
+        currency_conversion_rate: float = 1.0,
+        commit: bool = True,
+    ) -> int:
+        transaction = await self.transaction_service.create_transaction_full(
+            user_id=self.user_id,
+            group_id=self.group_id,
+            transaction=NewTransaction(
+                type="purchase" if purchase_items else "mimo",
+                description="description",
+                value=100,
+                currency_symbol="€",
+                currency_conversion_rate=currency_conversion_rate,
+                billed_at=date(2021, 1, 1),
+                creditor_shares=creditor_shares,
+                debitor_shares=debitor_shares,
+                purchase_items=purchase_items or [],
+            ),
+            commit=commit,
+        )
+        return transaction.id
+
+    async def _balance_effects(self) -> BalanceEffects:
+        async with self.db_conn.transaction(isolation="repeatable_read"):
+            return BalanceEffects(await load_group_shares(self.db_conn, self.group_id))
+
+    @unittest_run_loop
+    async def test_balance_effects(self):
+        a0, a1, a2, a3 = self.account_ids
+        transaction_ids = [
+            await self._create_transaction({a0: 1}, {a0: 1, a1: 2}),
+            await self._create_transaction(
+                {a1: 1, a2: 3}, {a3: 1}, currency_conversion_rate=1.5
+            ),
+            await self._create_transaction(
+                {a2: 1},
+                {a0: 1, a2: 1},
+                purchase_items=[
+                    NewPurchaseItem(
+                        name="item1", price=20, communist_shares=1, usages={a1: 3}
+                    ),
+                    NewPurchaseItem(
+                        name="item2", price=10, communist_shares=0, usages={a3: 1}
+                    ),
+                ],
+            ),
+        ]
+        deleted_id = await self._create_transaction({a3: 1}, {a0: 1})
+        await self.transaction_service.delete_transaction(
+            user_id=self.user_id, transaction_id=deleted_id
+        )
+        # transactions which have never been committed have no effect
+        await self._create_transaction({a3: 1}, {a1: 1}, commit=False)
+
+        effects = await self._balance_effects()
+        self.assertEqual(transaction_ids, effects.transaction_ids.tolist())
+
+        expected_balances = {
+            row["account_id"]: row["balance"]
+            for row in await self.db_conn.fetch(
+                "select * from compute_account_balances($1)", self.group_id
+            )
+        }
+        balances = effects.account_balances()
+        self.assertEqual(set(self.account_ids), set(balances))
+        for account_id, balance in balances.items():
+            self.assertAlmostEqual(expected_balances.get(account_id, 0), balance)
+
+        for transaction_id in transaction_ids:
+            rows = await self.db_conn.fetch(
+                "select e.* from transaction_snapshot ts, transaction_balance_effects(ts.details) e "
+                "where ts.transaction_id = $1 and ts.pending_user_id is null",
+                transaction_id,
+            )
+            breakdown = effects.transaction_breakdown(transaction_id)
+            self.assertEqual({row["account_id"] for row in rows}, set(breakdown))
+            for row in rows:
+                account_balance = breakdown[row["account_id"]]
+                self.assertAlmostEqual(
+                    row["common_creditors"], account_balance.common_creditors
+                )
+                self.assertAlmostEqual(row["positions"], account_balance.positions)
+                self.assertAlmostEqual(
+                    row["common_debitors"], account_balance.common_debitors
+                )
+        self.assertEqual({}, effects.transaction_breakdown(deleted_id))
+
+        # a1 uses 3 of the 4 shares of item1 and owes 15 of it to a2
+        breakdown = effects.transaction_breakdown(transaction_ids[2])
+        self.assertAlmostEqual(15, breakdown[a1].positions)
+
+        debts = effects.pairwise_debts().toarray()
+        self.assertTrue(np.all(debts >= 0))
+        self.assertTrue(np.all(np.diag(debts) == 0))
+        # what an account is owed minus what it owes is its balance
+        for i, account_id in enumerate(effects.account_ids):
+            self.assertAlmostEqual(
+                balances[account_id], debts[:, i].sum() - debts[i, :].sum()
+            )
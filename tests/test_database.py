@@ -0,0 +1,61 @@
+from aiohttp.test_utils import unittest_run_loop
+
+# pylint: disable=unused-import
+import abrechnung.http  # registers the prepared statements of all services
+from abrechnung.application import PREPARED_STATEMENTS
+from abrechnung.config import Config
+from abrechnung.database import db_connect_from_config
+from tests import AsyncTestCase, get_test_db_config
+
+
+class DatabaseConnectionTest(AsyncTestCase):
+    def _config(self, **kwargs) -> Config:
+        return Config({"database": {**get_test_db_config(), **kwargs}})
+
+    @unittest_run_loop
+    async def test_connection_init(self):
+        self.assertNotEqual(0, len(PREPARED_STATEMENTS))
+        pool = await db_connect_from_config(
+            self._config(min_size=1, max_size=2),
+            prepared_statements=PREPARED_STATEMENTS,
+        )
+        try:
+            async with pool.acquire() as conn:
+                # json values are decoded automatically
+                self.assertEqual(
+                    {"a": [1]}, await conn.fetchval("""select '{"a": [1]}'::jsonb""")
+                )
+                self.assertEqual(
+                    {"a": 1}, await conn.fetchval("""select '{"a": 1}'::json""")
+                )
+                self.assertEqual(
+                    2, await conn.fetchval("select ($1::jsonb ->> 'a')::int", {"a": 2})
+                )
+
+                # pylint: disable=protected-access
+                self.assertGreaterEqual(
+                    conn._stmt_cache.get_max_size(), len(set(PREPARED_STATEMENTS))
+                )
+                # the registered statements are already prepared when the connection is handed out
+                cached = {key[0] for key in conn._stmt_cache._entries}
+                self.assertLessEqual(set(PREPARED_STATEMENTS), cached)
+                n_cached = len(conn._stmt_cache)
+                await conn.fetchrow(PREPARED_STATEMENTS[0], 1, 1)
+                self.assertEqual(n_cached, len(conn._stmt_cache))
+        finally:
+            await pool.close()
+
+    @unittest_run_loop
+    async def test_pgbouncer_mode(self):
+        pool = await db_connect_from_config(
+            self._config(min_size=1, max_size=2, pgbouncer=True),
+            prepared_statements=PREPARED_STATEMENTS,
+        )
+        try:
+            async with pool.acquire() as conn:
+                # pylint: disable=protected-access
+                self.assertEqual(0, len(conn._stmt_cache))
+                self.assertIsNone(await conn.fetchrow(PREPARED_STATEMENTS[0], 1, 1))
+                self.assertEqual(0, len(conn._stmt_cache))
+        finally:
+            await pool.close()
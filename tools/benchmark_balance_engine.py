@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+import argparse
+import time
+
+import numpy as np
+from scipy import sparse
+
+from abrechnung.application.balance_engine import BalanceEffects, GroupShares
+
+
+def random_shares(
+    rng: np.random.Generator,
+    n_rows: int,
+    n_accounts: int,
+    max_accounts: int,
+) -> sparse.csr_matrix:
+    """rows x accounts matrix with between one and max_accounts shares per row"""
+    n_per_row = rng.integers(1, max_accounts + 1, size=n_rows)
+    rows = np.repeat(np.arange(n_rows), n_per_row)
+    columns = rng.integers(0, n_accounts, size=len(rows))
+    shares = rng.integers(1, 4, size=len(rows)).astype(np.float64)
+    matrix = sparse.csr_matrix((shares, (rows, columns)), shape=(n_rows, n_accounts))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def random_group(
+    n_transactions: int, n_accounts: int, items_per_transaction: float, seed: int
+) -> GroupShares:
+    rng = np.random.default_rng(seed)
+    n_items = int(n_transactions * items_per_transaction)
+    return GroupShares(
+        account_ids=np.arange(n_accounts),
+        transaction_ids=np.arange(n_transactions),
+        values=rng.uniform(1, 500, size=n_transactions),
+        currency_conversion_rates=rng.choice([1.0, 1.1, 0.9], size=n_transactions),
+        creditor_shares=random_shares(rng, n_transactions, n_accounts, 1),
+        debitor_shares=random_shares(rng, n_transactions, n_accounts, 8),
+        item_transactions=np.sort(rng.integers(0, n_transactions, size=n_items)),
+        item_prices=rng.uniform(0.1, 10, size=n_items),
+        item_communist_shares=rng.integers(0, 2, size=n_items).astype(np.float64),
+        item_usages=random_shares(rng, n_items, n_accounts, 3),
+    )
+
+
+def measure(func, repetitions: int):
+    """average time in milliseconds of a function call and its last result"""
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        result = func()
+    return (time.perf_counter() - start) / repetitions * 1e3, result
+
+
+def main(
+    transactions: list[int],
+    accounts: int,
+    items_per_transaction: float,
+    repetitions: int,
+    seed: int,
+):
+    print(
+        f"{'transactions':>12} {'accounts':>9} {'effects [ms]':>13} {'balances [ms]':>14} "
+        f"{'breakdown [ms]':>15} {'debts [ms]':>11}"
+    )
+    for n_transactions in transactions:
+        shares = random_group(n_transactions, accounts, items_per_transaction, seed)
+        effects_time, effects = measure(lambda: BalanceEffects(shares), repetitions)
+        balances_time, _ = measure(effects.account_balances, repetitions)
+        breakdown_time, _ = measure(
+            lambda: effects.transaction_breakdown(n_transactions // 2), repetitions
+        )
+        debts_time, _ = measure(effects.pairwise_debts, repetitions)
+        print(
+            f"{n_transactions:>12} {accounts:>9} {effects_time:>13.1f} {balances_time:>14.1f} "
+            f"{breakdown_time:>15.2f} {debts_time:>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Balance engine benchmark",
+        description="Measure the balance engine on groups with random transactions",
+    )
+    parser.add_argument(
+        "--transactions", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--items-per-transaction", type=float, default=2.0)
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(
+        transactions=args.transactions,
+        accounts=args.accounts,
+        items_per_transaction=args.items_per_transaction,
+        repetitions=args.repetitions,
+        seed=args.seed,
+    )
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import json
+import time
+
+from abrechnung.http.utils import encode_json
+from abrechnung.http.websocket import Notification, encode_messages
+
+NOTIFICATION_DATA = {
+    "subscription_type": "transaction",
+    "element_id": 1,
+    "transaction_id": 1234,
+}
+
+
+def fan_out_per_connection(queues: list[asyncio.Queue]):
+    """the previous behaviour, every connection gets its own message which is encoded by its tx task"""
+    for queue in queues:
+        queue.put_nowait({"type": "notification", "data": dict(NOTIFICATION_DATA)})
+    for queue in queues:
+        msg = json.dumps(queue.get_nowait(), default=encode_json) + "\n"
+        del msg
+
+
+def fan_out_encoded_once(queues: list[asyncio.Queue]):
+    """the notification is encoded once and the same object is put on all queues"""
+    message = Notification.encode(dict(NOTIFICATION_DATA))
+    for queue in queues:
+        queue.put_nowait(message)
+    for queue in queues:
+        frames = encode_messages([queue.get_nowait()])
+        del frames
+
+
+def measure(func, n_connections: int, n_notifications: int) -> float:
+    """average time in microseconds it takes to fan out a single notification"""
+    queues = [asyncio.Queue() for _ in range(n_connections)]
+    start = time.perf_counter()
+    for _ in range(n_notifications):
+        func(queues)
+    return (time.perf_counter() - start) / n_notifications * 1e6
+
+
+def main(connections: list[int], notifications: int):
+    print(
+        f"{'connections':>12} {'per connection [us]':>20} {'encoded once [us]':>18} {'speedup':>8}"
+    )
+    for n_connections in connections:
+        per_connection = measure(fan_out_per_connection, n_connections, notifications)
+        encoded_once = measure(fan_out_encoded_once, n_connections, notifications)
+        print(
+            f"{n_connections:>12} {per_connection:>20.1f} {encoded_once:>18.1f} "
+            f"{per_connection / encoded_once:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Notification fan-out benchmark",
+        description="Measure the cost of delivering one notification to a number of websocket connections",
+    )
+    parser.add_argument(
+        "--connections", type=int, nargs="+", default=[1, 10, 100, 1000]
+    )
+    parser.add_argument("--notifications", type=int, default=1000)
+    args = parser.parse_args()
+    main(connections=args.connections, notifications=args.notifications)
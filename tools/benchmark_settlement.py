@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+
+from abrechnung.application.settlement import (
+    EXACT_SETTLEMENT_MAX_ACCOUNTS,
+    plan_settlement,
+)
+
+
+def random_balances(n_accounts: int, seed: int) -> dict[int, float]:
+    """random balances in cents of n accounts which sum up to zero"""
+    rng = random.Random(seed)
+    cents = [rng.randint(-100000, 100000) for _ in range(n_accounts - 1)]
+    cents.append(-sum(cents))
+    return {account_id: value / 100 for account_id, value in enumerate(cents)}
+
+
+def measure(balances: dict[int, float], exact: bool, repetitions: int):
+    """average time in milliseconds it takes to plan a settlement and the number of transfers"""
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        settlement = plan_settlement(balances, change_seq=0, exact=exact)
+    elapsed = (time.perf_counter() - start) / repetitions * 1e3
+    return elapsed, len(settlement.transfers)
+
+
+def main(accounts: list[int], repetitions: int, seed: int):
+    print(f"{'accounts':>9} {'mode':>7} {'time [ms]':>10} {'transfers':>10}")
+    for n_accounts in accounts:
+        balances = random_balances(n_accounts, seed)
+        modes = [False]
+        if n_accounts <= EXACT_SETTLEMENT_MAX_ACCOUNTS:
+            modes.append(True)
+        for exact in modes:
+            elapsed, n_transfers = measure(balances, exact, repetitions)
+            mode = "exact" if exact else "greedy"
+            print(f"{n_accounts:>9} {mode:>7} {elapsed:>10.2f} {n_transfers:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Settlement benchmark",
+        description="Measure the time it takes to plan the settlement of groups with random balances",
+    )
+    parser.add_argument(
+        "--accounts",
+        type=int,
+        nargs="+",
+        default=[8, EXACT_SETTLEMENT_MAX_ACCOUNTS, 500, 1000, 5000, 20000],
+    )
+    parser.add_argument("--repetitions", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(accounts=args.accounts, repetitions=args.repetitions, seed=args.seed)
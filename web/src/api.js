@@ -334,6 +334,27 @@ export async function fetchTransactions({groupID}) {
     return resp.data;
 }
 
+export async function fetchTransactionsPage({groupID, cursor = null, limit = 50, filters = {}}) {
+    const params = new URLSearchParams({limit: limit, ...filters});
+    if (cursor !== null) {
+        params.set("cursor", cursor);
+    }
+    const resp = await makeGet(`/groups/${groupID}/transactions?${params.toString()}`);
+    return resp.data;
+}
+
+export async function fetchTransactionChanges({groupID, since = 0}) {
+    const resp = await makeGet(`/groups/${groupID}/transactions?since=${since}`);
+    return resp.data;
+}
+
+// the current change sequence number of a group, asking for changes after the largest possible one returns no
+// transactions
+export async function fetchTransactionChangeSeq({groupID}) {
+    const changes = await fetchTransactionChanges({groupID: groupID, since: Number.MAX_SAFE_INTEGER});
+    return changes.change_seq;
+}
+
 export async function createTransaction({
                                             groupID,
                                             type,
@@ -1,28 +1,58 @@
 // transaction handling
 import { atomFamily, selectorFamily } from "recoil";
 import { groupAccounts } from "./groups";
-import { fetchTransactions } from "../api";
+import { fetchTransactionChangeSeq, fetchTransactionChanges, fetchTransactions } from "../api";
 import { ws } from "../websocket";
 import { userData } from "./auth";
 import { DateTime } from "luxon";
 
+// last seen change sequence number per group, used to only fetch changed transactions
+const groupChangeSeq = {};
+
+const mergeTransactionChanges = (transactions, changes) => {
+    const changedIDs = new Set([
+        ...changes.transactions.map(transaction => transaction.id),
+        ...changes.deleted_transactions
+    ]);
+    return transactions
+        .filter(transaction => !changedIDs.has(transaction.id))
+        .concat(changes.transactions);
+};
+
 export const groupTransactions = atomFamily({
     key: "groupTransactions",
     default: selectorFamily({
         key: "groupTransactions/default",
         get: groupID => async ({ get }) => {
+            // the sequence number is taken before loading the list, changes in between are fetched again
+            groupChangeSeq[groupID] = await fetchTransactionChangeSeq({ groupID: groupID });
             return await fetchTransactions({ groupID: groupID });
         }
     }),
     effects_UNSTABLE: groupID => [
         ({ setSelf, trigger }) => {
-            ws.subscribe("transaction", groupID, ({ subscription_type, transaction_id, element_id }) => {
+            ws.subscribe("transaction", groupID, ({ subscription_type, transaction_id, element_id, transaction }) => {
                 if (subscription_type === "transaction" && element_id === groupID) {
-                    fetchTransactions({ groupID: element_id }).then(result => {
-                        setSelf(result);
+                    if (transaction !== undefined) {
+                        // the notification carries the changed transaction, no need to ask the server
+                        setSelf(transactions => mergeTransactionChanges(transactions, {
+                            transactions: [transaction],
+                            deleted_transactions: []
+                        }));
+                        return;
+                    }
+                    fetchTransactionChanges({
+                        groupID: element_id,
+                        since: groupChangeSeq[element_id] ?? 0
+                    }).then(changes => {
+                        if (changes.change_seq <= (groupChangeSeq[element_id] ?? 0)) {
+                            return; // we already know about this change
+                        }
+                        groupChangeSeq[element_id] = changes.change_seq;
+                        setSelf(transactions => mergeTransactionChanges(transactions, changes));
                     });
                 }
-            });
+            }, true);
             // TODO: handle registration errors
 
             return () => {
@@ -8,7 +8,7 @@ console.log(URL)
 export class SFTWebsocket {
     constructor(url) {
         this.url = url;
-        // subscription_type -> callback
+        // "subscription_type:element_id" -> handler
         this.notificationHandlers = {}
 
         this.ws = new WebSocket(this.url);
@@ -29,12 +29,29 @@ export class SFTWebsocket {
     }
     onopen = () => {
         console.log("WS Connected");
+        // the connection is authenticated once, all following messages are sent without token
+        this.authenticate();
         while (this.msgQueue.length > 0) {
             this.send(this.msgQueue.pop());
         }
-        Object.entries(this.notificationHandlers).forEach(([subscriptionType, values]) => {
-            this.sendSubscriptionRequest(subscriptionType, values["elementID"]);
-        })
+        // subscriptions are resumed after the last change we have seen such that we only receive what we missed
+        const subscriptions = Object.values(this.notificationHandlers).map((values) => {
+            const subscription = {
+                subscription_type: values["subscriptionType"],
+                element_id: values["elementID"],
+                with_payload: values["withPayload"]
+            };
+            if (values["lastSeq"] !== null) {
+                subscription.last_seq = values["lastSeq"];
+            }
+            return subscription;
+        });
+        if (subscriptions.length > 0) {
+            this.send({
+                type: "subscribe_many",
+                data: {subscriptions: subscriptions}
+            });
+        }
     }
     onclose = () => {
         console.log("WS Disconnected");
@@ -46,16 +63,49 @@ export class SFTWebsocket {
         // TODO: message format validation
         if (msg.type === "error") {
             console.log("WS Received error: ", msg.data);
+        } else if (msg.type === "authentication_expired") {
+            console.log("WS authentication expired, authenticating again");
+            this.authenticate();
+        } else if (msg.type === "subscribe_success") {
+            this.handleSubscription(msg.data);
+        } else if (msg.type === "subscribe_many_success") {
+            msg.data.subscriptions.forEach(this.handleSubscription);
         } else if (msg.type === "notification") {
             console.log("received notification", msg);
-            const subscriptionType = msg.data.subscription_type;
-            if (this.notificationHandlers.hasOwnProperty(subscriptionType)) {
-                this.notificationHandlers[subscriptionType].func(msg.data)
-            }
+            this.handleNotification(msg.data);
+        } else if (msg.type === "notification_batch") {
+            console.log("received notification batch", msg);
+            msg.data.forEach(this.handleNotification);
         } else {
             console.log("WS received unhandled message", msg);
         }
     }
+    handlerKey = (subscriptionType, elementID) => {
+        return `${subscriptionType}:${elementID}`;
+    }
+    handleNotification = (notification) => {
+        const key = this.handlerKey(notification.subscription_type, notification.element_id);
+        if (this.notificationHandlers.hasOwnProperty(key)) {
+            const handler = this.notificationHandlers[key];
+            if (notification.seq !== undefined) {
+                if (handler.lastSeq !== null && notification.seq <= handler.lastSeq) {
+                    return; // already delivered by a previous notification
+                }
+                handler.lastSeq = notification.seq;
+            }
+            handler.func(notification)
+        }
+    }
+    handleSubscription = (subscription) => {
+        // the changes we missed are no longer available, let the handler fetch everything again
+        const key = this.handlerKey(subscription.subscription_type, subscription.element_id);
+        if (subscription.resync && this.notificationHandlers.hasOwnProperty(key)) {
+            this.notificationHandlers[key].func({
+                subscription_type: subscription.subscription_type,
+                element_id: subscription.element_id
+            });
+        }
+    }
     send = (msg) => {
         if (this.ws.readyState !== 1) {
             this.msgQueue.push(msg);
@@ -65,29 +115,41 @@ export class SFTWebsocket {
         }
     }
 
-    sendSubscriptionRequest = (subscriptionType, elementID) => {
+    authenticate = () => {
+        return this.send({
+            type: "authenticate",
+            data: {
+                token: fetchToken()
+            }
+        });
+    }
+
+    sendSubscriptionRequest = (subscriptionType, elementID, withPayload = false) => {
         return this.send({
             type: "subscribe",
-            token: fetchToken(),
             data: {
                 subscription_type: subscriptionType,
-                element_id: elementID
+                element_id: elementID,
+                with_payload: withPayload
             }
         });
     }
 
-    subscribe = (subscriptionType, elementID, func) => {
-        this.notificationHandlers[subscriptionType] = {
+    // with withPayload set notifications include the changed element if the subscription type supports it.
+    subscribe = (subscriptionType, elementID, func, withPayload = false) => {
+        this.notificationHandlers[this.handlerKey(subscriptionType, elementID)] = {
             subscriptionType: subscriptionType,
             elementID: elementID,
-            func: func
+            func: func,
+            withPayload: withPayload,
+            lastSeq: null
         };
-        return this.sendSubscriptionRequest(subscriptionType, elementID)
+        return this.sendSubscriptionRequest(subscriptionType, elementID, withPayload)
     }
     unsubscribe = (subscriptionType, elementID) => {
+        delete this.notificationHandlers[this.handlerKey(subscriptionType, elementID)];
         return this.send({
             type: "unsubscribe",
-            token: fetchToken(),
             data: {
                 subscription_type: subscriptionType,
                 element_id: elementID